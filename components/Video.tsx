@@ -6,8 +6,14 @@ import {
   RTCPeerConnection,
   RTCSessionDescription
 } from 'react-native-webrtc';
+import { encodeControlFrame, FLAG_RESET } from '../utils/controlFrame';
 
  // Match robot WebSocket server port
+// Ask the robot to batch trickle ICE candidates into one message per tick
+const HELLO = 'HELLO ' + JSON.stringify({ batch: true });
+// Reconnect backoff after the websocket drops; the robot keeps the session for its grace period
+const RECONNECT_DELAYS_MS = [250, 500, 1000, 2000, 4000];
+
 const configuration = {
   iceServers: [{ urls: 'stun:stun.l.google.com:19302' }], // Optional but recommended
 };
@@ -19,12 +25,27 @@ interface VideoProps {
   setLocalStream: (stream: any) => void;
   call: boolean;
   signalingUrl: string;
+  payload?: string | null;
+  simStop?: number;
 }
 
-export default function VideoScreen({ setStream, vector, setIsConnected, setLocalStream, call, signalingUrl }: VideoProps) {
+export default function VideoScreen({ setStream, vector, setIsConnected, setLocalStream, call, signalingUrl, payload, simStop }: VideoProps) {
   const pc = useRef<RTCPeerConnection | null>(null);
   const ws = useRef<WebSocket | null>(null);
-  const dataChannel = useRef<RTCDataChannel | null>(null);
+  // Robot-opened channels by label: 'velocity' (unordered, no retransmits),
+  // 'commands' (reliable) and the legacy 'chat'
+  const dataChannels = useRef<Record<string, RTCDataChannel>>({});
+  const seq = useRef(0);
+  const commandSeq = useRef(0);
+  // Resumable session ID from the robot; sent back in HELLO after a reconnect
+  const sessionId = useRef<string | null>(null);
+  const reconnectAttempt = useRef(0);
+  const reconnectTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
+  const unmounted = useRef(false);
+  // Resolves once the peer connection that offers should go to exists
+  const pcReady = useRef<Promise<void>>(Promise.resolve());
+  const callRef = useRef(call);
+  callRef.current = call;
   useEffect(() => {
       InCallManager.start({ media: 'audio' });
       InCallManager.setSpeakerphoneOn(true);
@@ -82,23 +103,29 @@ export default function VideoScreen({ setStream, vector, setIsConnected, setLoca
       }
     };
 
+    // Our network changed under the connection (new access point): ask the robot for an ICE restart
+    (pc.current as any).oniceconnectionstatechange = () => {
+      if (pc.current?.iceConnectionState === 'failed' && ws.current?.readyState === WebSocket.OPEN) {
+        ws.current.send(JSON.stringify({ restart: true }));
+      }
+    };
+
     (pc.current as any).ondatachannel = (event: any) => {
       console.log('Data channel received:', event.channel.label);
-      dataChannel.current = event.channel;
+      const channel = event.channel;
+      dataChannels.current[channel.label] = channel;
 
-      if (dataChannel.current) {
-        dataChannel.current.onmessage = (msg: any) => {
-          console.log('Message from robot:', msg.data);
-        };
+      channel.onmessage = (msg: any) => {
+        console.log('Message from robot:', msg.data);
+      };
 
-        dataChannel.current.onopen = () => {
-          console.log('Data channel opened');
-        };
+      channel.onopen = () => {
+        console.log('Data channel opened:', channel.label);
+      };
 
-        dataChannel.current.onclose = () => {
-          console.log('Data channel closed');
-        };
-      }
+      channel.onclose = () => {
+        console.log('Data channel closed:', channel.label);
+      };
     };
   }, [setStream, startLocalStream]);
 
@@ -110,12 +137,31 @@ export default function VideoScreen({ setStream, vector, setIsConnected, setLoca
     ws.current.onopen = () => {
       console.log('WebSocket connected');
       setIsConnected(true);
-      ws.current?.send('HELLO');
+      reconnectAttempt.current = 0;
+      ws.current?.send(hello());
     };
 
     ws.current.onmessage = async (event) => {
       const message = JSON.parse(event.data);
 
+      if (message.session) {
+        if (!message.session.resumed && sessionId.current) {
+          // The robot couldn't resume (or rebuilt the session): start a fresh peer connection
+          console.log('Session not resumed, rebuilding peer connection');
+          pcReady.current = (async () => {
+            cleanup();
+            await setupPeerConnection(callRef.current);
+          })();
+        }
+        sessionId.current = message.session.id;
+        return;
+      }
+      if (message.recovered) {
+        console.log('Session recovered:', message.recovered);
+        return;
+      }
+      await pcReady.current;
+
       if (message.sdp?.type === 'offer') {
         console.log('Received offer');
         const offerDesc = new RTCSessionDescription({
@@ -135,11 +181,12 @@ export default function VideoScreen({ setStream, vector, setIsConnected, setLoca
         }));
       }
 
-      if (message.ice) {
+      const candidates = message.candidates ?? (message.ice ? [message.ice] : []);
+      for (const ice of candidates) {
         try {
           await pc.current?.addIceCandidate({
-            candidate: message.ice.candidate,
-            sdpMLineIndex: message.ice.sdpMLineIndex,
+            candidate: ice.candidate,
+            sdpMLineIndex: ice.sdpMLineIndex,
           });
         } catch (err) {
           console.warn('Error adding ICE candidate:', err);
@@ -154,18 +201,28 @@ export default function VideoScreen({ setStream, vector, setIsConnected, setLoca
     ws.current.onclose = () => {
       console.log('WebSocket connection closed');
       setIsConnected(false);
+      if (unmounted.current) {
+        return;
+      }
+      // Media keeps flowing on the robot; reconnect and resume the same session
+      const delay = RECONNECT_DELAYS_MS[Math.min(reconnectAttempt.current, RECONNECT_DELAYS_MS.length - 1)];
+      reconnectAttempt.current += 1;
+      reconnectTimer.current = setTimeout(setupWebSocket, delay);
     };
   }, [setIsConnected]);
 
+  // HELLO, asking to resume the current session if there is one
+  const hello = () => sessionId.current
+    ? 'HELLO ' + JSON.stringify({ batch: true, resume: sessionId.current })
+    : HELLO;
+
   // Shared cleanup function
   const cleanup = useCallback(() => {
     console.log("Cleaning up WebRTC connection");
-    if(dataChannel.current) {
-      dataChannel.current.close();
-    }
+    Object.values(dataChannels.current).forEach(channel => channel.close());
     pc.current?.getSenders().forEach(sender => sender.track?.stop());
     pc.current?.close();
-    dataChannel.current = null;
+    dataChannels.current = {};
     pc.current = null;
   }, []);
 
@@ -173,6 +230,10 @@ export default function VideoScreen({ setStream, vector, setIsConnected, setLoca
   useEffect(() => {
   
     return () => {
+      unmounted.current = true;
+      if (reconnectTimer.current) {
+        clearTimeout(reconnectTimer.current);
+      }
       cleanup();
     }
   }, [])
@@ -188,7 +249,9 @@ export default function VideoScreen({ setStream, vector, setIsConnected, setLoca
     }
     else{
       console.log("Sending HELLO");
-      ws.current?.send('HELLO');
+      // A new call is a new session, not a resume
+      sessionId.current = null;
+      ws.current?.send(HELLO);
     }
 
   }, [call])
@@ -197,17 +260,56 @@ export default function VideoScreen({ setStream, vector, setIsConnected, setLoca
     renegotiate();
   }, [call]);
 
+  // The channel with this label if it is open, otherwise the legacy one
+  const openChannel = (label: string) => {
+    for (const name of [label, 'chat']) {
+      const channel = dataChannels.current[name];
+      if (channel?.readyState === 'open') {
+        return channel;
+      }
+    }
+    return null;
+  };
+
   // Handle vector updates
   useEffect(() => {
-    const current = JSON.stringify(vector);
-    if (dataChannel.current?.readyState === 'open') {
-      // console.log('Sending vector:', current);
-      dataChannel.current.send(current);
+    const channel = openChannel('velocity');
+    if (channel) {
+      seq.current += 1;
+      channel.send(encodeControlFrame(seq.current, vector));
     }
     else {
       console.log("Data channel not open");
     }
   }, [vector]);
 
+  // Motions and resets must not be lost, so they go on the reliable channel
+  const sendCommand = (motion: string | null, flags: number) => {
+    const commands = dataChannels.current.commands;
+    if (commands?.readyState === 'open') {
+      commandSeq.current += 1;
+      commands.send(encodeControlFrame(commandSeq.current, { x: 0, y: 0, z: 0 }, motion, flags));
+      return;
+    }
+    // Older robots only have 'chat', where this is just another velocity frame
+    const channel = openChannel('chat');
+    if (channel) {
+      seq.current += 1;
+      channel.send(encodeControlFrame(seq.current, vector, motion, flags));
+    }
+  };
+
+  useEffect(() => {
+    if (payload) {
+      sendCommand(payload, 0);
+    }
+  }, [payload]);
+
+  useEffect(() => {
+    if (simStop) {
+      sendCommand(null, FLAG_RESET);
+    }
+  }, [simStop]);
+
   return null; // This component just handles signaling & WebRTC
 }
\ No newline at end of file
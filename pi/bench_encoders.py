@@ -0,0 +1,90 @@
+"""Per-frame encode time and CPU for each usable encoder backend.
+
+Feeds the same videotestsrc clip through every backend found by
+encoders.available_encoders() and prints one JSON line per backend.
+
+    python3 pi/bench_encoders.py [--frames 300] [--width 640 --height 480]
+"""
+import argparse
+import json
+import statistics
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+Gst.init(None)
+
+from encoders import BACKENDS, available_encoders
+
+
+def bench(backend, frames, width, height, fps):
+    desc = (
+        f"videotestsrc num-buffers={frames} pattern=ball ! "
+        f"video/x-raw,format=I420,width={width},height={height},framerate={fps}/1 ! "
+        f"{backend.description('enc', 96)} ! fakesink name=sink"
+    )
+    pipe = Gst.parse_launch(desc)
+    enc = pipe.get_by_name("enc")
+    sink = pipe.get_by_name("sink")
+    started = {}
+    encode_ms = []
+    bytes_out = [0]
+
+    def on_enc_sink(pad, info):
+        started[info.get_buffer().pts] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def on_enc_src(pad, info):
+        buf = info.get_buffer()
+        t0 = started.pop(buf.pts, None)
+        if t0 is not None:
+            encode_ms.append((time.perf_counter() - t0) * 1000)
+        return Gst.PadProbeReturn.OK
+
+    def on_sink(pad, info):
+        bytes_out[0] += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    enc.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, on_enc_sink)
+    enc.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, on_enc_src)
+    sink.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, on_sink)
+
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    pipe.set_state(Gst.State.PLAYING)
+    msg = pipe.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+    pipe.set_state(Gst.State.NULL)
+    if msg.type == Gst.MessageType.ERROR:
+        err, _ = msg.parse_error()
+        return {"encoder": backend.name, "error": err.message}
+
+    encode_ms.sort()
+    return {
+        "encoder": backend.name,
+        "frames": len(encode_ms),
+        "encode_ms_mean": round(statistics.mean(encode_ms), 3),
+        "encode_ms_p50": round(encode_ms[len(encode_ms) // 2], 3),
+        "encode_ms_p99": round(encode_ms[int(len(encode_ms) * 0.99) - 1], 3),
+        "cpu_s_per_frame": round(cpu / frames, 5),
+        "cpu_pct_at_realtime": round(cpu / frames * fps * 100, 1),
+        "encode_fps": round(frames / wall, 1),
+        "kbps_at_realtime": round(bytes_out[0] * 8 / (frames / fps) / 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--encoders", nargs="*", help="default: every available backend")
+    args = parser.parse_args()
+    for name in args.encoders or available_encoders():
+        print(json.dumps(bench(BACKENDS[name], args.frames, args.width, args.height, args.fps)))
+
+
+if __name__ == "__main__":
+    main()
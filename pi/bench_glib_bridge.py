@@ -0,0 +1,105 @@
+"""Compare the old 10 ms GLib polling task against GLibBridge.
+
+Measures how long a GLib source fired from another thread (the way webrtcbin
+raises on-ice-candidate / on-data-channel) waits before its callback runs and
+the result reaches asyncio, plus CPU burned while nothing is happening.
+
+    python3 pi/bench_glib_bridge.py [--samples 200] [--idle 5]
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import threading
+import time
+
+import gi
+gi.require_version('GLib', '2.0')
+from gi.repository import GLib
+
+from glib_bridge import GLibBridge
+
+
+async def glib_poll_loop():
+    # The loop the servers used before GLibBridge
+    while True:
+        while GLib.main_context_default().iteration(False):
+            pass
+        await asyncio.sleep(0.01)
+
+
+def summarize(samples_ms):
+    samples_ms = sorted(samples_ms)
+    return {
+        "mean_ms": round(statistics.mean(samples_ms), 3),
+        "p50_ms": round(samples_ms[len(samples_ms) // 2], 3),
+        "p99_ms": round(samples_ms[int(len(samples_ms) * 0.99) - 1], 3),
+        "max_ms": round(samples_ms[-1], 3),
+    }
+
+
+async def measure_dispatch(loop, samples):
+    """Fire GLib idle sources from a worker thread and time the round trip to asyncio."""
+    glib_delays = []
+    asyncio_delays = []
+    done = asyncio.Event()
+
+    def on_asyncio(t0):
+        asyncio_delays.append((time.perf_counter() - t0) * 1000)
+        if len(asyncio_delays) == samples:
+            done.set()
+
+    def on_glib(t0):
+        glib_delays.append((time.perf_counter() - t0) * 1000)
+        loop.call_soon_threadsafe(on_asyncio, t0)
+        return GLib.SOURCE_REMOVE
+
+    def producer():
+        for _ in range(samples):
+            time.sleep(random.uniform(0.002, 0.02))
+            GLib.idle_add(on_glib, time.perf_counter())
+
+    threading.Thread(target=producer, daemon=True).start()
+    await done.wait()
+    return {"glib_dispatch": summarize(glib_delays), "to_asyncio": summarize(asyncio_delays)}
+
+
+async def measure_idle_cpu(seconds):
+    cpu0 = time.process_time()
+    await asyncio.sleep(seconds)
+    return {"idle_cpu_pct": round((time.process_time() - cpu0) / seconds * 100, 2)}
+
+
+async def run_mode(mode, samples, idle):
+    loop = asyncio.get_running_loop()
+    if mode == "poll":
+        task = asyncio.create_task(glib_poll_loop())
+        bridge = None
+    else:
+        task = None
+        bridge = GLibBridge(loop)
+        bridge.start()
+    try:
+        result = {"mode": mode}
+        result.update(await measure_idle_cpu(idle))
+        result.update(await measure_dispatch(loop, samples))
+        return result
+    finally:
+        if task:
+            task.cancel()
+        if bridge:
+            bridge.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--idle", type=float, default=5.0)
+    args = parser.parse_args()
+    for mode in ("poll", "bridge"):
+        print(json.dumps(await run_mode(mode, args.samples, args.idle)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,276 @@
+"""Per-stage latency, CPU and memory for each WebRTCServer variant on loopback.
+
+Each variant is started with KSCALE_VIDEO_SOURCE=test (videotestsrc instead
+of the cameras; --source file replays a pre-decoded clip for realistic
+encoder load) and KSCALE_LATENCY_TRACE pointing at a temp file. A
+headless WebRTCClient receives and decodes the video. Server probe times
+(captured, encoded, payloaded) are joined with the client's (received,
+decoded) on the RTP timestamp; both sides use CLOCK_MONOTONIC on the same
+host.
+
+dual_video runs twice: as two streams and with KSCALE_STEREO=sbs as one
+composited stream. "eye_skew" is the capture time difference between the
+left and right image a viewer sees together: for two streams, the latest
+decoded frame of each track at every decode; for stereo, the two halves of
+each composited frame.
+
+vid_only_simulcast encodes three layers once (simulcast.py); with
+--viewers N every variant serves N clients at once, and when its baseline
+ran too a comparison line sets the layered server's CPU against the
+single encode and against N times it, the cost of one encode per viewer
+(an upper bound, since capture and pacing are counted N times as well).
+Per-stage latencies are not traced for the layered variant, whose
+payloaders are per peer.
+
+Prints one JSON object per variant, or writes them all to --out so results
+can be diffed between commits.
+
+    python3 pi/bench_latency.py [--variants vid_only dual_video] [--duration 20] [--profile teleop-min] [--viewers 4] [--out results.json]
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+Gst.init(None)
+
+from client import WebRTCClient
+from glib_bridge import GLibBridge
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# name: (script, video streams, extra environment)
+VARIANTS = {
+    "vid_only": ("vid_only.py", 1, {}),
+    "bi-directional": ("bi-directional.py", 1, {}),
+    "dual_video": ("dual_video.py", 2, {}),
+    "dual_video_stereo": ("dual_video.py", 1, {"KSCALE_STEREO": "sbs"}),
+    "vid_only_simulcast": ("vid_only.py", 1, {"KSCALE_SIMULCAST": "3"}),
+}
+# Layered variant -> the single shared encode it is compared against
+SIMULCAST_BASELINES = {"vid_only_simulcast": "vid_only"}
+PORT = 8765
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+# (name, start stage, end stage); stages come from the server trace then the client probe
+STAGES = [
+    ("capture_to_encoded", "captured", "encoded"),
+    ("encode_in_to_encoded", "encode_in", "encoded"),
+    ("encoded_to_payloaded", "encoded", "payloaded"),
+    ("payloaded_to_received", "payloaded", "received"),
+    ("received_to_decoded", "received", "decoded"),
+    ("payloaded_to_decoded", "payloaded", "decoded"),
+    ("capture_to_decoded", "captured", "decoded"),
+]
+
+
+def summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    n = len(values)
+    return {
+        "n": n,
+        "mean_ms": round(statistics.mean(values), 3),
+        "p50_ms": round(values[n // 2], 3),
+        "p95_ms": round(values[min(n - 1, int(n * 0.95))], 3),
+        "max_ms": round(values[-1], 3),
+    }
+
+
+def proc_usage(pid):
+    """(cpu seconds, rss kB) for pid from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK
+    rss = 0
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+    return cpu, rss
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def join_frames(trace_path, probes):
+    """Merge server trace records with client probe times on RTP timestamp."""
+    server = {}
+    with open(trace_path) as f:
+        for line in f:
+            record = json.loads(line)
+            server.setdefault(record["branch"], {})[record["rtp_ts"]] = record
+    frames = []
+    for probe in probes:
+        # Each client track maps to whichever server branch shares its RTP timestamps
+        best = max(server.values(), key=lambda recs: len(recs.keys() & probe.decoded.keys()), default={})
+        for rtp_ts, decoded in probe.decoded.items():
+            record = best.get(rtp_ts)
+            if record and rtp_ts in probe.received:
+                frame = dict(record)
+                frame["received"] = probe.received[rtp_ts]
+                frame["decoded"] = decoded
+                frames.append(frame)
+    return frames
+
+
+def eye_skew(frames):
+    """Capture time difference (ms) between the two eyes shown together."""
+    stereo = [f["eye_skew_ms"] for f in frames if "eye_skew_ms" in f]
+    if stereo:
+        return summarize(stereo)
+    by_branch = {}
+    for f in frames:
+        if "captured" in f:
+            by_branch.setdefault(f["branch"], []).append(f)
+    if len(by_branch) != 2:
+        return None
+    left, right = (sorted(fs, key=lambda f: f["decoded"]) for fs in by_branch.values())
+    right_decoded = [f["decoded"] for f in right]
+    skews = []
+    for f in left:
+        # Newest right-eye frame already on screen when this left-eye frame is decoded
+        i = bisect.bisect_right(right_decoded, f["decoded"]) - 1
+        if i >= 0:
+            skews.append(abs(f["captured"] - right[i]["captured"]) * 1000)
+    return summarize(skews)
+
+
+async def run_clients(duration, warmup, viewers=1):
+    loop = asyncio.get_running_loop()
+    bridge = GLibBridge(loop)
+    bridge.start()
+    clients = [WebRTCClient(f"ws://127.0.0.1:{PORT}", name=f"bench{i}") for i in range(viewers)]
+    try:
+        await asyncio.gather(*(client.run(duration + warmup) for client in clients))
+    finally:
+        bridge.stop()
+    return clients
+
+
+def bench_variant(name, duration, warmup, encoder, profile=None, source="test", viewers=1):
+    script, streams, extra_env = VARIANTS[name]
+    trace = tempfile.NamedTemporaryFile(prefix=f"trace-{name}-", suffix=".jsonl", delete=False)
+    trace.close()
+    env = dict(os.environ, KSCALE_VIDEO_SOURCE=source, KSCALE_LATENCY_TRACE=trace.name, **extra_env)
+    if encoder:
+        env["KSCALE_ENCODER"] = encoder
+    if profile:
+        env["KSCALE_LATENCY_PROFILE"] = profile
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, script)], cwd=HERE, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(PORT):
+            return {"variant": name, "error": "server did not start"}
+        cpu0, _ = proc_usage(server.pid)
+        t0 = time.monotonic()
+        clients = asyncio.run(run_clients(duration, warmup, viewers))
+        cpu1, rss = proc_usage(server.pid)
+        wall = time.monotonic() - t0
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    # Latency comes from the first viewer; the others only add load. Counts below are per viewer
+    frames = join_frames(trace.name, clients[0].probes)
+    os.unlink(trace.name)
+    # Drop the warm-up period (connection setup, first keyframe)
+    if frames:
+        cutoff = min(f["decoded"] for f in frames) + warmup
+        frames = [f for f in frames if f["decoded"] >= cutoff]
+    stages = {}
+    for stage, start, end in STAGES:
+        stages[stage] = summarize([(f[end] - f[start]) * 1000 for f in frames if start in f and end in f])
+    probes = [p for client in clients for p in client.probes]
+    decoded = sum(p.frames for p in probes) / viewers
+    received_bytes = sum(p.bytes for p in probes) / viewers
+    return {
+        "variant": name,
+        "encoder": encoder or "auto",
+        "latency_profile": profile or "default",
+        "video_source": source,
+        "streams": streams,
+        "viewers": viewers,
+        "duration_s": round(wall, 2),
+        "frames_joined": len(frames),
+        "frames_decoded": round(decoded),
+        "decoded_fps_per_stream": round(decoded / wall / streams, 2) if streams else 0,
+        "server_cpu_pct": round((cpu1 - cpu0) / wall * 100, 1),
+        "server_cpu_pct_per_stream": round((cpu1 - cpu0) / wall * 100 / streams, 1),
+        "server_rss_kb": rss,
+        "server_rss_kb_per_stream": rss // streams,
+        "video_kbps": round(received_bytes * 8 / wall / 1000, 1),
+        "eye_skew": eye_skew(frames),
+        "stages": stages,
+    }
+
+
+def simulcast_comparisons(results):
+    """Server CPU of each layered variant against its single encode and one encode per viewer."""
+    by_name = {r["variant"]: r for r in results if "error" not in r}
+    comparisons = []
+    for layered, single in SIMULCAST_BASELINES.items():
+        if layered not in by_name or single not in by_name:
+            continue
+        viewers = by_name[layered]["viewers"]
+        single_cpu = by_name[single]["server_cpu_pct"]
+        layered_cpu = by_name[layered]["server_cpu_pct"]
+        comparisons.append({
+            "comparison": f"{layered} vs {single}",
+            "viewers": viewers,
+            "layered_cpu_pct": layered_cpu,
+            "single_encode_cpu_pct": single_cpu,
+            "encode_per_viewer_cpu_pct": round(single_cpu * viewers, 1),
+            "layered_vs_per_viewer": round(layered_cpu / (single_cpu * viewers), 2) if single_cpu else None,
+        })
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--variants", nargs="*", default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--encoder", help="KSCALE_ENCODER for the servers (default auto)")
+    parser.add_argument("--source", choices=["test", "file"], default="test",
+                        help="KSCALE_VIDEO_SOURCE for the servers (file: KSCALE_VIDEO_FILE, see file_source.py)")
+    parser.add_argument("--profile", help="KSCALE_LATENCY_PROFILE for the servers (default balanced)")
+    parser.add_argument("--viewers", type=int, default=1, help="clients connected at once")
+    parser.add_argument("--out", help="write all results as a JSON list to this file")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.variants:
+        result = bench_variant(name, args.duration, args.warmup, args.encoder, args.profile, args.source,
+                               args.viewers)
+        print(json.dumps(result))
+        results.append(result)
+    comparisons = simulcast_comparisons(results)
+    for comparison in comparisons:
+        print(json.dumps(comparison))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"timestamp": time.time(), "results": results, "comparisons": comparisons}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Recovery time for each path a session can take after a network blip, against one running server.
+
+One headless WebRTCClient connects and receives video, then each round
+goes through the three paths:
+
+  resume       drop the websocket, reconnect with HELLO {"resume": id};
+               media should keep flowing through the gap
+  ice_restart  ask for an ICE restart as a client would when its network
+               changes ({"restart": true})
+  rebuild      reconnect with an expired session ID, forcing a fresh
+               webrtcbin on both sides
+
+For each path it reports the server's own measurement (sent back as
+{"recovered": ...}), the client's wall time from the blip to the
+recovery, and for resume how many frames were decoded while signaling
+was down.
+
+    python3 pi/bench_recovery.py --url ws://robot.local:8765 --rounds 5 [--gap 1.0] [--out recovery.json]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import websockets
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+Gst.init(None)
+
+from bench_latency import summarize
+from client import WebRTCClient
+from glib_bridge import GLibBridge
+
+POLL = 0.01
+TIMEOUT = 30.0
+
+
+async def wait_until(predicate, timeout=TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        await asyncio.sleep(POLL)
+
+
+def frames(client):
+    return sum(p.frames for p in client.probes)
+
+
+class RecoveryBench:
+    def __init__(self, url, gap):
+        self.url = url
+        self.gap = gap
+        self.client = WebRTCClient(url, name="recovery", keep_frames=False)
+        self.ws = None
+        self.reader = None
+        self.results = {"resume": [], "ice_restart": [], "rebuild": []}
+
+    async def connect(self, resume=None):
+        options = dict(self.client.options)
+        if resume:
+            options["resume"] = resume
+        self.ws = await websockets.connect(self.url)
+        self.client.ws = self.ws
+        await self.ws.send('HELLO ' + json.dumps(options))
+        self.reader = asyncio.create_task(self.receive(self.ws))
+
+    async def receive(self, ws):
+        try:
+            async for message in ws:
+                self.client.handle_server_message(message)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def drop(self):
+        await self.ws.close()
+        await self.reader
+        self.client.ws = None
+
+    async def server_report(self, path, count):
+        await wait_until(lambda: sum(r["path"] == path for r in self.client.recoveries) > count)
+        return [r for r in self.client.recoveries if r["path"] == path][-1]["ms"]
+
+    def count(self, path):
+        return sum(r["path"] == path for r in self.client.recoveries)
+
+    async def resume(self):
+        client = self.client
+        before = self.count("resume")
+        t0 = time.monotonic()
+        await self.drop()
+        frames_at_drop = frames(client)
+        await asyncio.sleep(self.gap)
+        frames_in_gap = frames(client) - frames_at_drop
+        client.resumed = False
+        await self.connect(resume=client.session_id)
+        await wait_until(lambda: client.resumed)
+        wall = time.monotonic() - t0
+        server_ms = await self.server_report("resume", before)
+        self.results["resume"].append({"server_ms": server_ms, "client_ms": round(wall * 1000, 1),
+                                       "frames_in_gap": frames_in_gap})
+
+    async def ice_restart(self):
+        before = self.count("ice_restart")
+        t0 = time.monotonic()
+        await self.ws.send(json.dumps({"restart": True}))
+        server_ms = await self.server_report("ice_restart", before)
+        self.results["ice_restart"].append({"server_ms": server_ms,
+                                            "client_ms": round((time.monotonic() - t0) * 1000, 1)})
+
+    async def rebuild(self):
+        client = self.client
+        before = self.count("rebuild")
+        t0 = time.monotonic()
+        await self.drop()
+        await asyncio.sleep(self.gap)
+        old_id = client.session_id
+        await self.connect(resume="expired-" + old_id)
+        # A new pipeline means new probes; wait for its first decoded frame
+        await wait_until(lambda: client.session_id != old_id and frames(client) > 0)
+        wall = time.monotonic() - t0
+        server_ms = await self.server_report("rebuild", before)
+        self.results["rebuild"].append({"server_ms": server_ms, "client_ms": round(wall * 1000, 1)})
+
+    async def run(self, rounds):
+        client = self.client
+        client.loop = asyncio.get_running_loop()
+        client.start_pipeline()
+        try:
+            await self.connect()
+            await wait_until(lambda: frames(client) > 0)
+            for i in range(rounds):
+                for step in (self.resume, self.ice_restart, self.rebuild):
+                    try:
+                        await step()
+                    except TimeoutError:
+                        self.results[step.__name__].append({"error": "timeout"})
+                    await wait_until(lambda: frames(client) > 0)
+                    await asyncio.sleep(1.0)
+                print(f"Round {i + 1}/{rounds} done")
+        finally:
+            if self.ws:
+                await self.ws.close()
+            client.close()
+
+    def summary(self):
+        out = {}
+        for path, runs in self.results.items():
+            ok = [r for r in runs if "error" not in r]
+            out[path] = {
+                "runs": len(runs),
+                "failed": len(runs) - len(ok),
+                "server": summarize([r["server_ms"] for r in ok]),
+                "client": summarize([r["client_ms"] for r in ok]),
+            }
+            if path == "resume":
+                out[path]["frames_in_gap"] = [r["frames_in_gap"] for r in ok]
+        return out
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="ws://127.0.0.1:8765")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--gap", type=float, default=1.0, help="seconds the websocket stays down")
+    parser.add_argument("--out", help="write per-run results and the summary to this JSON file")
+    args = parser.parse_args()
+
+    bridge = GLibBridge(asyncio.get_running_loop())
+    bridge.start()
+    bench = RecoveryBench(args.url, args.gap)
+    try:
+        await bench.run(args.rounds)
+    finally:
+        bridge.stop()
+    summary = bench.summary()
+    print(json.dumps(summary, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"timestamp": time.time(), "runs": bench.results, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,234 @@
+import json
+import os
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+from gi.repository import Gst, GstWebRTC, GLib
+
+ABR_INTERVAL_MS = 1000
+ABR_LOG = os.environ.get("KSCALE_ABR_LOG")  # optional JSON-lines file of every decision
+
+# Capture ladder, best first: (width, height, fps, min_kbps, max_kbps)
+LADDER = [
+    (640, 480, 30, 600, 2500),
+    (640, 480, 15, 300, 1200),
+    (320, 240, 15, 150, 600),
+]
+START_KBPS = 1500
+
+LOSS_HIGH = 0.10  # back off above this fraction lost
+LOSS_LOW = 0.02  # probe upwards below this
+RTT_HIGH = 0.3  # seconds; hold instead of probing when the path is queueing
+INCREASE = 1.08
+AVAILABLE_HEADROOM = 0.85
+STEP_DOWN_AFTER = 3  # intervals pinned at the rung floor before dropping a rung
+STEP_UP_AFTER = 8  # intervals at the rung ceiling with a clean link before climbing
+
+
+def stats_entries(stats):
+    """Flatten a webrtcbin get-stats reply into a list of plain dicts."""
+    entries = []
+
+    def add(field_id, value, _):
+        if isinstance(value, Gst.Structure):
+            entry = {}
+            for i in range(value.n_fields()):
+                name = value.nth_field_name(i)
+                try:
+                    entry[name] = value.get_value(name)
+                except TypeError:
+                    pass
+            entries.append(entry)
+        return True
+
+    stats.foreach(add, None)
+    return entries
+
+
+def link_sample(entries):
+    """Worst-case (loss, rtt, jitter, available_kbps) over all outbound streams in one peer's stats."""
+    loss = rtt = jitter = 0.0
+    available = None
+    for entry in entries:
+        kind = entry.get("type")
+        if kind == GstWebRTC.WebRTCStatsType.REMOTE_INBOUND_RTP:
+            loss = max(loss, entry.get("fraction-lost") or 0.0)
+            rtt = max(rtt, entry.get("round-trip-time") or 0.0)
+            jitter = max(jitter, entry.get("jitter") or 0.0)
+        elif kind == GstWebRTC.WebRTCStatsType.CANDIDATE_PAIR:
+            bps = entry.get("available-outgoing-bitrate")
+            if bps:
+                kbps = bps / 1000
+                available = kbps if available is None else min(available, kbps)
+    return loss, rtt, jitter, available
+
+
+def bytes_sent(entries):
+    """Total payload bytes sent over all outbound streams in one peer's stats."""
+    return sum(entry.get("bytes-sent") or 0 for entry in entries
+               if entry.get("type") == GstWebRTC.WebRTCStatsType.OUTBOUND_RTP)
+
+
+class BitrateController:
+    """Loss/RTT driven target bitrate with a hysteretic resolution/framerate ladder.
+
+    update() takes the worst link sample across peers and returns the decision
+    for this interval; it has no GStreamer dependencies of its own.
+    """
+
+    def __init__(self, ladder=LADDER, start_kbps=START_KBPS):
+        self.ladder = ladder
+        self.rung = 0
+        self.target = start_kbps
+        self.at_floor = 0
+        self.at_ceiling = 0
+
+    def update(self, loss, rtt, available=None):
+        width, height, fps, lo, hi = self.ladder[self.rung]
+        reason = "hold"
+        if loss > LOSS_HIGH:
+            self.target *= 1 - 0.5 * loss
+            reason = "loss"
+        elif loss < LOSS_LOW and rtt < RTT_HIGH:
+            self.target *= INCREASE
+            reason = "probe"
+        if available is not None and self.target > available * AVAILABLE_HEADROOM:
+            self.target = available * AVAILABLE_HEADROOM
+            reason = "available"
+        self.target = min(max(self.target, lo), hi)
+
+        self.at_floor = self.at_floor + 1 if self.target <= lo and reason in ("loss", "available") else 0
+        self.at_ceiling = self.at_ceiling + 1 if self.target >= hi and reason == "probe" else 0
+        step = 0
+        if self.at_floor >= STEP_DOWN_AFTER and self.rung < len(self.ladder) - 1:
+            step = 1
+        elif self.at_ceiling >= STEP_UP_AFTER and self.rung > 0:
+            step = -1
+        if step:
+            self.rung += step
+            self.at_floor = self.at_ceiling = 0
+            lo, hi = self.ladder[self.rung][3:]
+            # Land in the middle of the new rung so the next step needs fresh evidence
+            self.target = (lo + hi) / 2
+            reason = "step-down" if step > 0 else "step-up"
+
+        width, height, fps = self.ladder[self.rung][:3]
+        return {
+            "reason": reason,
+            "target_kbps": round(self.target),
+            "rung": self.rung,
+            "width": width,
+            "height": height,
+            "fps": fps,
+            "rung_changed": bool(step),
+        }
+
+
+class AdaptiveBitrate:
+    """Polls every peer's webrtcbin stats on a GLib timer and retunes the shared video encoders.
+
+    With simulcast branches each peer is also moved between layers on its
+    own sample, and only peers still on the top layer steer its bitrate.
+    """
+
+    def __init__(self, sessions, interval_ms=ABR_INTERVAL_MS, log_path=ABR_LOG):
+        self.sessions = sessions
+        self.interval_ms = interval_ms
+        self.controller = BitrateController()
+        self.log = open(log_path, "a", buffering=1) if log_path else None
+        self.source_id = None
+        self.generation = 0
+        self.pending = {}
+        # Last complete round, session id -> (loss, rtt, jitter, available_kbps, bytes_sent)
+        self.peer_samples = {}
+
+    def start(self):
+        if self.source_id is None:
+            self.source_id = GLib.timeout_add(self.interval_ms, self.poll)
+
+    def stop(self):
+        if self.source_id is not None:
+            GLib.source_remove(self.source_id)
+            self.source_id = None
+
+    def poll(self):
+        sessions = [s for s in list(self.sessions.sessions.values()) if s.webrtc is not None and not s.closed]
+        self.generation += 1
+        self.pending = {}
+        for session in sessions:
+            promise = Gst.Promise.new_with_change_func(self.on_stats, self.generation, session.id, len(sessions))
+            session.webrtc.emit("get-stats", None, promise)
+        return GLib.SOURCE_CONTINUE
+
+    def on_stats(self, promise, generation, session_id, expected):
+        reply = promise.get_reply()
+        sample = None
+        if reply is not None:
+            entries = stats_entries(reply)
+            sample = link_sample(entries) + (bytes_sent(entries),)
+        # Called from the webrtcbin thread; hand the sample back to GLib
+        GLib.idle_add(self.on_sample, generation, session_id, sample, expected)
+
+    def on_sample(self, generation, session_id, sample, expected):
+        if generation != self.generation:
+            return GLib.SOURCE_REMOVE
+        self.pending[session_id] = sample
+        if len(self.pending) < expected:
+            return GLib.SOURCE_REMOVE
+        self.peer_samples = {sid: s for sid, s in self.pending.items() if s is not None}
+        self.pending = {}
+        if not self.peer_samples:
+            return GLib.SOURCE_REMOVE
+        layers = self.select_layers()
+        # Peers moved down to a smaller simulcast layer no longer hold back the top layer's bitrate
+        samples = [s for sid, s in self.peer_samples.items() if not layers.get(sid)]
+        samples = samples or list(self.peer_samples.values())
+        loss = max(s[0] for s in samples)
+        rtt = max(s[1] for s in samples)
+        jitter = max(s[2] for s in samples)
+        available = [s[3] for s in samples if s[3] is not None]
+        decision = self.controller.update(loss, rtt, min(available) if available else None)
+        self.apply(decision)
+        record = {"t": round(time.time(), 3), "peers": len(samples), "loss": round(loss, 4),
+                  "rtt": round(rtt, 4), "jitter": round(jitter, 4),
+                  "available_kbps": min(available) if available else None}
+        if layers:
+            record["layers"] = layers
+        record.update(decision)
+        line = json.dumps(record)
+        if decision["reason"] not in ("hold", "probe"):
+            print("ABR:", line)
+        if self.log:
+            self.log.write(line + "\n")
+        return GLib.SOURCE_REMOVE
+
+    def select_layers(self):
+        """Pick each peer's simulcast layer from its own sample; returns session id -> lowest layer forwarded."""
+        layers = {}
+        for session in list(self.sessions.sessions.values()):
+            sample = self.peer_samples.get(session.id)
+            if sample is None or session.closed:
+                continue
+            for branch, link in zip(self.sessions.branches, session.links):
+                if branch.layers:
+                    branch.select_layer(link, *sample[:4])
+                    layers[session.id] = max(layers.get(session.id, 0), link.layer)
+        return layers
+
+    def apply(self, decision):
+        for branch in self.sessions.branches:
+            if not branch.encoder:
+                continue
+            # A stereo frame holds two camera frames, so it gets both cameras' share
+            cols, rows = branch.tile
+            enc = branch.get_element(branch.encoder_name)
+            if enc:
+                branch.encoder.set_bitrate(enc, decision["target_kbps"] * 1000 * cols * rows)
+            if decision["rung_changed"]:
+                scaler = branch.get_element(branch.scaler_name)
+                if scaler:
+                    scaler.set_property("caps", Gst.Caps.from_string(
+                        f"video/x-raw,width={decision['width'] * cols},height={decision['height'] * rows},"
+                        f"framerate={decision['fps']}/1"))
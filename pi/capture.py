@@ -0,0 +1,138 @@
+import os
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstBase', '1.0')
+from gi.repository import Gst, GstBase, GLib
+
+from file_source import file_source_description
+from latency_profile import PROFILE
+
+# "camera" uses libcamerasrc; "test" substitutes live test sources so servers run without cameras;
+# "file" replays KSCALE_VIDEO_FILE pre-decoded in the capture caps (file_source.py)
+VIDEO_SOURCE = os.environ.get("KSCALE_VIDEO_SOURCE", "camera")
+
+CAPTURE_WIDTH = 640
+CAPTURE_HEIGHT = 480
+CAPTURE_FPS = 30
+
+# "sbs" (side by side) or "tb" (top and bottom) packs both dual_video.py cameras into one encode
+STEREO_LAYOUT = os.environ.get("KSCALE_STEREO", "")
+# (columns, rows) of camera frames in one stereo frame
+STEREO_LAYOUTS = {"sbs": (2, 1), "tb": (1, 2)}
+
+# Formats libcamerasrc can hand out straight from the ISP, cheapest for encoders first
+CAPTURE_FORMATS = ["NV12", "I420", "YUY2"]
+
+# Elements that may copy or convert every frame
+CONVERTERS = ("videoconvert", "videoscale", "videorate", "v4l2convert")
+
+
+def encoder_format(encoder):
+    """First CAPTURE_FORMATS entry the encoder accepts on its sink pad, so videoconvert can pass through."""
+    factory = Gst.ElementFactory.find(encoder.factory)
+    if factory:
+        for tmpl in factory.get_static_pad_templates():
+            if tmpl.direction != Gst.PadDirection.SINK:
+                continue
+            caps = tmpl.get_caps()
+            for fmt in CAPTURE_FORMATS:
+                if caps.can_intersect(Gst.Caps.from_string(f"video/x-raw,format={fmt}")):
+                    return fmt
+    print(f"No native capture format for {encoder.factory}, converting from {CAPTURE_FORMATS[-1]}")
+    return CAPTURE_FORMATS[-1]
+
+
+def capture_caps(encoder, width=CAPTURE_WIDTH, height=CAPTURE_HEIGHT, fps=CAPTURE_FPS):
+    return f"video/x-raw,format={encoder_format(encoder)},width={width},height={height},framerate={fps}/1"
+
+
+def capture_description(encoder, camera_name=None):
+    """Source plus capsfilter for one camera, ending in caps the encoder takes natively."""
+    if VIDEO_SOURCE == "test":
+        src = "videotestsrc is-live=true pattern=ball"
+    elif VIDEO_SOURCE == "file":
+        src = file_source_description(capture_caps(encoder), CAPTURE_FPS)
+    elif camera_name:
+        src = f'libcamerasrc camera-name="{camera_name}"'
+    else:
+        src = "libcamerasrc"
+    return f"{src} ! capsfilter caps={capture_caps(encoder)}"
+
+
+def stereo_description(encoder, camera_names, layout, mixer="stereo_mix"):
+    """Both cameras composited into one frame, left (or top) eye first.
+
+    compositor aggregates on the pipeline clock: every output frame takes
+    the current buffer from each eye, so the two halves can't drift apart
+    the way two free-running encoders do. With a leaky latency profile the
+    per-eye queues keep a late eye from holding back the other one.
+    """
+    cols, rows = STEREO_LAYOUTS[layout]
+    eyes = ""
+    positions = ""
+    for i, camera_name in enumerate(camera_names):
+        eyes += f"{capture_description(encoder, camera_name)} ! {PROFILE.queue_description()} ! {mixer}.sink_{i} "
+        positions += f" sink_{i}::xpos={i * CAPTURE_WIDTH * (cols - 1)} sink_{i}::ypos={i * CAPTURE_HEIGHT * (rows - 1)}"
+    return (
+        f"{eyes}compositor name={mixer}{positions} ! "
+        f"video/x-raw,format={encoder_format(encoder)},width={cols * CAPTURE_WIDTH},"
+        f"height={rows * CAPTURE_HEIGHT},framerate={CAPTURE_FPS}/1"
+    )
+
+
+def audio_source(device="hw:0,0"):
+    if VIDEO_SOURCE in ("test", "file"):
+        return "audiotestsrc is-live=true wave=silence"
+    return f"alsasrc device={device}"
+
+
+def caps_summary(pad):
+    caps = pad.get_current_caps() if pad else None
+    if not caps or caps.is_empty():
+        return "unnegotiated"
+    s = caps.get_structure(0)
+    features = caps.get_features(0)
+    summary = f"{s.get_value('format')} {s.get_value('width')}x{s.get_value('height')}"
+    if features and not features.is_any() and features.to_string() != "memory:SystemMemory":
+        summary += f" [{features.to_string()}]"
+    return summary
+
+
+def conversion_report(pipe):
+    """Lines describing every converter in the graph and whether it touches the frames."""
+    lines = []
+    it = pipe.iterate_recurse()
+    while True:
+        res, el = it.next()
+        if res != Gst.IteratorResult.OK:
+            break
+        factory = el.get_factory()
+        if not factory or factory.get_name() not in CONVERTERS:
+            continue
+        sink = caps_summary(el.get_static_pad("sink"))
+        src = caps_summary(el.get_static_pad("src"))
+        if isinstance(el, GstBase.BaseTransform) and el.is_passthrough():
+            state = "passthrough"
+        elif sink == src:
+            state = "same caps"
+        else:
+            state = "CONVERTING"
+        lines.append(f"{el.get_parent().get_name()}/{el.get_name()}: {state} ({sink} -> {src})")
+    return lines
+
+
+def report_when_flowing(pipe, pad):
+    """Print conversion_report() once the first buffer reaches pad (caps are final by then)."""
+    def print_report():
+        print("Conversions in capture graph:")
+        for line in conversion_report(pipe) or ["none"]:
+            print("  " + line)
+        return GLib.SOURCE_REMOVE
+
+    def on_buffer(pad, info):
+        # Give the other branches a moment to negotiate as well
+        GLib.timeout_add(500, print_report)
+        return Gst.PadProbeReturn.REMOVE
+
+    pad.add_probe(Gst.PadProbeType.BUFFER, on_buffer)
@@ -0,0 +1,235 @@
+"""Headless webrtcbin client for the robot's HELLO/sdp/ice signaling protocol."""
+import asyncio
+import json
+import time
+
+import websockets
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+gi.require_version('GstSdp', '1.0')
+from gi.repository import Gst, GstWebRTC, GstSdp
+
+from latency_trace import rtp_header
+
+DEPAYLOADERS = {
+    "VP8": "rtpvp8depay ! vp8dec",
+    "VP9": "rtpvp9depay ! vp9dec",
+    "H264": "rtph264depay ! h264parse ! avdec_h264",
+}
+
+
+class VideoProbe:
+    """Times each incoming video frame: last RTP packet received and frame decoded.
+
+    Frames are keyed by RTP timestamp so they can be joined with the
+    server's LatencyTracer output.
+    """
+
+    def __init__(self, keep_frames=True):
+        self.keep_frames = keep_frames
+        self.received = {}
+        self.decoded = {}
+        self.pts_to_rtp = {}
+        self.last_marker_ts = None
+        self.frames = 0
+        self.bytes = 0
+        self.first_frame_at = None
+
+    def attach(self, depay, decoder):
+        depay.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self.on_rtp)
+        depay.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_depayloaded)
+        decoder.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_decoded)
+
+    def on_rtp(self, pad, info):
+        buf = info.get_buffer()
+        self.bytes += buf.get_size()
+        rtp_ts, marker = rtp_header(buf)
+        if marker:
+            self.last_marker_ts = rtp_ts
+            if self.keep_frames:
+                self.received[rtp_ts] = time.monotonic()
+        return Gst.PadProbeReturn.OK
+
+    def on_depayloaded(self, pad, info):
+        if self.last_marker_ts is not None:
+            self.pts_to_rtp[info.get_buffer().pts] = self.last_marker_ts
+        return Gst.PadProbeReturn.OK
+
+    def on_decoded(self, pad, info):
+        now = time.monotonic()
+        self.frames += 1
+        if self.first_frame_at is None:
+            self.first_frame_at = now
+        rtp_ts = self.pts_to_rtp.pop(info.get_buffer().pts, None)
+        if rtp_ts is not None and self.keep_frames:
+            self.decoded[rtp_ts] = now
+        return Gst.PadProbeReturn.OK
+
+
+class WebRTCClient:
+    """Connects to a WebRTCServer, answers its offer and receives every video track.
+
+    Decoded video goes to fakesink; each track gets a VideoProbe in
+    self.probes. Data channels opened by the robot are kept in self.channels.
+    """
+
+    def __init__(self, url, name="client", latency=0, keep_frames=True, options=None):
+        self.url = url
+        self.name = name
+        self.latency = latency
+        self.keep_frames = keep_frames
+        # Sent as HELLO {json}; batching is always requested
+        self.options = dict(options or {}, batch=True)
+        self.pipe = None
+        self.webrtc = None
+        self.ws = None
+        self.loop = None
+        self.probes = []
+        self.channels = []
+        self.on_channel_open = None
+        self.started_at = None
+        self.connected = asyncio.Event()
+        self.remote_set = False
+        self.pending_candidates = []
+        # Resumable session ID from the server, and its {"path", "ms"} recovery reports
+        self.session_id = None
+        self.resumed = False
+        self.recoveries = []
+
+    def start_pipeline(self):
+        self.pipe = Gst.Pipeline.new(self.name)
+        self.webrtc = Gst.ElementFactory.make("webrtcbin", f"{self.name}_webrtc")
+        self.webrtc.set_property("bundle-policy", GstWebRTC.WebRTCBundlePolicy.MAX_BUNDLE)
+        self.webrtc.set_property("latency", self.latency)
+        self.pipe.add(self.webrtc)
+        self.webrtc.connect("on-ice-candidate", self.send_ice_candidate_message)
+        self.webrtc.connect("on-data-channel", self.on_data_channel)
+        self.webrtc.connect("pad-added", self.on_incoming_stream)
+        self.webrtc.connect("notify::connection-state", self.on_connection_state)
+        self.pipe.set_state(Gst.State.PLAYING)
+
+    def close(self):
+        if self.pipe:
+            self.pipe.set_state(Gst.State.NULL)
+            self.pipe = None
+            self.webrtc = None
+
+    def send(self, message):
+        if self.ws:
+            asyncio.run_coroutine_threadsafe(self.ws.send(message), self.loop)
+
+    def on_connection_state(self, webrtc, pspec):
+        if webrtc.get_property("connection-state") == GstWebRTC.WebRTCPeerConnectionState.CONNECTED:
+            self.loop.call_soon_threadsafe(self.connected.set)
+
+    def on_data_channel(self, webrtc, channel):
+        self.channels.append(channel)
+        if self.on_channel_open:
+            channel.connect("on-open", self.on_channel_open)
+
+    def on_incoming_stream(self, webrtc, pad):
+        if pad.direction != Gst.PadDirection.SRC:
+            return
+        s = pad.get_current_caps().get_structure(0)
+        if s.get_value("media") != "video":
+            sink = Gst.ElementFactory.make("fakesink")
+            self.pipe.add(sink)
+            sink.sync_state_with_parent()
+            pad.link(sink.get_static_pad("sink"))
+            return
+        chain = DEPAYLOADERS.get(s.get_value("encoding-name"))
+        if not chain:
+            print(f"{self.name}: no depayloader for {s.get_value('encoding-name')}")
+            return
+        decode = Gst.parse_bin_from_description(f"{chain} ! fakesink sync=false", True)
+        self.pipe.add(decode)
+        decode.sync_state_with_parent()
+        pad.link(decode.get_static_pad("sink"))
+        elements = list(decode.iterate_sorted())[::-1]  # upstream first
+        probe = VideoProbe(self.keep_frames)
+        probe.attach(elements[0], elements[-2])
+        self.probes.append(probe)
+
+    def on_offer_set(self, promise, _, __):
+        promise.wait()
+        self.loop.call_soon_threadsafe(self.flush_candidates)
+        # Receive only: we never send media back
+        for i in range(len(self.webrtc.emit("get-transceivers"))):
+            transceiver = self.webrtc.emit("get-transceiver", i)
+            transceiver.set_property("direction", GstWebRTC.WebRTCRTPTransceiverDirection.RECVONLY)
+        promise = Gst.Promise.new_with_change_func(self.on_answer_created, None, None)
+        self.webrtc.emit("create-answer", None, promise)
+
+    def on_answer_created(self, promise, _, __):
+        promise.wait()
+        answer = promise.get_reply().get_value("answer")
+        self.webrtc.emit("set-local-description", answer, Gst.Promise.new())
+        self.send(json.dumps({'sdp': {'type': 'answer', 'sdp': answer.sdp.as_text()}}))
+
+    def send_ice_candidate_message(self, _, mlineindex, candidate):
+        self.send(json.dumps({'ice': {'candidate': candidate, 'sdpMLineIndex': mlineindex}}))
+
+    def handle_server_message(self, message):
+        msg = json.loads(message)
+        if 'session' in msg:
+            session = msg['session']
+            if self.session_id and not session['resumed'] and self.pipe:
+                # The server started over on a new webrtcbin, so this side needs a new one too
+                self.close()
+                self.remote_set = False
+                self.pending_candidates = []
+                self.probes = []
+                self.start_pipeline()
+            self.session_id = session['id']
+            self.resumed = session['resumed']
+        elif 'recovered' in msg:
+            self.recoveries.append(msg['recovered'])
+        elif 'sdp' in msg and msg['sdp']['type'] == 'offer':
+            res, sdpmsg = GstSdp.SDPMessage.new()
+            GstSdp.sdp_message_parse_buffer(msg['sdp']['sdp'].encode(), sdpmsg)
+            offer = GstWebRTC.WebRTCSessionDescription.new(GstWebRTC.WebRTCSDPType.OFFER, sdpmsg)
+            promise = Gst.Promise.new_with_change_func(self.on_offer_set, None, None)
+            self.webrtc.emit("set-remote-description", offer, promise)
+        elif 'ice' in msg:
+            self.add_ice_candidate(msg['ice'])
+        elif 'candidates' in msg:
+            for ice in msg['candidates']:
+                self.add_ice_candidate(ice)
+
+    def flush_candidates(self):
+        self.remote_set = True
+        pending, self.pending_candidates = self.pending_candidates, []
+        for ice in pending:
+            self.add_ice_candidate(ice)
+
+    def add_ice_candidate(self, ice):
+        if not self.webrtc:
+            return
+        if not self.remote_set:
+            self.pending_candidates.append(ice)
+            return
+        self.webrtc.emit("add-ice-candidate", ice['sdpMLineIndex'], ice['candidate'])
+
+    async def run(self, duration):
+        """Connect, send HELLO and receive for duration seconds."""
+        self.loop = asyncio.get_running_loop()
+        self.started_at = time.monotonic()
+        self.start_pipeline()
+        try:
+            async with websockets.connect(self.url) as ws:
+                self.ws = ws
+                await ws.send('HELLO ' + json.dumps(self.options))
+
+                async def receive():
+                    async for message in ws:
+                        self.handle_server_message(message)
+
+                try:
+                    await asyncio.wait_for(receive(), duration)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.ws = None
+            self.close()
@@ -0,0 +1,344 @@
+"""Binary control frames sent by the app on the data channel.
+
+Frame layout (little endian, 28 bytes):
+
+    u8   version        FRAME_VERSION
+    u8   motion         index into MOTIONS, 0 = none
+    u16  flags          FLAG_RESET
+    u32  seq            sender sequence number, wraps
+    f64  timestamp      sender clock in ms (Date.now())
+    f32  x, y, z        joystick / slider velocity
+
+Must stay in sync with utils/controlFrame.ts.
+
+Pose frames from a headset (little endian, 44 bytes), relayed by
+webxr_demo/https_server.py or sent on the data channel directly:
+
+    u8   version        POSE_VERSION
+    u8   source         index into POSE_SOURCES
+    u16  flags          reserved, 0
+    u32  seq            sender sequence number, wraps
+    f64  timestamp      sender clock in ms (Date.now())
+    f32  x, y, z        position in metres
+    f32  qx, qy, qz, qw orientation quaternion
+
+webxr_demo/pose_ingest.py imports POSE from here.
+"""
+import json
+import math
+import struct
+import time
+
+FRAME_VERSION = 1
+FRAME = struct.Struct("<BBHIdfff")
+FRAME_SIZE = FRAME.size
+
+FLAG_RESET = 0x1
+
+POSE_VERSION = 2
+POSE = struct.Struct("<BBHId7f")
+POSE_SIZE = POSE.size
+POSE_SOURCES = ("head", "left", "right")
+
+MOTIONS = (None, "boxing", "salute", "zombie_walk")
+MOTION_IDS = {name: i for i, name in enumerate(MOTIONS) if name}
+
+# Data channels the robot opens, label -> webrtcbin create-data-channel options.
+# Velocity setpoints are only worth having if they are fresh, so a lost one is
+# never retransmitted or allowed to hold back newer ones. Motions and resets
+# must arrive. "chat" is the original single channel, kept for older apps.
+VELOCITY_CHANNEL = "velocity"
+COMMAND_CHANNEL = "commands"
+LEGACY_CHANNEL = "chat"
+DATA_CHANNELS = {
+    VELOCITY_CHANNEL: "ordered=(boolean)false,max-retransmits=(int)0",
+    COMMAND_CHANNEL: "ordered=(boolean)true",
+    LEGACY_CHANNEL: "ordered=(boolean)true",
+}
+
+
+class ControlFrame:
+    """A decoded command. The dispatcher reuses one instance per channel, so copy() it to keep it.
+
+    channel is (sender, label) for the channel it came in on, where sender
+    is the session ID (None for UDP), so sequence numbers are only ever
+    compared within one channel.
+    """
+
+    __slots__ = ("version", "motion", "flags", "seq", "timestamp", "x", "y", "z", "received", "channel")
+
+    def __init__(self):
+        self.version = FRAME_VERSION
+        self.motion = 0
+        self.flags = 0
+        self.seq = 0
+        self.timestamp = 0.0
+        self.x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+        self.received = 0.0
+        self.channel = None
+
+    @property
+    def motion_name(self):
+        return MOTIONS[self.motion] if self.motion < len(MOTIONS) else None
+
+    @property
+    def reset(self):
+        return bool(self.flags & FLAG_RESET)
+
+    def copy(self):
+        other = ControlFrame()
+        for name in self.__slots__:
+            setattr(other, name, getattr(self, name))
+        return other
+
+    def __repr__(self):
+        return (f"ControlFrame(seq={self.seq}, x={self.x:.3f}, y={self.y:.3f}, z={self.z:.3f}, "
+                f"motion={self.motion_name}, flags={self.flags:#x})")
+
+
+def encode_frame(seq, x, y, z, motion=None, flags=0, timestamp=None):
+    if timestamp is None:
+        timestamp = time.time() * 1000
+    return FRAME.pack(FRAME_VERSION, MOTION_IDS.get(motion, 0), flags, seq & 0xFFFFFFFF,
+                      timestamp, x, y, z)
+
+
+class PoseFrame:
+    """A decoded pose. Reused by the dispatcher like ControlFrame."""
+
+    __slots__ = ("source", "flags", "seq", "timestamp", "x", "y", "z", "qx", "qy", "qz", "qw", "received")
+
+    def __init__(self):
+        self.source = 0
+        self.flags = 0
+        self.seq = 0
+        self.timestamp = 0.0
+        self.x = self.y = self.z = 0.0
+        self.qx = self.qy = self.qz = 0.0
+        self.qw = 1.0
+        self.received = 0.0
+
+    @property
+    def source_name(self):
+        return POSE_SOURCES[self.source] if self.source < len(POSE_SOURCES) else None
+
+    def __repr__(self):
+        return (f"PoseFrame({self.source_name}, seq={self.seq}, pos=({self.x:.3f}, {self.y:.3f}, {self.z:.3f}), "
+                f"quat=({self.qx:.3f}, {self.qy:.3f}, {self.qz:.3f}, {self.qw:.3f}))")
+
+
+def encode_pose(seq, position, orientation, source="head", timestamp=None):
+    if timestamp is None:
+        timestamp = time.time() * 1000
+    return POSE.pack(POSE_VERSION, POSE_SOURCES.index(source), 0, seq & 0xFFFFFFFF, timestamp,
+                     *position, *orientation)
+
+
+def json_velocity(msg):
+    """(x, y, z) from a JSON command in any of the accepted shapes; ValueError or TypeError if malformed."""
+    if "Xvel" in msg:
+        # SimUDP shape, already mapped to robot axes
+        velocity = (-float(msg.get("Yvel") or 0), float(msg.get("Xvel") or 0), -float(msg.get("YawRate") or 0))
+    elif "vector" in msg:
+        vector = msg["vector"]
+        if (not isinstance(vector, list) or len(vector) != 3
+                or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in vector)):
+            raise ValueError("vector must be three numbers")
+        velocity = tuple(float(v) for v in vector)
+    else:
+        velocity = (float(msg.get("x") or 0), float(msg.get("y") or 0), float(msg.get("z") or 0))
+    if not all(math.isfinite(v) for v in velocity):
+        raise ValueError("velocity must be finite")
+    return velocity
+
+
+class ChannelStats:
+    """Delivered, late and dropped counts for one channel, from sender sequence numbers.
+
+    A frame older than the newest seen is late (an unordered channel let it
+    overtake); a gap in the sequence counts as dropped until, and unless, the
+    missing frame turns up late.
+    """
+
+    __slots__ = ("delivered", "late", "dropped", "rejected", "last_seq")
+
+    def __init__(self):
+        self.delivered = 0
+        self.late = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.last_seq = None
+
+    def update(self, seq):
+        self.delivered += 1
+        last = self.last_seq
+        if last is None:
+            self.last_seq = seq
+            return
+        ahead = (seq - last) & 0xFFFFFFFF
+        if ahead == 0:
+            return
+        if ahead < 0x80000000:
+            self.dropped += ahead - 1
+            self.last_seq = seq
+        else:
+            self.late += 1
+            if self.dropped:
+                self.dropped -= 1
+
+    def summary(self):
+        return {"delivered": self.delivered, "late": self.late, "dropped": self.dropped,
+                "rejected": self.rejected}
+
+
+class ChannelState:
+    """Everything the dispatcher keeps for one channel of one sender.
+
+    Each has its own reused frames, so channels delivered on different
+    threads never decode into the same object.
+    """
+
+    __slots__ = ("label", "frame", "pose", "json_seq", "stats")
+
+    def __init__(self, label, sender):
+        self.label = label
+        self.frame = ControlFrame()
+        self.frame.channel = (sender, label)
+        self.pose = PoseFrame()
+        self.json_seq = 0
+        self.stats = ChannelStats()
+
+
+class ControlDispatcher:
+    """Decodes control messages once and hands the result to the handlers for its channel.
+
+    Binary frames are unpacked straight into a reused ControlFrame. JSON text
+    from older clients ({x, y, z} vectors and the UDP {Xvel, Yvel, YawRate,
+    motion} shape) is still accepted and mapped onto the same frame; those
+    clients carry no sequence numbers, so one is assigned locally.
+
+    Handlers are registered for a set of channel labels, or for every
+    channel with labels=None. Frames that didn't come from a data channel
+    (UDP) have label None. Pose frames go to the register_pose() handlers
+    instead, whatever channel they came in on.
+
+    State is kept per (sender, label), where sender is the session the
+    channel belongs to, so a second viewer never shares sequence numbers
+    with the operator. forget() drops a closed sender's state.
+    """
+
+    def __init__(self):
+        self.handlers = []  # (handler, labels or None)
+        self.channels = {}  # (sender, label) -> ChannelState
+        self.retired = {}  # label -> summed ChannelStats.summary() of forgotten senders
+        self.pose_handlers = []
+        self.poses = 0
+        self.decoded = 0
+        self.rejected = 0
+        self.decode_seconds = 0.0
+
+    def register(self, handler, labels=None):
+        self.handlers.append((handler, labels))
+        return handler
+
+    def register_pose(self, handler):
+        self.pose_handlers.append(handler)
+        return handler
+
+    def channel(self, label, sender=None):
+        key = (sender, label)
+        state = self.channels.get(key)
+        if state is None:
+            state = self.channels[key] = ChannelState(label, sender)
+        return state
+
+    def channel_stats(self, label, sender=None):
+        return self.channel(label, sender).stats
+
+    def forget(self, sender):
+        """Drop a closed sender's state; its counts stay in stats()."""
+        for key in [key for key in list(self.channels) if key[0] == sender]:
+            state = self.channels.pop(key, None)
+            if state is None:
+                continue
+            totals = self.retired.setdefault(state.label, dict.fromkeys(state.stats.summary(), 0))
+            for name, value in state.stats.summary().items():
+                totals[name] += value
+
+    def on_message_data(self, channel, data, sender=None):
+        self.dispatch_bytes(data.get_data() if hasattr(data, "get_data") else data, channel.props.label, sender)
+
+    def on_message_string(self, channel, message, sender=None):
+        self.dispatch_json(message, channel.props.label, sender)
+
+    def dispatch_bytes(self, data, label=None, sender=None):
+        start = time.perf_counter()
+        state = self.channel(label, sender)
+        if len(data) == POSE_SIZE and data[0] == POSE_VERSION:
+            self.dispatch_pose(data, state, start)
+            return
+        if len(data) != FRAME_SIZE or data[0] != FRAME_VERSION:
+            self.rejected += 1
+            state.stats.rejected += 1
+            return
+        f = state.frame
+        (f.version, f.motion, f.flags, f.seq, f.timestamp, f.x, f.y, f.z) = FRAME.unpack_from(data)
+        f.received = time.time() * 1000
+        self.decode_seconds += time.perf_counter() - start
+        self.emit(f, state)
+
+    def dispatch_pose(self, data, state, start):
+        p = state.pose
+        (_, p.source, p.flags, p.seq, p.timestamp,
+         p.x, p.y, p.z, p.qx, p.qy, p.qz, p.qw) = POSE.unpack_from(data)
+        p.received = time.time() * 1000
+        self.decode_seconds += time.perf_counter() - start
+        self.poses += 1
+        for handler in self.pose_handlers:
+            handler(p)
+
+    def dispatch_json(self, message, label=None, sender=None):
+        start = time.perf_counter()
+        state = self.channel(label, sender)
+        try:
+            msg = json.loads(message)
+            if not isinstance(msg, dict):
+                raise ValueError("not a JSON object")
+            motion = MOTION_IDS.get(msg.get("motion"), 0)
+            x, y, z = json_velocity(msg)
+        except (TypeError, ValueError):
+            # Not JSON, or JSON of the wrong shape: {"vector": [1]}, {"x": "abc"}, {"motion": [1]}
+            self.rejected += 1
+            state.stats.rejected += 1
+            return
+        f = state.frame
+        f.version = 0
+        f.flags = FLAG_RESET if msg.get("reset") else 0
+        f.motion = motion
+        f.x, f.y, f.z = x, y, z
+        state.json_seq = (state.json_seq + 1) & 0xFFFFFFFF
+        f.seq = state.json_seq
+        f.received = time.time() * 1000
+        f.timestamp = f.received
+        self.decode_seconds += time.perf_counter() - start
+        self.emit(f, state)
+
+    def emit(self, frame, state):
+        self.decoded += 1
+        state.stats.update(frame.seq)
+        label = state.label
+        for handler, labels in self.handlers:
+            if labels is None or label in labels:
+                handler(frame)
+
+    def stats(self):
+        """Counts per label, summed over every sender including forgotten ones."""
+        totals = {label: dict(summary) for label, summary in list(self.retired.items())}
+        for state in list(self.channels.values()):
+            summary = state.stats.summary()
+            total = totals.setdefault(state.label, dict.fromkeys(summary, 0))
+            for name, value in summary.items():
+                total[name] += value
+        return totals
@@ -0,0 +1,251 @@
+import threading
+import time
+from array import array
+
+from control_frames import COMMAND_CHANNEL, LEGACY_CHANNEL, VELOCITY_CHANNEL
+
+CONTROL_RATE_HZ = 100
+COMMAND_DEADLINE = 0.25  # seconds without a fresh command before stopping
+STOP_DECAY = 0.8  # per-tick velocity scale once the deadline has passed
+STATS_WINDOW = 1024
+REPORT_INTERVAL = 10.0
+
+
+def seq_newer(a, b):
+    """True if sequence number a is newer than b, allowing for u32 wraparound."""
+    return a != b and ((a - b) & 0xFFFFFFFF) < 0x80000000
+
+
+class CommandMailbox:
+    """Latest-value slot between the data channel callbacks and the control loop.
+
+    put() replaces the slot with a single tuple assignment and take() reads
+    it back the same way, so neither side ever waits on the other. Frames
+    with an older or repeated sequence number than the last one accepted
+    on the same channel (ControlFrame.channel) are dropped, unless that one
+    has gone stale (the sender restarted). Channels never compare sequence
+    numbers with each other; the newest accepted frame from any of them is
+    the latest. Discrete motions and flags (reset) are latched separately,
+    so a following velocity update can't overwrite them before the loop
+    sees them, and take() hands each one over exactly once. Latching and
+    take()'s read-and-clear hold a short lock, since they can run on
+    different threads; take() only takes it when something is pending.
+
+    put_command() is for the reliable command channel, which has its own
+    sequence space: it only latches the motion and reset flag and leaves the
+    velocity slot alone.
+    """
+
+    def __init__(self, deadline=COMMAND_DEADLINE):
+        self.deadline = deadline
+        self.latest = None  # (seq, x, y, z, received, sender_ms, arrival_ms)
+        self.channels = {}  # (sender, label) -> (seq, received) of its last accepted frame
+        self.motion = 0
+        self.flags = 0
+        self.lock = threading.Lock()
+        self.stale_dropped = 0
+        self.accepted = 0
+        self.commands = 0
+
+    def put(self, frame):
+        now = time.monotonic()
+        last = self.channels.get(frame.channel)
+        if last is not None and not seq_newer(frame.seq, last[0]) and now - last[1] < self.deadline:
+            self.stale_dropped += 1
+            return False
+        self.channels[frame.channel] = (frame.seq, now)
+        if frame.motion or frame.flags:
+            self.latch(frame.motion, frame.flags)
+        self.latest = (frame.seq, frame.x, frame.y, frame.z, now, frame.timestamp, frame.received)
+        self.accepted += 1
+        return True
+
+    def put_command(self, frame):
+        self.latch(frame.motion, frame.flags)
+        self.commands += 1
+        return True
+
+    def latch(self, motion, flags):
+        with self.lock:
+            if motion:
+                self.motion = motion
+            self.flags |= flags
+
+    def take(self):
+        """Return (latest command tuple or None, pending motion id, pending flags); motion and flags only once."""
+        latest = self.latest
+        # Unlocked check: anything latched after it is picked up on the next tick
+        if not (self.motion or self.flags):
+            return latest, 0, 0
+        with self.lock:
+            motion, flags = self.motion, self.flags
+            self.motion = self.flags = 0
+        return latest, motion, flags
+
+    def forget(self, sender):
+        """Drop the sequence state of every channel a closed sender had."""
+        for channel in [channel for channel in list(self.channels) if channel[0] == sender]:
+            self.channels.pop(channel, None)
+
+    def reset(self):
+        self.latest = None
+        self.channels = {}
+        with self.lock:
+            self.motion = 0
+            self.flags = 0
+
+
+class PoseMailbox:
+    """Latest pose per tracked source (head, hands); a pose older than the one held is dropped.
+
+    Each slot is a single tuple (seq, position, orientation, received,
+    sender_ms, arrival_ms), replaced whole like CommandMailbox.latest, so
+    whatever reads it never waits on the receive path.
+    """
+
+    def __init__(self, deadline=COMMAND_DEADLINE):
+        self.deadline = deadline
+        self.latest = {}
+        self.accepted = 0
+        self.stale_dropped = 0
+        self.age = RollingStats(STATS_WINDOW)  # sender clock to arrival, ms
+
+    def put(self, pose):
+        now = time.monotonic()
+        latest = self.latest.get(pose.source)
+        if latest is not None and not seq_newer(pose.seq, latest[0]) and now - latest[3] < self.deadline:
+            self.stale_dropped += 1
+            return False
+        self.latest[pose.source] = (pose.seq, (pose.x, pose.y, pose.z), (pose.qx, pose.qy, pose.qz, pose.qw),
+                                    now, pose.timestamp, pose.received)
+        self.age.add(pose.received - pose.timestamp)
+        self.accepted += 1
+        return True
+
+    def get(self, source=0):
+        return self.latest.get(source)
+
+
+class RollingStats:
+    """Fixed-size ring of float samples, preallocated."""
+
+    def __init__(self, size=STATS_WINDOW):
+        self.samples = array('d', bytes(8 * size))
+        self.size = size
+        self.count = 0
+
+    def add(self, value):
+        self.samples[self.count % self.size] = value
+        self.count += 1
+
+    def summary(self):
+        n = min(self.count, self.size)
+        if not n:
+            return {"n": 0}
+        values = sorted(self.samples[:n])
+        return {
+            "n": n,
+            "mean": round(sum(values) / n, 3),
+            "p50": round(values[n // 2], 3),
+            "p99": round(values[min(n - 1, int(n * 0.99))], 3),
+            "max": round(values[-1], 3),
+        }
+
+
+class ControlLoop:
+    """Fixed-rate consumer of the command mailbox.
+
+    Every tick reads the newest command and hands (x, y, z, motion, flags) to
+    the actuate callback; velocity repeats every tick, while a motion or a
+    flag such as reset is passed on only on the tick that takes it. When no
+    new command has arrived within the deadline the output decays to a
+    zero-velocity stop. Tick jitter and command age (arrival to actuation)
+    are kept in ms for stats(). With no actuate callback (no
+    KSCALE_CONTROL_TARGET, see udp_bridge.control_output) it only measures.
+    """
+
+    def __init__(self, actuate=None, rate_hz=CONTROL_RATE_HZ, deadline=COMMAND_DEADLINE,
+                 report_interval=REPORT_INTERVAL):
+        self.mailbox = CommandMailbox(deadline)
+        self.actuate = actuate
+        self.period = 1.0 / rate_hz
+        self.deadline = deadline
+        self.report_interval = report_interval
+        self.jitter = RollingStats()
+        self.age = RollingStats()
+        self.ticks = 0
+        self.timeouts = 0
+        self.output = (0.0, 0.0, 0.0)
+        self.last_seq = None
+        self.running = False
+        self.thread = None
+
+    def attach(self, dispatcher):
+        """Take velocity from the velocity, legacy and UDP paths and motions/resets from the command channel."""
+        dispatcher.register(self.mailbox.put, (VELOCITY_CHANNEL, LEGACY_CHANNEL, None))
+        dispatcher.register(self.mailbox.put_command, (COMMAND_CHANNEL,))
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="control-loop", daemon=True)
+        self.thread.start()
+        print(f"Control loop running at {1 / self.period:.0f} Hz, deadline {self.deadline * 1000:.0f} ms")
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def run(self):
+        next_tick = time.monotonic()
+        next_report = next_tick + self.report_interval
+        while self.running:
+            next_tick += self.period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            now = time.monotonic()
+            self.jitter.add((now - next_tick) * 1000)
+            if now - next_tick > self.period:
+                # Overran: skip missed ticks instead of bursting to catch up
+                next_tick = now
+            self.tick(now)
+            if self.report_interval and now >= next_report:
+                next_report = now + self.report_interval
+                print("Control loop stats:", self.stats())
+
+    def tick(self, now):
+        self.ticks += 1
+        latest, motion, flags = self.mailbox.take()
+        if latest is not None and now - latest[4] < self.deadline:
+            seq, x, y, z, arrived = latest[:5]
+            if seq != self.last_seq:
+                self.last_seq = seq
+                self.age.add((now - arrived) * 1000)
+            self.output = (x, y, z)
+        else:
+            x, y, z = self.output
+            if x or y or z:
+                if latest is not None and self.last_seq == latest[0]:
+                    self.timeouts += 1
+                    self.last_seq = None
+                x, y, z = x * STOP_DECAY, y * STOP_DECAY, z * STOP_DECAY
+                if abs(x) < 1e-3 and abs(y) < 1e-3 and abs(z) < 1e-3:
+                    x = y = z = 0.0
+                self.output = (x, y, z)
+        if self.actuate:
+            self.actuate(x, y, z, motion, flags)
+
+    def stats(self):
+        return {
+            "ticks": self.ticks,
+            "accepted": self.mailbox.accepted,
+            "commands": self.mailbox.commands,
+            "stale_dropped": self.mailbox.stale_dropped,
+            "timeouts": self.timeouts,
+            "jitter_ms": self.jitter.summary(),
+            "command_age_ms": self.age.summary(),
+        }
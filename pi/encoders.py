@@ -0,0 +1,173 @@
+import os
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from latency_profile import PROFILE
+
+# "auto" picks the first usable backend in ENCODER_ORDER, or name one directly
+ENCODER = os.environ.get("KSCALE_ENCODER", "auto")
+ENCODER_ORDER = ["v4l2h264", "x264", "vp8", "vp9"]
+ENCODER_THREADS = os.cpu_count() or 1
+# Frames between unrequested keyframes. Peers get keyframes when they join or
+# send PLI/FIR (keyframes.py), so the GOP is only a safety net and kept long.
+KEYFRAME_INTERVAL = int(os.environ.get("KSCALE_KEYFRAME_INTERVAL", "600"))
+
+
+class EncoderBackend:
+    """How to build one encoder and its matching payloader as a gst-launch fragment."""
+
+    def __init__(self, name, factory, encoding_name, encoder_props, payloader,
+                 parser=None, output_caps=None, payloader_props="", rtp_caps_extra="",
+                 keyframe_prop=None, extra_controls=None, keyframe_control=None,
+                 bitrate_prop=None, bitrate_unit=1, deadline_prop=None, lookahead_prop=None,
+                 depayloader=None):
+        self.name = name
+        self.factory = factory
+        self.encoding_name = encoding_name
+        self.encoder_props = encoder_props
+        self.payloader = payloader
+        self.parser = parser
+        self.output_caps = output_caps
+        self.payloader_props = payloader_props
+        self.rtp_caps_extra = rtp_caps_extra
+        self.keyframe_prop = keyframe_prop
+        # V4L2 encoders take their settings as one extra-controls structure
+        self.extra_controls = extra_controls
+        self.keyframe_control = keyframe_control
+        # Runtime bitrate knob, in bits per second divided by bitrate_unit
+        self.bitrate_prop = bitrate_prop
+        self.bitrate_unit = bitrate_unit
+        # Format strings for the latency profile's encoder deadline and lookahead
+        self.deadline_prop = deadline_prop
+        self.lookahead_prop = lookahead_prop
+        # Turns this backend's RTP back into a muxable stream (for recording)
+        self.depayloader = depayloader
+
+    def probe(self):
+        """True if the element exists and can open its device."""
+        if not Gst.ElementFactory.find(self.factory):
+            return False
+        el = Gst.ElementFactory.make(self.factory, None)
+        if not el:
+            return False
+        # Hardware encoders only fail once they try to open the device
+        ok = el.set_state(Gst.State.READY) != Gst.StateChangeReturn.FAILURE
+        el.set_state(Gst.State.NULL)
+        return ok
+
+    def encoder_description(self, name, keyframe_interval=None, profile=PROFILE):
+        keyframe_interval = keyframe_interval or KEYFRAME_INTERVAL
+        props = self.encoder_props
+        if self.deadline_prop:
+            props = f"{props} {self.deadline_prop.format(profile.encoder_deadline)}"
+        if self.lookahead_prop:
+            props = f"{props} {self.lookahead_prop.format(profile.encoder_lookahead)}"
+        if keyframe_interval and self.keyframe_prop:
+            props = f"{props} {self.keyframe_prop.format(keyframe_interval)}"
+        if self.extra_controls is not None:
+            controls = dict(self.extra_controls)
+            if keyframe_interval and self.keyframe_control:
+                controls[self.keyframe_control] = keyframe_interval
+            fields = "".join(f",{k}={v}" for k, v in controls.items())
+            props = f'{props} extra-controls="controls{fields}"'
+        desc = f"{self.factory} name={name} {props}".rstrip()
+        if self.output_caps:
+            desc += f" ! {self.output_caps}"
+        if self.parser:
+            desc += f" ! {self.parser}"
+        return desc
+
+    def description(self, name, pt, keyframe_interval=None, scaler=None, profile=PROFILE):
+        """videoconvert ! queue ! encoder ! payloader, ready to append to a capture chain.
+
+        The videoconvert only passes buffers through when the capture caps
+        already use a format the encoder takes (see capture.capture_caps).
+
+        With scaler set, a videoscale/videorate stage and a capsfilter of that
+        name are inserted so the resolution and framerate can be stepped at
+        runtime. The queue in front of the encoder follows the latency profile.
+        """
+        scale = ""
+        if scaler:
+            scale = f"videoscale ! videorate drop-only=true ! capsfilter name={scaler} caps=video/x-raw ! "
+        return (
+            f"videoconvert ! {scale}{profile.queue_description()} ! "
+            f"{self.encoder_description(name, keyframe_interval, profile)} ! "
+            f"{self.payloader} name={name}_pay pt={pt} {self.payloader_props}".rstrip()
+        )
+
+    def set_bitrate(self, element, bps):
+        if self.bitrate_prop:
+            element.set_property(self.bitrate_prop, int(bps // self.bitrate_unit))
+        elif self.extra_controls is not None:
+            controls = Gst.Structure.new_from_string(f"controls,video_bitrate={int(bps)}")
+            element.set_property("extra-controls", controls)
+
+    def rtp_caps(self, pt):
+        caps = f"application/x-rtp,media=video,encoding-name={self.encoding_name},clock-rate=90000,payload={pt}"
+        if self.rtp_caps_extra:
+            caps += f",{self.rtp_caps_extra}"
+        return caps
+
+
+H264_PAY = "rtph264pay"
+H264_PAY_PROPS = "config-interval=-1 aggregate-mode=zero-latency"
+H264_DEPAY = "rtph264depay ! h264parse"
+H264_RTP_CAPS = "packetization-mode=(string)1,profile-level-id=(string)42e01f"
+
+BACKENDS = {
+    "v4l2h264": EncoderBackend(
+        "v4l2h264", "v4l2h264enc", "H264",
+        # Import libcamera's dmabufs directly instead of copying into V4L2 buffers
+        "output-io-mode=dmabuf-import",
+        H264_PAY, parser="h264parse",
+        output_caps="video/x-h264,level=(string)4,profile=(string)constrained-baseline",
+        payloader_props=H264_PAY_PROPS, rtp_caps_extra=H264_RTP_CAPS,
+        extra_controls={"repeat_sequence_header": 1, "video_bitrate": 2000000},
+        keyframe_control="h264_i_frame_period", depayloader=H264_DEPAY,
+    ),
+    "x264": EncoderBackend(
+        "x264", "x264enc", "H264",
+        "tune=zerolatency speed-preset=ultrafast bitrate=2000 "
+        f"threads={ENCODER_THREADS} sliced-threads=true",
+        H264_PAY, parser="h264parse",
+        output_caps="video/x-h264,profile=constrained-baseline",
+        payloader_props=H264_PAY_PROPS, rtp_caps_extra=H264_RTP_CAPS,
+        keyframe_prop="key-int-max={}", bitrate_prop="bitrate", bitrate_unit=1000,
+        lookahead_prop="rc-lookahead={}", depayloader=H264_DEPAY,
+    ),
+    "vp8": EncoderBackend(
+        "vp8", "vp8enc", "VP8",
+        f"cpu-used=8 threads={ENCODER_THREADS} error-resilient=partitions",
+        "rtpvp8pay", keyframe_prop="keyframe-max-dist={}", bitrate_prop="target-bitrate",
+        deadline_prop="deadline={}", lookahead_prop="lag-in-frames={}", depayloader="rtpvp8depay",
+    ),
+    "vp9": EncoderBackend(
+        "vp9", "vp9enc", "VP9",
+        f"cpu-used=8 threads={ENCODER_THREADS} row-mt=true",
+        "rtpvp9pay", keyframe_prop="keyframe-max-dist={}", bitrate_prop="target-bitrate",
+        deadline_prop="deadline={}", lookahead_prop="lag-in-frames={}", depayloader="rtpvp9depay",
+    ),
+}
+
+
+def available_encoders():
+    return [name for name in ENCODER_ORDER if BACKENDS[name].probe()]
+
+
+def select_encoder(preference=ENCODER):
+    """Return the requested backend, falling back down ENCODER_ORDER if it isn't usable."""
+    order = ENCODER_ORDER
+    if preference != "auto":
+        if preference not in BACKENDS:
+            raise ValueError(f"Unknown encoder {preference!r}, expected one of {', '.join(BACKENDS)}")
+        order = [preference] + [n for n in ENCODER_ORDER if n != preference]
+    for name in order:
+        if BACKENDS[name].probe():
+            if name != order[0]:
+                print(f"Encoder {order[0]} not available, falling back to {name}")
+            print("Using encoder:", name)
+            return BACKENDS[name]
+    raise RuntimeError("No usable video encoder found")
@@ -0,0 +1,190 @@
+"""Virtual cameras replaying a local clip, for KSCALE_VIDEO_SOURCE=file.
+
+The clip (by default the one vid.py fetches) is decoded once, in the exact
+capture caps the encoder would get from libcamerasrc, into a raw frame file
+next to it (.frames/); later runs load that file instead of decoding again.
+Each virtual camera is an appsrc fed by its own thread on an absolute
+real-time schedule from the in-memory ring, so encoder and network
+benchmarks are repeatable and never include decode or copy time.
+"""
+import json
+import os
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from control_loop import RollingStats
+
+VIDEO_FILE = os.environ.get("KSCALE_VIDEO_FILE", os.path.expanduser("~/videos/BigBuckBunny_320x180.mp4"))
+# Length of the ring; it loops after this many seconds
+VIDEO_FILE_SECONDS = float(os.environ.get("KSCALE_VIDEO_FILE_SECONDS", "10"))
+
+# A decode that produces nothing for this long has stalled (missing plugin, bad caps)
+DECODE_TIMEOUT = 10 * Gst.SECOND
+# Frames an appsrc holds before push-buffer blocks the camera thread
+APPSRC_FRAMES = 2
+
+APPSRC_PREFIX = "filecam"
+
+
+class FrameRing:
+    """Raw frames of one clip in one caps, each loaded once into its own Gst.Buffer.
+
+    frame() hands out a shallow copy that shares the frame's memory, so a
+    push costs no frame copy; the whole ring stays resident while in use.
+    """
+
+    def __init__(self, path, caps, fps, seconds=VIDEO_FILE_SECONDS):
+        self.caps = caps
+        self.fps = fps
+        st = os.stat(path)
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), ".frames")
+        key = f"{os.path.basename(path)}-{st.st_size:x}-{st.st_mtime_ns:x}-{caps}-{seconds:g}s"
+        key = "".join(c if c.isalnum() or c in "-._" else "_" for c in key)
+        self.path = os.path.join(cache_dir, key + ".raw")
+        meta = self.path + ".json"
+        if not os.path.exists(meta):
+            os.makedirs(cache_dir, exist_ok=True)
+            self.decode(path, int(seconds * fps), meta)
+        with open(meta) as f:
+            info = json.load(f)
+        self.frame_size = info["frame_size"]
+        self.frames = info["frames"]
+        self.buffers = []
+        with open(self.path, "rb") as f:
+            for _ in range(self.frames):
+                self.buffers.append(Gst.Buffer.new_wrapped_bytes(GLib.Bytes.new(f.read(self.frame_size))))
+        print(f"Frame ring {self.path}: {self.frames} frames of {self.frame_size} bytes")
+
+    def decode(self, path, max_frames, meta):
+        print(f"Decoding {path} into {self.caps} (once)")
+        pipe = Gst.parse_launch(
+            f'filesrc location="{path}" ! decodebin ! videoconvert ! videoscale ! videorate ! '
+            f"capsfilter caps={self.caps} ! appsink name=sink sync=false max-buffers=8"
+        )
+        sink = pipe.get_by_name("sink")
+        bus = pipe.get_bus()
+        tmp = self.path + ".tmp"
+        frames = 0
+        frame_size = 0
+        try:
+            if pipe.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+                raise RuntimeError(f"Could not start decoding {path}")
+            with open(tmp, "wb") as out:
+                while frames < max_frames:
+                    sample = sink.emit("try-pull-sample", DECODE_TIMEOUT)
+                    if sample is None:
+                        # End of the clip, an error, or a stall; the bus says which
+                        msg = bus.timed_pop_filtered(0, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+                        if msg and msg.type == Gst.MessageType.ERROR:
+                            err, debug = msg.parse_error()
+                            raise RuntimeError(f"Decoding {path} failed: {err.message} ({debug})")
+                        if msg is None and not sink.get_property("eos"):
+                            raise RuntimeError(f"Decoding {path} stalled after {frames} frames")
+                        break
+                    buf = sample.get_buffer()
+                    frame_size = frame_size or buf.get_size()
+                    out.write(buf.extract_dup(0, frame_size))
+                    frames += 1
+            if not frames:
+                raise RuntimeError(f"No frames decoded from {path} in {self.caps}")
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            pipe.set_state(Gst.State.NULL)
+        # Only a complete ring is ever renamed into place
+        os.replace(tmp, self.path)
+        with open(meta, "w") as f:
+            json.dump({"frame_size": frame_size, "frames": frames, "caps": self.caps}, f)
+
+    def frame(self, index):
+        """A writable buffer for frame index (timestamps are per push) sharing the ring's memory."""
+        return self.buffers[index % self.frames].copy()
+
+
+class FileCamera:
+    """Pushes ring frames into one appsrc at exactly fps, on a schedule that doesn't drift.
+
+    Frame n is due at start + n / fps. When the thread wakes late it records
+    how late; if it falls a whole frame behind it skips ahead rather than
+    bursting, the way a real sensor drops frames.
+    """
+
+    def __init__(self, ring, appsrc):
+        self.ring = ring
+        self.appsrc = appsrc
+        self.running = False
+        self.thread = None
+        self.pushed = 0
+        self.skipped = 0
+        self.late = RollingStats()  # ms behind schedule at push
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.appsrc.get_name(), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+        print(f"{self.appsrc.get_name()}: {self.pushed} frames, {self.skipped} skipped, "
+              f"late ms {self.late.summary()}")
+
+    def run(self):
+        period = 1 / self.ring.fps
+        duration = int(Gst.SECOND / self.ring.fps)
+        start = time.monotonic()
+        n = 0
+        while self.running:
+            delay = start + n * period - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                behind = int(-delay / period)
+                self.skipped += behind
+                n += behind
+            self.late.add(max(-delay, 0) * 1000)
+            buf = self.ring.frame(n)
+            buf.duration = duration
+            self.appsrc.emit("push-buffer", buf)
+            self.pushed += 1
+            n += 1
+
+
+RINGS = {}
+CAMERAS = []
+APPSRC_NAMES = []
+
+
+def file_source_description(caps, fps):
+    """appsrc fragment for one more virtual camera; the clip is decoded now if it isn't cached."""
+    if caps not in RINGS:
+        RINGS[caps] = FrameRing(VIDEO_FILE, caps, fps)
+    name = f"{APPSRC_PREFIX}{len(APPSRC_NAMES)}"
+    APPSRC_NAMES.append((name, caps))
+    # do-timestamp stamps each frame with the running time it is pushed at, like a live camera.
+    # block with a byte limit of a few frames keeps a slow encoder from queueing frames without
+    # bound; the camera thread then falls behind schedule and skips, like a real sensor.
+    max_bytes = APPSRC_FRAMES * RINGS[caps].frame_size
+    return (f"appsrc name={name} is-live=true format=time do-timestamp=true block=true "
+            f"max-buffers={APPSRC_FRAMES} max-bytes={max_bytes} caps={caps}")
+
+
+def start_file_cameras(pipe):
+    for name, caps in APPSRC_NAMES:
+        appsrc = pipe.get_by_name(name)
+        if appsrc:
+            camera = FileCamera(RINGS[caps], appsrc)
+            camera.start()
+            CAMERAS.append(camera)
+
+
+def stop_file_cameras():
+    while CAMERAS:
+        CAMERAS.pop().stop()
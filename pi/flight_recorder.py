@@ -0,0 +1,224 @@
+"""Binary flight recorder for control commands, signaling and setup timing.
+
+Records are fixed 36 byte structs packed into a preallocated ring in
+memory; a background thread appends them to disk, so the GLib, asyncio and
+control threads never wait on a slow terminal or disk. With
+KSCALE_FLIGHT_VIDEO the already-encoded video is saved next to the log by
+splitmuxsink (depayload and mux only, no re-encode).
+
+Dump a log as JSON lines:
+
+    python3 pi/flight_recorder.py flight/flight-1700000000.bin
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+# Directory for logs (and video); recording is off when unset
+FLIGHT_DIR = os.environ.get("KSCALE_FLIGHT_DIR")
+# Write through append-only memory-mapped segments instead of file writes
+FLIGHT_MMAP = os.environ.get("KSCALE_FLIGHT_MMAP", "0") == "1"
+# Also save every encoded video branch with splitmuxsink
+FLIGHT_VIDEO = os.environ.get("KSCALE_FLIGHT_VIDEO", "0") == "1"
+
+RING_RECORDS = 16384
+FLUSH_INTERVAL = 0.5
+MMAP_SEGMENT = 4 * 1024 * 1024
+VIDEO_SEGMENT_NS = 60 * Gst.SECOND
+
+# monotonic time, kind, code, session, flags, reserved, seq, aux, x, y, z. session is
+# the peer session ID for every kind (0 for commands from UDP); flags are command flags.
+RECORD = struct.Struct("<dBBHHHIIfff")
+# magic, version, record size, wall clock and monotonic time at start
+HEADER = struct.Struct("<4sHHdd")
+MAGIC = b"KSFR"
+VERSION = 2
+
+COMMAND, SIGNAL, TIMING = 1, 2, 3
+KINDS = {COMMAND: "command", SIGNAL: "signal", TIMING: "timing"}
+SIGNAL_EVENTS = ["other", "hello", "offer", "answer", "ice", "candidates", "candidate_sent", "close",
+                 "detach", "resume", "ice_restart"]
+TIMING_EVENTS = ["other", "offer", "answer", "remote_description_set", "connected", "first_rtp",
+                 "recovered_resume", "recovered_ice_restart", "recovered_rebuild"]
+SIGNAL_CODES = {event: i for i, event in enumerate(SIGNAL_EVENTS)}
+TIMING_CODES = {event: i for i, event in enumerate(TIMING_EVENTS)}
+
+
+class FlightRecorder:
+    """Preallocated ring of binary records drained to disk by a writer thread.
+
+    record() packs straight into the ring under a short lock; if the writer
+    falls a whole ring behind, the oldest unwritten records are overwritten
+    and counted in self.dropped.
+    """
+
+    def __init__(self, directory=FLIGHT_DIR, use_mmap=FLIGHT_MMAP, capacity=RING_RECORDS):
+        self.directory = directory
+        self.enabled = bool(directory)
+        self.use_mmap = use_mmap
+        self.capacity = capacity
+        self.ring = bytearray(RECORD.size * capacity)
+        self.written = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.path = None
+        self.out = None
+        self.segment = None
+        self.segment_pos = 0
+        self.segment_index = 0
+        self.thread = None
+
+    def start(self):
+        if not self.enabled or self.thread:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"flight-{int(time.time())}.bin")
+        header = HEADER.pack(MAGIC, VERSION, RECORD.size, time.time(), time.monotonic())
+        if self.use_mmap:
+            self.open_segment()
+            self.write_mmap(header)
+        else:
+            self.out = open(self.path, "ab")
+            self.out.write(header)
+        self.thread = threading.Thread(target=self.run, name="flight-recorder", daemon=True)
+        self.thread.start()
+        print(f"Flight recorder writing to {self.path}{' (mmap)' if self.use_mmap else ''}")
+
+    def record(self, kind, code=0, session=0, seq=0, aux=0, x=0.0, y=0.0, z=0.0, flags=0):
+        if not self.enabled:
+            return
+        with self.lock:
+            RECORD.pack_into(self.ring, (self.written % self.capacity) * RECORD.size,
+                             time.monotonic(), kind, code, session & 0xFFFF, flags & 0xFFFF, 0,
+                             seq & 0xFFFFFFFF, aux & 0xFFFFFFFF, x, y, z)
+            self.written += 1
+
+    def command(self, frame):
+        """ControlDispatcher handler."""
+        if not self.enabled:
+            return
+        sender = frame.channel[0] if frame.channel else None
+        self.record(COMMAND, frame.motion, sender or 0, frame.seq, 0, frame.x, frame.y, frame.z, frame.flags)
+
+    def signal(self, session, event, size=0):
+        if not self.enabled:
+            return
+        self.record(SIGNAL, SIGNAL_CODES.get(event, 0), session, aux=size)
+
+    def timing(self, session, event, ms):
+        if not self.enabled:
+            return
+        self.record(TIMING, TIMING_CODES.get(event, 0), session, x=ms)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            written = self.written
+            start = max(self.flushed, written - self.capacity)
+            self.dropped += start - self.flushed
+            count = written - start
+            begin = start % self.capacity
+            # Up to the end of the ring, then wrapped round from the front
+            head = min(count, self.capacity - begin)
+            chunks = [bytes(self.ring[begin * RECORD.size:(begin + head) * RECORD.size])]
+            if count > head:
+                chunks.append(bytes(self.ring[:(count - head) * RECORD.size]))
+            self.flushed = written
+        for chunk in chunks:
+            if self.use_mmap:
+                self.write_mmap(chunk)
+            else:
+                self.out.write(chunk)
+        if self.out:
+            self.out.flush()
+
+    def open_segment(self):
+        path = self.path if self.segment_index == 0 else f"{self.path}.{self.segment_index}"
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(fd, MMAP_SEGMENT)
+        if self.segment:
+            self.segment.close()
+        self.segment = mmap.mmap(fd, MMAP_SEGMENT)
+        os.close(fd)
+        self.segment_pos = 0
+        self.segment_index += 1
+
+    def write_mmap(self, data):
+        # Records are only ever appended; a full segment rolls over to path.N
+        while data:
+            room = MMAP_SEGMENT - self.segment_pos
+            if room == 0:
+                self.open_segment()
+                continue
+            part = data[:room]
+            self.segment[self.segment_pos:self.segment_pos + len(part)] = part
+            self.segment_pos += len(part)
+            data = data[room:]
+
+
+def record_video(pipe, branch, directory=FLIGHT_DIR):
+    """Save a video branch's encoded stream by depayloading off its tee into splitmuxsink."""
+    encoder = branch.encoder
+    if not encoder or not encoder.depayloader:
+        return None
+    location = os.path.join(directory, f"{branch.name}-{int(time.time())}-%05d.mkv")
+    # Leaky so a slow disk drops recorded frames rather than stalling the live tee
+    # A simulcast branch's tee already carries encoded frames (its top layer)
+    unpack = encoder.depayloader if branch.payloaded else (encoder.parser or "identity")
+    desc = (f"queue max-size-time={2 * Gst.SECOND} max-size-buffers=0 max-size-bytes=0 leaky=downstream ! "
+            f"{unpack} ! splitmuxsink muxer=matroskamux send-keyframe-requests=true "
+            f"max-size-time={VIDEO_SEGMENT_NS} location={location}")
+    recorder = Gst.parse_bin_from_description(desc, True)
+    recorder.set_name(f"{branch.name}_recorder")
+    pipe.add(recorder)
+    branch.tee.get_request_pad("src_%u").link(recorder.get_static_pad("sink"))
+    print(f"Recording {branch.name} to {location}")
+    return recorder
+
+
+def read_records(path):
+    """Yield dicts for every record in a log written by FlightRecorder (and its mmap segments)."""
+    paths = [path]
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        paths.append(f"{path}.{i}")
+        i += 1
+    data = b"".join(open(p, "rb").read() for p in paths)
+    magic, version, size, wall, mono = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or size != RECORD.size:
+        raise ValueError(f"{path} is not a version {VERSION} flight log")
+    for offset in range(HEADER.size, len(data) - size + 1, size):
+        t, kind, code, session, flags, _, seq, aux, x, y, z = RECORD.unpack_from(data, offset)
+        if kind == 0:
+            break  # unused tail of an mmap segment
+        record = {"time": round(wall + t - mono, 6), "kind": KINDS.get(kind, kind), "session": session}
+        if kind == COMMAND:
+            record.update(motion=code, flags=flags, seq=seq, x=x, y=y, z=z)
+        elif kind == SIGNAL:
+            record.update(event=SIGNAL_EVENTS[code], bytes=aux)
+        elif kind == TIMING:
+            record.update(event=TIMING_EVENTS[code], ms=round(x, 1))
+        yield record
+
+
+RECORDER = FlightRecorder()
+
+
+if __name__ == "__main__":
+    for record in read_records(sys.argv[1]):
+        print(json.dumps(record))
@@ -0,0 +1,51 @@
+import threading
+
+from gi.repository import GLib
+
+
+class GLibBridge:
+    """Runs the default GLib main context on its own thread.
+
+    GStreamer signals (bus watches, webrtcbin callbacks, data channel
+    messages) are dispatched by GLib as soon as they fire instead of waiting
+    for the next asyncio poll tick. Work is handed to asyncio with
+    loop.call_soon_threadsafe() and to GLib with GLib.idle_add(), both of
+    which wake the target loop immediately.
+
+    Threading rule: the Python state of the servers (SessionManager,
+    PeerSession, SignalingChannel, the pipeline reference) belongs to the
+    asyncio thread. Callbacks that GStreamer runs on the GLib thread or a
+    streaming thread (signals, bus messages, promise replies, pad probes) may
+    read that state from a snapshot, e.g. list(sessions.values()), but hand
+    anything that changes it to asyncio with loop.call_soon_threadsafe().
+    The asyncio side talks to GStreamer directly (action signals, element
+    state, adding and removing elements), which GStreamer locks itself.
+
+    Two exceptions, each documented where it lives: pad-added handlers link
+    the peer's receive path in place, because the pad must be linked before
+    the handler returns; and the control path (ControlDispatcher into the
+    mailboxes) runs on whichever thread delivers the message, with state kept
+    per channel and handed over by single assignment. Components that live
+    entirely in GLib timeouts (AdaptiveBitrate, Metrics sampling, RenderPath
+    reports) keep their own state on the GLib thread.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.context = GLib.MainContext.default()
+        self.main_loop = GLib.MainLoop.new(self.context, False)
+        self.thread = None
+
+    def start(self):
+        if self.thread:
+            return
+        self.thread = threading.Thread(target=self.main_loop.run, name="glib-main", daemon=True)
+        self.thread.start()
+        print("GLib main loop running on", self.thread.name)
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.main_loop.quit()
+        self.thread.join(timeout=1.0)
+        self.thread = None
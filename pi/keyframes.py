@@ -0,0 +1,69 @@
+"""Keyframes on request: receiver feedback, new peers and layer switches, coalesced per encoder.
+
+Encoders run a long GOP (encoders.KEYFRAME_INTERVAL) as a safety net only.
+PLI/FIR from any peer's webrtcbin arrives as an upstream GstForceKeyUnit
+event; MediaBranch catches it on that peer's link and asks here instead of
+letting every copy reach the shared encoder. A request within
+KEYFRAME_COALESCE_MS of the last keyframe forced is dropped, since that
+keyframe is already on its way to every peer of the encoder.
+"""
+import os
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+KEYFRAME_COALESCE_MS = float(os.environ.get("KSCALE_KEYFRAME_COALESCE_MS", "300"))
+
+# Why a keyframe was asked for
+REASONS = ("pli", "fir", "join", "layer")
+
+
+class KeyframeRequests:
+    """Counts and rate-limits forced keyframes for one encoder.
+
+    admit() is called from streaming threads (feedback) and the GLib thread
+    (joins, layer switches), so it takes a lock.
+    """
+
+    def __init__(self, window_ms=KEYFRAME_COALESCE_MS):
+        self.window = window_ms / 1000
+        self.last_forced = -self.window
+        self.lock = threading.Lock()
+        self.forced = dict.fromkeys(REASONS, 0)
+        self.coalesced = dict.fromkeys(REASONS, 0)
+        # Every keyframe the encoder produced, forced or from the GOP
+        self.encoded = 0
+
+    def admit(self, reason):
+        """True if a keyframe should be forced now for reason, False if one just was."""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_forced < self.window:
+                self.coalesced[reason] += 1
+                return False
+            self.last_forced = now
+            self.forced[reason] += 1
+        return True
+
+    def on_encoded(self, pad, info):
+        if not info.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+            self.encoded += 1
+        return Gst.PadProbeReturn.OK
+
+    def stats(self):
+        return {"encoded": self.encoded, "forced": dict(self.forced), "coalesced": dict(self.coalesced)}
+
+
+def feedback_reason(event):
+    """The reason ("pli" or "fir") for a GstForceKeyUnit event from rtpsession, None for any other event."""
+    if event.type != Gst.EventType.CUSTOM_UPSTREAM:
+        return None
+    structure = event.get_structure()
+    if not structure or structure.get_name() != "GstForceKeyUnit":
+        return None
+    # rtpsession sets all-headers only for FIR (full intra request); PLI just needs a keyframe
+    all_headers = structure.has_field("all-headers") and structure.get_value("all-headers")
+    return "fir" if all_headers else "pli"
@@ -0,0 +1,104 @@
+import os
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+# Named trade-off between latency and smoothness/quality, applied to every pipeline the servers build
+LATENCY_PROFILE = os.environ.get("KSCALE_LATENCY_PROFILE", "balanced")
+
+QUEUE_LEAKY = {"no": 0, "upstream": 1, "downstream": 2}
+JITTERBUFFER_MODES = {"none": 0, "slave": 1, "buffer": 2, "synced": 4}
+
+
+class LatencyProfile:
+    """Every latency-relevant knob in one place.
+
+    jitterbuffer_latency is the receive jitter buffer size in ms (webrtcbin
+    and any standalone rtpjitterbuffer). queue_buffers/queue_leaky bound each
+    queue the servers create; a leaky queue drops frames instead of letting
+    delay build up. encoder_deadline is the libvpx per-frame deadline in us
+    (1 = realtime) and encoder_lookahead the frames an encoder may hold back
+    for rate control; hardware encoders ignore both.
+    """
+
+    def __init__(self, name, jitterbuffer_latency, jitterbuffer_mode, drop_on_latency,
+                 queue_buffers, queue_leaky, sink_sync, encoder_deadline, encoder_lookahead):
+        self.name = name
+        self.jitterbuffer_latency = jitterbuffer_latency
+        self.jitterbuffer_mode = jitterbuffer_mode
+        self.drop_on_latency = drop_on_latency
+        self.queue_buffers = queue_buffers
+        self.queue_leaky = queue_leaky
+        self.sink_sync = sink_sync
+        self.encoder_deadline = encoder_deadline
+        self.encoder_lookahead = encoder_lookahead
+
+    def queue_description(self, name=None):
+        """gst-launch fragment for a queue bounded by buffer count only."""
+        desc = "queue"
+        if name:
+            desc += f" name={name}"
+        return (f"{desc} max-size-buffers={self.queue_buffers} max-size-bytes=0 "
+                f"max-size-time=0 leaky={self.queue_leaky}")
+
+    def configure_queue(self, queue):
+        queue.set_property("max-size-buffers", self.queue_buffers)
+        queue.set_property("max-size-bytes", 0)
+        queue.set_property("max-size-time", 0)
+        queue.set_property("leaky", QUEUE_LEAKY[self.queue_leaky])
+        return queue
+
+    def make_queue(self, name=None):
+        return self.configure_queue(Gst.ElementFactory.make("queue", name))
+
+    def configure_jitterbuffer(self, el):
+        """Apply to an rtpjitterbuffer, or to the rtpbin inside a webrtcbin."""
+        el.set_property("latency", self.jitterbuffer_latency)
+        el.set_property("drop-on-latency", self.drop_on_latency)
+        mode = JITTERBUFFER_MODES[self.jitterbuffer_mode]
+        el.set_property("mode" if el.find_property("mode") else "buffer-mode", mode)
+
+    def configure_webrtc(self, webrtc):
+        webrtc.set_property("latency", self.jitterbuffer_latency)
+        rtpbin = webrtc.get_by_name("rtpbin")
+        if rtpbin:
+            self.configure_jitterbuffer(rtpbin)
+
+    def configure_sink(self, sink):
+        if sink.find_property("sync"):
+            sink.set_property("sync", self.sink_sync)
+
+    def summary(self):
+        return dict(vars(self))
+
+
+PROFILES = {
+    # Operator feedback: smallest buffers, drop rather than wait, show frames as they arrive
+    "teleop-min": LatencyProfile(
+        "teleop-min", jitterbuffer_latency=30, jitterbuffer_mode="none", drop_on_latency=True,
+        queue_buffers=1, queue_leaky="downstream", sink_sync=False,
+        encoder_deadline=1, encoder_lookahead=0,
+    ),
+    # The previous defaults (200 ms jitter buffer, clock-synced sinks) with bounded queues
+    "balanced": LatencyProfile(
+        "balanced", jitterbuffer_latency=200, jitterbuffer_mode="slave", drop_on_latency=True,
+        queue_buffers=5, queue_leaky="downstream", sink_sync=True,
+        encoder_deadline=1, encoder_lookahead=0,
+    ),
+    # Nothing dropped, smoother rate control; a second or so of delay is fine
+    "recording": LatencyProfile(
+        "recording", jitterbuffer_latency=500, jitterbuffer_mode="slave", drop_on_latency=False,
+        queue_buffers=30, queue_leaky="no", sink_sync=True,
+        encoder_deadline=33000, encoder_lookahead=10,
+    ),
+}
+
+
+def get_profile(name=LATENCY_PROFILE):
+    if name not in PROFILES:
+        raise ValueError(f"Unknown latency profile {name!r}, expected one of {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+
+PROFILE = get_profile()
@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+# JSON-lines file of per-frame stage times, written only when set (used by bench_latency.py)
+LATENCY_TRACE = os.environ.get("KSCALE_LATENCY_TRACE")
+FLUSH_INTERVAL_MS = 1000
+
+
+def rtp_header(buf):
+    """(rtp timestamp, marker) read straight from the 12 byte RTP header."""
+    head = buf.extract_dup(0, 12)
+    return int.from_bytes(head[4:8], "big"), bool(head[1] & 0x80)
+
+
+class LatencyTracer:
+    """Per-frame capture/encode/payload times for one video branch, keyed by RTP timestamp.
+
+    Times are time.monotonic() seconds so a receiver on the same host can
+    join its own probe times on the RTP timestamp.
+    """
+
+    def __init__(self, branch, path=LATENCY_TRACE):
+        self.branch = branch.name
+        self.out = open(path, "a", buffering=1)
+        self.frames = {}
+        self.done = []
+        source = next(iter(branch.bin.iterate_sources()), None) if branch.bin else None
+        enc = branch.get_element(branch.encoder_name)
+        pay = branch.get_element(f"{branch.encoder_name}_pay")
+        if not (source and enc and pay):
+            print(f"Latency trace: can't find source/encoder/payloader in {branch.name}")
+            return
+        mixer = branch.get_element("stereo_mix") if branch.stereo else None
+        if mixer:
+            # Eye buffers keep their own capture PTS; the mixed frame gets a new one
+            self.eyes = {}
+            for pad in mixer.iterate_sink_pads():
+                pad.add_probe(Gst.PadProbeType.BUFFER, self.on_eye)
+            mixer.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_mixed)
+        else:
+            source.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_stage, "captured")
+        enc.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self.on_stage, "encode_in")
+        enc.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_stage, "encoded")
+        pay.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_payloaded)
+        GLib.timeout_add(FLUSH_INTERVAL_MS, self.flush)
+
+    def on_stage(self, pad, info, stage):
+        frame = self.frames.setdefault(info.get_buffer().pts, {})
+        frame.setdefault(stage, time.monotonic())
+        return Gst.PadProbeReturn.OK
+
+    def on_eye(self, pad, info):
+        self.eyes[pad.get_name()] = (info.get_buffer().pts, time.monotonic())
+        return Gst.PadProbeReturn.OK
+
+    def on_mixed(self, pad, info):
+        if len(self.eyes) < 2:
+            return Gst.PadProbeReturn.OK
+        frame = self.frames.setdefault(info.get_buffer().pts, {})
+        pts = [p for p, _ in self.eyes.values()]
+        frame["captured"] = min(t for _, t in self.eyes.values())
+        # Capture timestamp difference between the two halves of this frame
+        frame["eye_skew_ms"] = abs(pts[0] - pts[1]) / Gst.MSECOND
+        return Gst.PadProbeReturn.OK
+
+    def on_payloaded(self, pad, info):
+        buf = info.get_buffer()
+        now = time.monotonic()
+        rtp_ts, marker = rtp_header(buf)
+        frame = self.frames.get(buf.pts)
+        if frame is None:
+            return Gst.PadProbeReturn.OK
+        frame.setdefault("payloaded", now)
+        if marker:
+            # Last packet of the frame has left the payloader
+            frame["rtp_ts"] = rtp_ts
+            frame["branch"] = self.branch
+            self.done.append(self.frames.pop(buf.pts))
+        return Gst.PadProbeReturn.OK
+
+    def flush(self):
+        done, self.done = self.done, []
+        for frame in done:
+            self.out.write(json.dumps(frame) + "\n")
+        # Frames dropped inside the encoder never reach the payloader
+        if len(self.frames) > 300:
+            self.frames.clear()
+        return GLib.SOURCE_CONTINUE
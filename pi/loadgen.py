@@ -0,0 +1,181 @@
+"""Headless load generator: many WebRTCClients against one running server.
+
+Each client connects with HELLO {"echo": true}, receives and decodes the
+video, and sends control messages at --rate Hz on the --channel data
+channel (by default the unreliable velocity channel, so nothing hides loss
+behind retransmits). The server sends every message straight back on that
+channel, so the sender matches echoes by sequence number: anything not
+echoed is lost, and one-way latency is half the echo round trip. Clients reconnect every
+--reconnect seconds (0 = never) and time each connect from HELLO to the
+data channel opening and to the first decoded frame.
+
+    python3 pi/loadgen.py --url ws://robot.local:8765 --clients 8 --rate 100 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+from gi.repository import Gst, GstWebRTC, GLib
+
+Gst.init(None)
+
+from bench_latency import summarize
+from client import WebRTCClient
+from control_frames import FRAME, VELOCITY_CHANNEL, encode_frame
+from glib_bridge import GLibBridge
+
+# Messages sent this close to the end of a connection are not counted, their echo may still be on the way
+ECHO_GRACE = 1.0
+
+
+class ControlSender:
+    """Numbered control messages on one data channel, matched against their echoes."""
+
+    def __init__(self, fmt="binary", size=0):
+        self.fmt = fmt
+        self.size = size
+        self.seq = 0
+        self.channel = None
+        self.in_flight = {}
+        self.sent = 0
+        self.echoed = 0
+        self.rtts = []
+
+    def attach(self, channel):
+        self.channel = channel
+        channel.connect("on-message-data", self.on_data)
+        channel.connect("on-message-string", self.on_string)
+
+    def send(self):
+        self.seq += 1
+        now = time.monotonic()
+        if self.fmt == "binary":
+            # Binary frames are always FRAME.size bytes; the server rejects anything else
+            self.channel.emit("send-data", GLib.Bytes.new(encode_frame(self.seq, 0.0, 0.0, 0.0)))
+        else:
+            message = {"x": 0.0, "y": 0.0, "z": 0.0, "seq": self.seq}
+            text = json.dumps(message)
+            padding = self.size - len(text) - len(', "pad": ""')
+            if padding > 0:
+                message["pad"] = "x" * padding
+                text = json.dumps(message)
+            self.channel.emit("send-string", text)
+        self.in_flight[self.seq] = now
+        self.sent += 1
+
+    def on_data(self, channel, data):
+        self.matched(FRAME.unpack_from(data.get_data())[3])
+
+    def on_string(self, channel, message):
+        self.matched(json.loads(message).get("seq"))
+
+    def matched(self, seq):
+        sent_at = self.in_flight.pop(seq, None)
+        if sent_at is not None:
+            self.echoed += 1
+            self.rtts.append((time.monotonic() - sent_at) * 1000)
+
+
+def channel_open(client, label=VELOCITY_CHANNEL):
+    for channel in client.channels:
+        if channel.props.label == label and channel.get_property("ready-state") == GstWebRTC.WebRTCDataChannelState.OPEN:
+            return channel
+    return None
+
+
+async def connect_once(index, args, seconds, stats):
+    client = WebRTCClient(args.url, name=f"load{index}", keep_frames=False, options={"echo": True})
+    sender = ControlSender(args.format, args.size)
+    task = asyncio.create_task(client.run(seconds))
+    interval = 1 / args.rate if args.rate else None
+    stop_sending = time.monotonic() + seconds - ECHO_GRACE
+    while not task.done():
+        await asyncio.sleep(interval or 0.05)
+        if sender.channel is None:
+            channel = channel_open(client, args.channel)
+            if channel:
+                sender.attach(channel)
+                stats["connect_ms"].append((time.monotonic() - client.started_at) * 1000)
+        elif interval and time.monotonic() < stop_sending:
+            sender.send()
+    await task
+
+    stats["cycles"] += 1
+    stats["sent"] += sender.sent
+    stats["echoed"] += sender.echoed
+    stats["one_way_ms"] += [rtt / 2 for rtt in sender.rtts]
+    first = [p.first_frame_at for p in client.probes if p.first_frame_at]
+    if first:
+        stats["first_frame_ms"].append((min(first) - client.started_at) * 1000)
+        elapsed = client.started_at + seconds - min(first)
+        frames = sum(p.frames for p in client.probes)
+        stats["fps"].append(frames / len(client.probes) / elapsed)
+
+
+async def run_client(index, args):
+    stats = {"cycles": 0, "sent": 0, "echoed": 0, "one_way_ms": [], "connect_ms": [],
+             "first_frame_ms": [], "fps": []}
+    await asyncio.sleep(index * args.ramp)
+    end = time.monotonic() + args.duration
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= ECHO_GRACE:
+            break
+        seconds = min(args.reconnect, remaining) if args.reconnect else remaining
+        try:
+            await connect_once(index, args, seconds, stats)
+        except OSError as e:
+            print(f"load{index}: connect failed: {e}")
+            await asyncio.sleep(1)
+    return stats
+
+
+def report(results, args):
+    sent = sum(s["sent"] for s in results)
+    echoed = sum(s["echoed"] for s in results)
+    fps = [f for s in results for f in s["fps"]]
+    return {
+        "clients": args.clients,
+        "rate_hz": args.rate,
+        "format": args.format,
+        "channel": args.channel,
+        "connections": sum(s["cycles"] for s in results),
+        "messages_sent": sent,
+        "messages_echoed": echoed,
+        "loss_pct": round((sent - echoed) / sent * 100, 3) if sent else None,
+        "one_way_latency": summarize([v for s in results for v in s["one_way_ms"]]),
+        "connect_to_channel": summarize([v for s in results for v in s["connect_ms"]]),
+        "connect_to_first_frame": summarize([v for s in results for v in s["first_frame_ms"]]),
+        "received_fps_per_stream": round(sum(fps) / len(fps), 2) if fps else None,
+        "per_client": [{"loss_pct": round((s["sent"] - s["echoed"]) / s["sent"] * 100, 3) if s["sent"] else None,
+                        "connections": s["cycles"]} for s in results],
+    }
+
+
+async def main(args):
+    loop = asyncio.get_running_loop()
+    bridge = GLibBridge(loop)
+    bridge.start()
+    try:
+        results = await asyncio.gather(*(run_client(i, args) for i in range(args.clients)))
+    finally:
+        bridge.stop()
+    print(json.dumps(report(results, args), indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="ws://127.0.0.1:8765")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--rate", type=float, default=50.0, help="control messages per second per client (0 = none)")
+    parser.add_argument("--format", choices=["binary", "json"], default="binary")
+    parser.add_argument("--channel", default=VELOCITY_CHANNEL, help="data channel label to send on")
+    parser.add_argument("--size", type=int, default=0, help="pad JSON messages to this many bytes")
+    parser.add_argument("--reconnect", type=float, default=0.0, help="reconnect every N seconds (0 = never)")
+    parser.add_argument("--ramp", type=float, default=0.2, help="seconds between client starts")
+    asyncio.run(main(parser.parse_args()))
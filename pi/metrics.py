@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from control_loop import RollingStats
+
+# Prometheus text endpoint on localhost; 0 turns it off
+METRICS_PORT = int(os.environ.get("KSCALE_METRICS_PORT", "9108"))
+# Pad probes are only installed for SAMPLE_WINDOW_MS out of every SAMPLE_INTERVAL_MS
+SAMPLE_INTERVAL_MS = 5000
+SAMPLE_WINDOW_MS = 500
+# In-flight frames tracked between encoder sink and src (pts -> time), by pts slot
+ENCODE_SLOTS = 64
+
+
+class BranchSampler:
+    """Capture FPS and per-frame encode time for one MediaBranch, measured in short windows.
+
+    Buffer probes cost a Python call per buffer, so they are only attached
+    for SAMPLE_WINDOW_MS at a time and removed again. Encode start times go
+    into fixed arrays indexed by pts, so a window allocates nothing per frame
+    beyond what the probe call itself does.
+    """
+
+    def __init__(self, branch):
+        self.branch = branch
+        self.slot_pts = array('Q', bytes(8 * ENCODE_SLOTS))
+        self.slot_start = array('d', bytes(8 * ENCODE_SLOTS))
+        self.frames = array('L', bytes(4 * 4))
+        self.encode = RollingStats(256)  # ms
+        self.probes = []
+        self.window_start = 0.0
+        self.fps = {}
+
+    def sample(self):
+        branch = self.branch
+        if not branch.bin or self.probes:
+            return
+        enc = branch.get_element(branch.encoder_name)
+        sources = list(branch.bin.iterate_sources())[:len(self.frames)]
+        for i, source in enumerate(sources):
+            self.frames[i] = 0
+            pad = source.get_static_pad("src")
+            self.probes.append((pad, pad.add_probe(Gst.PadProbeType.BUFFER, self.on_captured, i)))
+        if enc:
+            for name, callback in (("sink", self.on_encode_in), ("src", self.on_encoded)):
+                pad = enc.get_static_pad(name)
+                self.probes.append((pad, pad.add_probe(Gst.PadProbeType.BUFFER, callback)))
+        self.window_start = time.monotonic()
+        GLib.timeout_add(SAMPLE_WINDOW_MS, self.finish, [s.get_name() for s in sources])
+
+    def finish(self, source_names):
+        for pad, probe_id in self.probes:
+            pad.remove_probe(probe_id)
+        self.probes = []
+        elapsed = time.monotonic() - self.window_start
+        self.fps = {name: self.frames[i] / elapsed for i, name in enumerate(source_names)}
+        return GLib.SOURCE_REMOVE
+
+    def on_captured(self, pad, info, index):
+        self.frames[index] += 1
+        return Gst.PadProbeReturn.OK
+
+    def on_encode_in(self, pad, info):
+        pts = info.get_buffer().pts
+        slot = (pts // 1000) % ENCODE_SLOTS
+        self.slot_pts[slot] = pts
+        self.slot_start[slot] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def on_encoded(self, pad, info):
+        pts = info.get_buffer().pts
+        slot = (pts // 1000) % ENCODE_SLOTS
+        if self.slot_pts[slot] == pts:
+            self.encode.add((time.perf_counter() - self.slot_start[slot]) * 1000)
+        return Gst.PadProbeReturn.OK
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class Metrics:
+    """Serves the streaming and control path state at http://127.0.0.1:METRICS_PORT/metrics.
+
+    Everything except capture FPS and encode time is read from counters the
+    components already keep (SessionManager, SignalingChannel, AdaptiveBitrate,
+    ControlDispatcher, ControlLoop) when the endpoint is scraped, so there is
+    no extra work between scrapes.
+    """
+
+    def __init__(self, server, port=METRICS_PORT):
+        self.server = server
+        self.port = port
+        self.samplers = {}
+        self.httpd = None
+
+    def start(self):
+        if not self.port:
+            return
+        GLib.timeout_add(SAMPLE_INTERVAL_MS, self.sample)
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True).start()
+        print(f"Metrics on http://127.0.0.1:{self.port}/metrics")
+
+    def sample(self):
+        for branch in self.server.sessions.branches:
+            if not branch.encoder_name:
+                continue
+            if branch.name not in self.samplers:
+                self.samplers[branch.name] = BranchSampler(branch)
+            self.samplers[branch.name].sample()
+        return GLib.SOURCE_CONTINUE
+
+    def render(self):
+        out = []
+
+        def family(name, kind, help_text, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                out.append(f"{name}{format_labels(labels)} {value}")
+
+        manager = self.server.sessions
+        sessions = list(manager.sessions.values())
+        family("kscale_sessions", "gauge", "Connected peers.", [({}, len(sessions))])
+        family("kscale_sessions_opened_total", "counter", "Peer sessions opened.", [({}, manager.opened)])
+        states = {}
+        for session in sessions:
+            states[session.state] = states.get(session.state, 0) + 1
+        family("kscale_session_state", "gauge", "Peers per session state (detached: websocket lost, media up).",
+               [({"state": state}, count) for state, count in states.items()])
+        family("kscale_session_recoveries_total", "counter",
+               "Sessions recovered by path: resume (signaling only), ice_restart, rebuild.",
+               [({"path": path}, stats.count) for path, stats in manager.recovery.items()])
+        family("kscale_session_recovery_seconds", "gauge", "Time to recover over recent recoveries, per path.",
+               [({"path": path, "stat": stat}, summary[stat] / 1000)
+                for path, summary in ((p, st.summary()) for p, st in manager.recovery.items())
+                if summary["n"] for stat in ("mean", "p99", "max")])
+        family("kscale_session_resume_misses_total", "counter", "HELLOs that asked to resume an expired session.",
+               [({}, manager.resume_misses)])
+
+        totals = dict(manager.closed_totals)
+        for session in sessions:
+            for key, value in session.signaling.stats().items():
+                if key in totals:
+                    totals[key] += value
+            totals["candidates_received"] += session.candidates_received
+        family("kscale_signaling_messages_sent_total", "counter", "Signaling messages written to websockets.",
+               [({}, totals["sent"])])
+        family("kscale_signaling_candidate_batches_total", "counter", "Batched candidate messages sent.",
+               [({}, totals["batches"])])
+        family("kscale_signaling_candidates_total", "counter", "ICE candidates exchanged.",
+               [({"direction": "sent"}, totals["candidates"]),
+                ({"direction": "received"}, totals["candidates_received"])])
+
+        samplers = list(self.samplers.values())
+        family("kscale_capture_fps", "gauge", "Frames per second leaving each camera source (sampled).",
+               [({"branch": s.branch.name, "source": name}, round(fps, 2))
+                for s in samplers for name, fps in s.fps.items()])
+        encode = [(s.branch.name, s.encode.summary()) for s in samplers]
+        family("kscale_encode_seconds", "gauge", "Per-frame encode time over recent sampled frames.",
+               [({"branch": name, "stat": stat}, summary[stat] / 1000)
+                for name, summary in encode if summary["n"] for stat in ("mean", "p99", "max")])
+
+        abr = getattr(self.server, "abr", None)
+        if abr:
+            family("kscale_encoder_target_bitrate_bps", "gauge", "Bitrate the encoders are asked for.",
+                   [({"branch": b.name}, round(abr.controller.target * 1000 * b.tile[0] * b.tile[1]))
+                    for b in manager.branches if b.encoder])
+            peers = list(abr.peer_samples.items())
+            family("kscale_outbound_bytes_total", "counter", "RTP bytes sent to each peer.",
+                   [({"peer": sid}, s[4]) for sid, s in peers])
+            family("kscale_rtt_seconds", "gauge", "Round-trip time reported by each peer.",
+                   [({"peer": sid}, s[1]) for sid, s in peers])
+            family("kscale_fraction_lost", "gauge", "Fraction of packets each peer reported lost.",
+                   [({"peer": sid}, s[0]) for sid, s in peers])
+            family("kscale_jitter_seconds", "gauge", "Interarrival jitter reported by each peer.",
+                   [({"peer": sid}, s[2]) for sid, s in peers])
+
+        keyframes = [(branch.name, layer, requests.stats()) for branch in manager.branches if branch.encoder_name
+                     for layer, requests in enumerate(getattr(branch, "layer_keyframes", [branch.keyframes]))]
+        family("kscale_keyframes_requested_total", "counter",
+               "Keyframe requests by reason: forced, or coalesced into one forced just before.",
+               [({"branch": name, "layer": layer, "reason": reason, "result": result}, count)
+                for name, layer, stats in keyframes for result in ("forced", "coalesced")
+                for reason, count in stats[result].items()])
+        family("kscale_keyframes_encoded_total", "counter", "Keyframes produced, requested or from the GOP.",
+               [({"branch": name, "layer": layer}, stats["encoded"]) for name, layer, stats in keyframes])
+
+        simulcast = [(session.id, branch.name, link) for session in sessions
+                     for branch, link in zip(manager.branches, session.links) if branch.layers]
+        if simulcast:
+            family("kscale_simulcast_layer", "gauge", "Simulcast layer forwarded to each peer (0 is the largest).",
+                   [({"peer": sid, "branch": name}, link.layer) for sid, name, link in simulcast])
+            family("kscale_simulcast_switches_total", "counter", "Keyframe-aligned layer switches per peer.",
+                   [({"peer": sid, "branch": name}, link.switches) for sid, name, link in simulcast])
+
+        control = self.server.control
+        family("kscale_control_messages_total", "counter", "Data channel control messages.",
+               [({"result": "decoded"}, control.decoded), ({"result": "rejected"}, control.rejected)])
+        family("kscale_control_decode_seconds_total", "counter", "Time spent decoding control messages.",
+               [({}, round(control.decode_seconds, 6))])
+        channels = control.stats()
+        family("kscale_datachannel_messages_total", "counter",
+               "Control messages per data channel: delivered, late (overtaken), dropped (sequence gaps), rejected.",
+               [({"channel": label or "udp", "result": result}, value)
+                for label, summary in channels.items() for result, value in summary.items()])
+        pose = getattr(self.server, "pose", None)
+        if pose:
+            family("kscale_pose_frames_total", "counter", "Headset pose frames received.",
+                   [({"result": "accepted"}, pose.accepted), ({"result": "stale"}, pose.stale_dropped)])
+            age = pose.age.summary()
+            family("kscale_pose_age_seconds", "gauge", "Sender clock to robot arrival for recent poses.",
+                   [({"stat": stat}, age[stat] / 1000) for stat in ("mean", "p99", "max") if age["n"]])
+        loop = getattr(self.server, "control_loop", None)
+        if loop:
+            family("kscale_control_ticks_total", "counter", "Control loop ticks.", [({}, loop.ticks)])
+            family("kscale_control_timeouts_total", "counter", "Ticks that decayed to a stop for lack of commands.",
+                   [({}, loop.timeouts)])
+        return "\n".join(out) + "\n"
@@ -0,0 +1,118 @@
+import itertools
+import os
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from latency_profile import PROFILE
+
+# Frames later than this at the sink are skipped rather than shown
+RENDER_MAX_LATENESS = 20 * Gst.MSECOND
+RENDER_REPORT_INTERVAL_MS = 10000
+# Optional "WxH" to scale on the CPU for sinks that can't scale themselves (e.g. fbdevsink)
+RENDER_SIZE = os.environ.get("KSCALE_RENDER_SIZE")
+
+
+class RenderPath:
+    """Bounded, leaky queue ! [videoconvert] ! sink for one decoded operator stream.
+
+    The default queue holds up to a second of video, so a slow sink turns
+    straight into display latency. Here the queue is sized by the latency
+    profile and (unless the profile says otherwise) drops the oldest frame
+    when full, and the sink skips frames that are already late. The sink
+    gets the decoder's native size and does any scaling itself; videoconvert
+    is only inserted when the sink can't take the decoded format, and CPU
+    scaling only when RENDER_SIZE is set. A pad without caps yet (a decoder
+    created in the same pad-added) gets the path built on its first caps
+    event instead, so the decision is made on the real format.
+
+    Queue depth and dropped frames (queue overruns and late frames skipped
+    by the sink) are printed every RENDER_REPORT_INTERVAL_MS.
+    """
+
+    ids = itertools.count(1)
+
+    def __init__(self, sink_factory="autovideosink", profile=PROFILE):
+        self.name = f"render{next(RenderPath.ids)}"
+        self.sink_factory = sink_factory
+        self.profile = profile
+        self.queue = None
+        self.sink = None
+        self.max_depth = 0
+        self.overruns = 0
+
+    def link(self, session, pad):
+        """Build the path inside session and link pad (decoded video) to it, now or once it has caps."""
+        caps = pad.get_current_caps()
+        if caps is None:
+            pad.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_pad_event, session)
+            return True
+        return self.build(session, pad, caps)
+
+    def on_pad_event(self, pad, info, session):
+        event = info.get_event()
+        if event.type != Gst.EventType.CAPS:
+            return Gst.PadProbeReturn.OK
+        # Streaming thread, like pad-added; the peer is looked up after probes, so caps go to the new path
+        if not session.closed:
+            self.build(session, pad, event.parse_caps())
+        return Gst.PadProbeReturn.REMOVE
+
+    def build(self, session, pad, caps):
+        self.queue = self.profile.make_queue(f"{self.name}_queue")
+        self.queue.connect("overrun", self.on_overrun)
+        self.sink = Gst.ElementFactory.make(self.sink_factory, f"{self.name}_sink")
+        if not self.sink:
+            print(f"Render {self.name}: no {self.sink_factory}")
+            return False
+        sink = self.sink
+        self.profile.configure_sink(sink)
+        if sink.find_property("max-lateness"):
+            sink.set_property("max-lateness", RENDER_MAX_LATENESS)
+            sink.set_property("qos", True)
+        if sink.find_property("force-aspect-ratio"):
+            sink.set_property("force-aspect-ratio", True)
+        session.add_elements(self.queue, sink)
+
+        chain = [self.queue]
+        sink_caps = sink.get_static_pad("sink").query_caps(None)
+        if RENDER_SIZE or not sink_caps.can_intersect(caps):
+            chain.append(Gst.ElementFactory.make("videoconvert", f"{self.name}_convert"))
+        if RENDER_SIZE:
+            width, height = RENDER_SIZE.split("x")
+            scale = Gst.ElementFactory.make("videoscale", f"{self.name}_scale")
+            capsfilter = Gst.ElementFactory.make("capsfilter", f"{self.name}_size")
+            capsfilter.set_property("caps", Gst.Caps.from_string(
+                f"video/x-raw,width={width},height={height}"))
+            chain += [scale, capsfilter]
+        if len(chain) > 1:
+            session.add_elements(*chain[1:])
+        chain.append(sink)
+        for upstream, downstream in zip(chain, chain[1:]):
+            upstream.link(downstream)
+        pad.link(self.queue.get_static_pad("sink"))
+        print(f"Render {self.name}: {' ! '.join(el.get_factory().get_name() for el in chain)}")
+        GLib.timeout_add(RENDER_REPORT_INTERVAL_MS, self.report)
+        return True
+
+    def on_overrun(self, queue):
+        self.overruns += 1
+        self.max_depth = self.profile.queue_buffers
+
+    def stats(self):
+        depth = self.queue.get_property("current-level-buffers")
+        self.max_depth = max(self.max_depth, depth)
+        stats = {"depth": depth, "max_depth": self.max_depth, "queue_dropped": self.overruns}
+        if self.sink.find_property("stats"):
+            s = self.sink.get_property("stats")
+            stats["rendered"] = s.get_value("rendered")
+            stats["sink_dropped"] = s.get_value("dropped")
+        return stats
+
+    def report(self):
+        if not self.queue.get_parent():
+            # Session closed and removed the elements
+            return GLib.SOURCE_REMOVE
+        print(f"Render {self.name}:", self.stats())
+        return GLib.SOURCE_CONTINUE
@@ -0,0 +1,789 @@
+import asyncio
+import itertools
+import json
+import os
+import secrets
+import time
+
+import websockets
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+gi.require_version('GstSdp', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstWebRTC, GstSdp, GstVideo, GLib
+
+from bitrate import AdaptiveBitrate
+from capture import STEREO_LAYOUTS, report_when_flowing
+from control_frames import DATA_CHANNELS, ControlDispatcher
+from control_loop import ControlLoop, PoseMailbox, RollingStats
+from encoders import select_encoder
+from file_source import start_file_cameras, stop_file_cameras
+from flight_recorder import FLIGHT_DIR, FLIGHT_VIDEO, RECORDER, record_video
+from glib_bridge import GLibBridge
+from keyframes import KeyframeRequests, feedback_reason
+from latency_profile import PROFILE
+from latency_trace import LATENCY_TRACE, LatencyTracer
+from metrics import Metrics
+from signaling import SignalingChannel, parse_hello
+from udp_bridge import UDP_CONTROL_PORT, CommandReceiver, control_output
+
+STUN_SERVER = "stun://stun.l.google.com:19302"
+SIGNALING_PORT = 8765
+# Keep capture and encode PLAYING with no peers so reconnects skip the camera/ISP/encoder restart
+KEEP_WARM = os.environ.get("KSCALE_KEEP_WARM", "1") != "0"
+# How long a session whose websocket dropped keeps streaming, waiting for HELLO {"resume": id}
+RESUME_GRACE = float(os.environ.get("KSCALE_RESUME_GRACE_MS", "30000")) / 1000
+# ICE "disconnected" often heals by itself; restart only if it is still down after this
+ICE_RESTART_DELAY = 2.0
+# An ICE restart that hasn't reconnected after this is tried again
+ICE_RESTART_TIMEOUT = 10.0
+# After this many restarts without reconnecting, the session is rebuilt from scratch
+MAX_ICE_RESTARTS = 3
+ICE_UP = (GstWebRTC.WebRTCICEConnectionState.CONNECTED, GstWebRTC.WebRTCICEConnectionState.COMPLETED)
+# Recovery paths, cheapest first: signaling only, new ICE credentials, new webrtcbin
+RECOVERY_PATHS = ("resume", "ice_restart", "rebuild")
+
+
+class MediaBranch:
+    """One shared capture/encode/payload chain fanned out to every peer through a tee.
+
+    The chain is described with gst-launch syntax and must end in an RTP
+    payloader. Each peer that attaches only gets its own queue after the tee,
+    so extra viewers add RTP/SRTP work but never another encoder.
+
+    A stereo branch carries both eyes in one frame ("sbs" or "tb"); peers
+    are told the layout before the offer so they can split it.
+
+    Keyframes are only forced on request (keyframes.py): PLI/FIR from a
+    peer is caught on its link and coalesced with everyone else's.
+    """
+
+    def __init__(self, name, description, rtp_caps, direction=GstWebRTC.WebRTCRTPTransceiverDirection.SENDRECV,
+                 encoder=None, encoder_name=None, scaler_name=None, stereo=None):
+        self.name = name
+        self.description = description
+        self.rtp_caps = Gst.Caps.from_string(rtp_caps)
+        self.direction = direction
+        # Optional handles for runtime tuning of video branches
+        self.encoder = encoder
+        self.encoder_name = encoder_name
+        self.scaler_name = scaler_name
+        self.stereo = stereo
+        # (columns, rows) of camera frames per encoded frame
+        self.tile = STEREO_LAYOUTS.get(stereo, (1, 1))
+        # Simulcast layers (simulcast.py); a single shared encode has none
+        self.layers = []
+        # False when the tee carries encoded frames rather than RTP
+        self.payloaded = True
+        self.keyframes = KeyframeRequests()
+        self.bin = None
+        self.tee = None
+
+    def build(self, pipe):
+        self.bin = Gst.parse_bin_from_description(self.description, True)
+        self.bin.set_name(self.name)
+        self.tee = Gst.ElementFactory.make("tee", f"{self.name}_tee")
+        self.tee.set_property("allow-not-linked", True)
+        pipe.add(self.bin)
+        pipe.add(self.tee)
+        self.bin.link(self.tee)
+        enc = self.get_element(self.encoder_name)
+        if enc:
+            enc.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.keyframes.on_encoded)
+
+    def force_keyframe(self, reason="join", layer=0):
+        """Ask the encoder for a keyframe unless one was just forced; True if it was asked."""
+        enc = self.get_element(self.encoder_name)
+        if not enc or not self.keyframes.admit(reason):
+            return False
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        enc.get_static_pad("src").send_event(event)
+        return True
+
+    def on_feedback(self, pad, info, link):
+        """Turn a peer's PLI/FIR into a coalesced request instead of passing it up the shared tee."""
+        reason = feedback_reason(info.get_event())
+        if not reason:
+            return Gst.PadProbeReturn.OK
+        self.force_keyframe(reason, self.link_layer(link))
+        return Gst.PadProbeReturn.DROP
+
+    def link_layer(self, link):
+        return 0
+
+    def get_element(self, name):
+        if not self.bin or not name:
+            return None
+        return self.bin.get_by_name(name)
+
+    def teardown(self, pipe):
+        for el in (self.bin, self.tee):
+            if el:
+                el.set_state(Gst.State.NULL)
+                pipe.remove(el)
+        self.bin = None
+        self.tee = None
+
+    def attach(self, pipe, webrtc, index, profile=PROFILE):
+        """Link a new tee branch into webrtc. Returns the handle detach() needs."""
+        queue = profile.make_queue(f"{webrtc.get_name()}_{self.name}_queue")
+        pipe.add(queue)
+        queue.sync_state_with_parent()
+        webrtc.emit("add-transceiver", self.direction, self.rtp_caps)
+        sink_pad = webrtc.get_request_pad(f"sink_{index}")
+        if not sink_pad:
+            print(f"Failed to get sink pad for {self.name} on {webrtc.get_name()}")
+        else:
+            queue.get_static_pad("src").link(sink_pad)
+        if self.encoder_name:
+            queue.get_static_pad("src").add_probe(Gst.PadProbeType.EVENT_UPSTREAM, self.on_feedback, None)
+        tee_pad = self.tee.get_request_pad("src_%u")
+        tee_pad.link(queue.get_static_pad("sink"))
+        return tee_pad, queue
+
+    def detach(self, pipe, link, done):
+        """Unlink a peer branch without stalling the tee; calls done() on the GLib thread."""
+        tee_pad, queue = link
+
+        def drop_queue():
+            queue.set_state(Gst.State.NULL)
+            pipe.remove(queue)
+            done()
+            return GLib.SOURCE_REMOVE
+
+        def on_idle(pad, info):
+            pad.unlink(queue.get_static_pad("sink"))
+            self.tee.release_request_pad(pad)
+            GLib.idle_add(drop_queue)
+            return Gst.PadProbeReturn.REMOVE
+
+        tee_pad.add_probe(Gst.PadProbeType.IDLE, on_idle)
+
+    def peer_src(self, link):
+        """The pad feeding RTP into the peer's webrtcbin."""
+        return link[1].get_static_pad("src")
+
+
+class PeerSession:
+    """A webrtcbin and its signaling state for one connected client.
+
+    state is "new" until the peer connection comes up, then "connected".
+    Losing the websocket makes it "detached": media and data channels keep
+    running and the client may resume with the session token for
+    RESUME_GRACE. Losing ICE makes it "restarting" while an ICE restart
+    offer goes out over signaling (deferred until a detached session is
+    resumed); after MAX_ICE_RESTARTS the manager rebuilds it. "closed" is
+    final.
+    """
+
+    ids = itertools.count(1)
+
+    def __init__(self, manager, ws, options=None):
+        self.id = next(PeerSession.ids)
+        # Resumable session ID handed to the client; only the client it was sent to knows it
+        self.token = secrets.token_urlsafe(16)
+        self.state = "new"
+        self.manager = manager
+        self.ws = ws
+        self.options = options or {}
+        self.signaling = SignalingChannel(ws, manager.loop, batch=bool(self.options.get("batch")))
+        # Candidates that arrive before the answer is applied wait here
+        self.remote_set = False
+        self.pending_candidates = []
+        self.webrtc = None
+        self.links = []
+        self.elements = []
+        self.data_channels = {}
+        self.closed = False
+        self.started_at = time.monotonic()
+        self.timings = {}
+        self.candidates_received = 0
+        # Last offer and its candidates, resent if a resume finds the offer unanswered
+        self.local_offer = None
+        self.local_candidates = []
+        self.detached_at = None
+        self.expiry = None
+        self.ice_lost_at = None
+        self.ice_restarts = 0
+        self.restart_timer = None
+        # (path, monotonic start) while this session is the result of a rebuild
+        self.recovering = None
+
+    def set_state(self, state):
+        if state != self.state:
+            print(f"Session {self.id}: {self.state} -> {state}")
+            self.state = state
+
+    def session_message(self, resumed):
+        return json.dumps({'session': {'id': self.token, 'resumed': resumed, 'grace_ms': round(RESUME_GRACE * 1000)}})
+
+    def start(self):
+        manager = self.manager
+        pipe = manager.pipe
+        self.webrtc = Gst.ElementFactory.make("webrtcbin", f"peer{self.id}")
+        self.webrtc.set_property("bundle-policy", GstWebRTC.WebRTCBundlePolicy.MAX_BUNDLE)
+        self.webrtc.set_property("stun-server", STUN_SERVER)
+        pipe.add(self.webrtc)
+        manager.profile.configure_webrtc(self.webrtc)
+        self.webrtc.connect("on-ice-candidate", self.send_ice_candidate_message)
+        self.webrtc.connect("on-data-channel", manager.server.on_data_channel)
+        self.webrtc.connect("pad-added", manager.server.on_incoming_stream)
+        self.webrtc.connect("notify::ice-connection-state", self.on_ice_connection_state)
+        self.send(self.session_message(False))
+        for i, branch in enumerate(manager.branches):
+            self.links.append(branch.attach(pipe, self.webrtc, i, manager.profile))
+            if branch.stereo:
+                self.send(json.dumps({'layout': {'mline': i, 'stereo': branch.stereo}}))
+        self.webrtc.connect("on-negotiation-needed", self.on_negotiation_needed)
+        self.webrtc.connect("notify::connection-state", self.on_connection_state)
+        self.webrtc.sync_state_with_parent()
+        print(f"Session {self.id} started")
+
+    def add_elements(self, *elements):
+        """Add per-peer elements (e.g. the receive path) that go away with the session.
+
+        Called from pad-added on a streaming thread, since the pad has to be
+        linked before the handler returns. close() sets the webrtcbin to NULL,
+        which waits for its streaming threads, before it snapshots
+        self.elements, so nothing is appended after that.
+        """
+        for el in elements:
+            self.manager.pipe.add(el)
+            self.elements.append(el)
+        for el in elements:
+            el.sync_state_with_parent()
+
+    def close(self, done=None):
+        if self.closed:
+            return
+        self.closed = True
+        self.set_state("closed")
+        for handle in (self.expiry, self.restart_timer):
+            if handle:
+                handle.cancel()
+        self.signaling.close()
+        pipe = self.manager.pipe
+        webrtc = self.webrtc
+        pending = [len(self.links)]
+
+        def finish():
+            webrtc.set_state(Gst.State.NULL)
+            pipe.remove(webrtc)
+            for el in list(self.elements):
+                el.set_state(Gst.State.NULL)
+                pipe.remove(el)
+            self.elements = []
+            print(f"Session {self.id} closed")
+            if done:
+                done()
+
+        def branch_done():
+            pending[0] -= 1
+            if pending[0] == 0:
+                finish()
+
+        if not self.links:
+            finish()
+        loop = self.manager.loop
+        for branch, link in zip(self.manager.branches, self.links):
+            branch.detach(pipe, link, lambda: loop.call_soon_threadsafe(branch_done))
+        self.links = []
+
+    def mark(self, event):
+        """Record ms since HELLO for the first occurrence of a setup event. asyncio thread only."""
+        if event in self.timings:
+            return
+        self.timings[event] = round((time.monotonic() - self.started_at) * 1000, 1)
+        RECORDER.timing(self.id, event, self.timings[event])
+        if event == "first_rtp":
+            print(f"Session {self.id} setup timings (ms, {self.manager.profile.name} profile):",
+                  self.timings, self.signaling.stats())
+            if self.recovering:
+                path, since = self.recovering
+                self.recovering = None
+                self.manager.recovered(self, path, since)
+
+    def echo_channel(self, channel):
+        """Send every data channel message straight back, for clients that asked with HELLO {"echo": true}."""
+        channel.connect("on-message-data", lambda ch, data: ch.emit("send-data", data))
+        channel.connect("on-message-string", lambda ch, message: ch.emit("send-string", message))
+
+    def on_connection_state(self, webrtc, pspec):
+        state = webrtc.get_property("connection-state")
+        if state == GstWebRTC.WebRTCPeerConnectionState.CONNECTED:
+            self.manager.loop.call_soon_threadsafe(self.on_connected)
+
+    def on_connected(self):
+        if self.closed:
+            return
+        self.mark("connected")
+        if self.state == "new":
+            self.set_state("connected")
+        # A fresh decoder can't start until the next keyframe; don't wait out the GOP
+        for branch in self.manager.branches:
+            branch.force_keyframe()
+        for branch, link in zip(self.manager.branches, self.links):
+            branch.peer_src(link).add_probe(Gst.PadProbeType.BUFFER, self.on_first_rtp)
+
+    def on_ice_connection_state(self, webrtc, pspec):
+        state = webrtc.get_property("ice-connection-state")
+        self.manager.loop.call_soon_threadsafe(self.on_ice_change, state)
+
+    def on_ice_change(self, state):
+        if self.closed:
+            return
+        if state in ICE_UP:
+            if self.state == "restarting" and not self.remote_set:
+                # Still the old credentials; the restart isn't done until the answer is applied
+                return
+            if self.ice_lost_at is not None:
+                since, self.ice_lost_at = self.ice_lost_at, None
+                if self.restart_timer:
+                    self.restart_timer.cancel()
+                    self.restart_timer = None
+                if self.ice_restarts:
+                    # A disconnect that healed on its own isn't a recovery
+                    self.manager.recovered(self, "ice_restart", since)
+                self.ice_restarts = 0
+            if self.state == "restarting":
+                self.set_state("connected")
+        elif state == GstWebRTC.WebRTCICEConnectionState.DISCONNECTED:
+            if self.ice_lost_at is None:
+                self.ice_lost_at = time.monotonic()
+                self.restart_timer = self.manager.loop.call_later(ICE_RESTART_DELAY, self.ice_restart, "disconnected")
+        elif state == GstWebRTC.WebRTCICEConnectionState.FAILED:
+            if self.ice_lost_at is None:
+                self.ice_lost_at = time.monotonic()
+            self.ice_restart("failed")
+
+    def ice_restart(self, reason):
+        """Renegotiate with fresh ICE credentials over signaling, keeping every element and stream."""
+        if self.restart_timer:
+            self.restart_timer.cancel()
+        self.restart_timer = None
+        if self.closed:
+            return
+        if self.ice_lost_at is None:
+            # Asked for by the client (its network changed) before ICE noticed anything
+            self.ice_lost_at = time.monotonic()
+        if self.state == "detached":
+            print(f"Session {self.id}: ICE {reason} while detached, restarting on resume")
+            return
+        if self.ice_restarts >= MAX_ICE_RESTARTS:
+            print(f"Session {self.id}: {self.ice_restarts} ICE restarts failed, rebuilding")
+            self.manager.rebuild(self)
+            return
+        self.ice_restarts += 1
+        self.set_state("restarting")
+        print(f"Session {self.id}: ICE restart {self.ice_restarts} ({reason})")
+        RECORDER.signal(self.id, "ice_restart")
+        self.remote_set = False
+        self.local_candidates = []
+        options = Gst.Structure.new_from_string("offer-options,ice-restart=(boolean)true")
+        promise = Gst.Promise.new_with_change_func(self.on_offer_created, self.webrtc, None)
+        self.webrtc.emit("create-offer", options, promise)
+        self.restart_timer = self.manager.loop.call_later(ICE_RESTART_TIMEOUT, self.ice_restart, "timeout")
+
+    def detach(self):
+        """The websocket is gone: stop signaling but leave the media running for RESUME_GRACE."""
+        self.signaling.close()
+        self.ws = None
+        self.detached_at = time.monotonic()
+        self.set_state("detached")
+        RECORDER.signal(self.id, "detach")
+        self.expiry = self.manager.loop.call_later(RESUME_GRACE, self.manager.expire, self)
+
+    def resume(self, ws, options):
+        """Rebind to a new websocket; renegotiate only what the gap left unfinished."""
+        if self.expiry:
+            self.expiry.cancel()
+            self.expiry = None
+        self.signaling.close()
+        self.ws = ws
+        self.options = dict(self.options, **options)
+        self.signaling = SignalingChannel(ws, self.manager.loop, batch=bool(self.options.get("batch")))
+        self.send(self.session_message(True))
+        RECORDER.signal(self.id, "resume")
+        since, self.detached_at = self.detached_at, None
+        self.manager.recovered(self, "resume", since or time.monotonic())
+        ice = self.webrtc.get_property("ice-connection-state")
+        self.set_state("connected" if ice in ICE_UP else "new")
+        if self.ice_lost_at is not None or ice == GstWebRTC.WebRTCICEConnectionState.FAILED:
+            self.ice_restart("resumed")
+            return
+        if not self.remote_set and self.local_offer:
+            # The offer or its answer was lost with the old websocket
+            self.send(json.dumps({'sdp': {'type': 'offer', 'sdp': self.local_offer}}))
+            for mlineindex, candidate in list(self.local_candidates):
+                self.signaling.send_candidate(mlineindex, candidate)
+
+    def on_first_rtp(self, pad, info):
+        self.manager.loop.call_soon_threadsafe(self.mark, "first_rtp")
+        return Gst.PadProbeReturn.REMOVE
+
+    def send(self, message):
+        self.signaling.send(message)
+
+    def on_negotiation_needed(self, element):
+        self.manager.loop.call_soon_threadsafe(self.negotiate)
+
+    def negotiate(self):
+        print(f"Session {self.id}: negotiation needed")
+        if self.closed:
+            return
+        if self.data_channels:
+            print("Data channels already added")
+            return
+        for label, options in DATA_CHANNELS.items():
+            opts = Gst.Structure.new_from_string("application/data-channel," + options)
+            channel = self.webrtc.emit("create-data-channel", label, opts)
+            if channel:
+                self.data_channels[label] = channel
+                self.manager.server.on_data_channel(self.webrtc, channel)
+        print(f"Data channels created on robot: {', '.join(self.data_channels)}")
+        promise = Gst.Promise.new_with_change_func(self.on_offer_created, self.webrtc, None)
+        self.webrtc.emit("create-offer", None, promise)
+
+    def on_offer_created(self, promise, _, __):
+        promise.wait()
+        reply = promise.get_reply()
+        self.manager.loop.call_soon_threadsafe(self.send_offer, reply.get_value("offer"))
+
+    def send_offer(self, offer):
+        if self.closed:
+            return
+        text = offer.sdp.as_text()
+        self.local_offer = text
+        self.mark("offer")
+        print(f"Session {self.id}: sending offer")
+        # Queue the offer before set-local-description starts trickling candidates
+        self.send(json.dumps({'sdp': {'type': 'offer', 'sdp': text}}))
+        RECORDER.signal(self.id, "offer", len(text))
+        self.webrtc.emit("set-local-description", offer, Gst.Promise.new())
+
+    def send_ice_candidate_message(self, _, mlineindex, candidate):
+        self.manager.loop.call_soon_threadsafe(self.send_candidate, mlineindex, candidate)
+
+    def send_candidate(self, mlineindex, candidate):
+        self.local_candidates.append((mlineindex, candidate))
+        self.signaling.send_candidate(mlineindex, candidate)
+        RECORDER.signal(self.id, "candidate_sent", len(candidate))
+
+    def on_remote_description_set(self, promise, _, __):
+        self.manager.loop.call_soon_threadsafe(self.flush_candidates)
+
+    def flush_candidates(self):
+        self.mark("remote_description_set")
+        self.remote_set = True
+        pending, self.pending_candidates = self.pending_candidates, []
+        for ice in pending:
+            self.add_ice_candidate(ice)
+        if self.state == "restarting":
+            # ICE may never have left "connected" (a restart the client asked for), so check now
+            self.on_ice_change(self.webrtc.get_property("ice-connection-state"))
+
+    def add_ice_candidate(self, ice):
+        if self.closed:
+            return
+        if not self.remote_set:
+            self.pending_candidates.append(ice)
+            return
+        self.webrtc.emit("add-ice-candidate", ice['sdpMLineIndex'], ice['candidate'])
+
+    def handle_message(self, msg):
+        if 'sdp' in msg and msg['sdp']['type'] == 'answer':
+            self.mark("answer")
+            sdp = msg['sdp']['sdp']
+            RECORDER.signal(self.id, "answer", len(sdp))
+            res, sdpmsg = GstSdp.SDPMessage.new()
+            GstSdp.sdp_message_parse_buffer(sdp.encode(), sdpmsg)
+            answer = GstWebRTC.WebRTCSessionDescription.new(GstWebRTC.WebRTCSDPType.ANSWER, sdpmsg)
+            promise = Gst.Promise.new_with_change_func(self.on_remote_description_set, None, None)
+            self.webrtc.emit("set-remote-description", answer, promise)
+        elif 'ice' in msg:
+            RECORDER.signal(self.id, "ice")
+            self.candidates_received += 1
+            self.add_ice_candidate(msg['ice'])
+        elif 'candidates' in msg:
+            RECORDER.signal(self.id, "candidates", len(msg['candidates']))
+            self.candidates_received += len(msg['candidates'])
+            for ice in msg['candidates']:
+                self.add_ice_candidate(ice)
+        elif 'restart' in msg:
+            # The client saw its network change (new address, different access point)
+            if self.state != "restarting":
+                self.ice_restart("client")
+
+
+class SessionManager:
+    """Owns the shared pipeline and one PeerSession per websocket.
+
+    Capture starts with the first peer, or at warm_up() when keep_warm is
+    set, in which case it stays PLAYING and peers only ever add or remove
+    their own webrtcbin. Otherwise it stops after the last peer leaves.
+    A HELLO only rebuilds the session of the client that sent it, and a
+    HELLO {"resume": id} for a live session rebinds it instead. A dropped
+    websocket detaches its session rather than closing it.
+    """
+
+    def __init__(self, loop, server, profile=PROFILE, keep_warm=KEEP_WARM):
+        self.loop = loop
+        self.server = server
+        self.profile = profile
+        self.keep_warm = keep_warm
+        self.pipe = None
+        self.branches = []
+        self.sessions = {}
+        # Running totals for metrics; live sessions are added on top at scrape time
+        self.opened = 0
+        self.closed_totals = {"sent": 0, "batches": 0, "candidates": 0, "candidates_received": 0}
+        # Recovery times (ms) per path, and rebuilds of sessions a client asked to resume
+        self.recovery = {path: RollingStats(256) for path in RECOVERY_PATHS}
+        self.resume_misses = 0
+
+    def add_branch(self, branch):
+        self.branches.append(branch)
+
+    def start_capture(self):
+        print("Starting pipeline")
+        print("Latency profile:", self.profile.summary())
+        self.pipe = Gst.Pipeline.new("pipeline")
+        bus = self.pipe.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self.on_bus_message)
+        for branch in self.branches:
+            branch.build(self.pipe)
+        encoders = [b.get_element(b.encoder_name) for b in self.branches if b.encoder_name]
+        if encoders and encoders[0]:
+            report_when_flowing(self.pipe, encoders[0].get_static_pad("sink"))
+        if LATENCY_TRACE:
+            for branch in self.branches:
+                if branch.encoder_name:
+                    LatencyTracer(branch)
+        if FLIGHT_DIR and FLIGHT_VIDEO:
+            for branch in self.branches:
+                record_video(self.pipe, branch)
+        self.pipe.set_state(Gst.State.PLAYING)
+        start_file_cameras(self.pipe)
+
+    def warm_up(self):
+        if self.keep_warm and not self.pipe:
+            self.start_capture()
+
+    def stop_capture(self):
+        if not self.pipe:
+            return
+        print("Stopping pipeline")
+        stop_file_cameras()
+        self.pipe.set_state(Gst.State.NULL)
+        self.pipe.get_bus().remove_signal_watch()
+        for branch in self.branches:
+            branch.teardown(self.pipe)
+        self.pipe = None
+
+    def on_bus_message(self, bus, message):
+        # GLib thread; self.pipe belongs to asyncio (see GLibBridge)
+        self.loop.call_soon_threadsafe(self.handle_bus_message, message)
+
+    def handle_bus_message(self, message):
+        t = message.type
+        if t == Gst.MessageType.LATENCY and self.pipe:
+            print("Received a LATENCY message. Recalculating latency.")
+            self.pipe.recalculate_latency()
+        elif t == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            print("Pipeline error:", err.message, debug)
+
+    def get(self, ws):
+        return self.sessions.get(ws)
+
+    def find(self, webrtc):
+        # Called from webrtcbin signals, so iterate a snapshot
+        for session in list(self.sessions.values()):
+            if session.webrtc == webrtc:
+                return session
+        return None
+
+    def open_session(self, ws, options=None):
+        self.close_session(ws)
+        if not self.pipe:
+            self.start_capture()
+        session = PeerSession(self, ws, options)
+        self.sessions[ws] = session
+        self.opened += 1
+        RECORDER.signal(session.id, "hello")
+        session.start()
+        print(f"{len(self.sessions)} active session(s)")
+        return session
+
+    def hello(self, ws, options):
+        """Resume the session named by options["resume"] if it is still alive, else open a new one.
+
+        Returns (session, resumed).
+        """
+        token = options.get("resume")
+        session = next((s for s in self.sessions.values() if s.token == token), None) if token else None
+        if session and not session.closed:
+            old_ws = next(k for k, s in self.sessions.items() if s is session)
+            if old_ws is not ws:
+                # The old websocket may not have noticed it is dead yet; it no longer owns the session
+                del self.sessions[old_ws]
+                self.close_session(ws)
+                self.sessions[ws] = session
+            print(f"Session {session.id} resumed")
+            self.add_signaling_totals(session)
+            session.resume(ws, options)
+            return session, True
+        started = time.monotonic()
+        session = self.open_session(ws, options)
+        if token:
+            # Expired or unknown: the client has to start over on a new webrtcbin
+            self.resume_misses += 1
+            session.recovering = ("rebuild", started)
+        return session, False
+
+    def detach_session(self, ws):
+        """The websocket closed: keep the session's media up in case the client resumes."""
+        session = self.sessions.get(ws)
+        if session and not session.closed:
+            session.detach()
+
+    def expire(self, session):
+        if session.state != "detached":
+            return
+        print(f"Session {session.id} not resumed within {RESUME_GRACE:g}s, closing")
+        ws = next((k for k, s in self.sessions.items() if s is session), None)
+        if ws is not None:
+            self.close_session(ws)
+
+    def rebuild(self, session):
+        """Last resort: a fresh webrtcbin for the same websocket (the client makes a new peer connection)."""
+        ws = session.ws
+        started = session.ice_lost_at or time.monotonic()
+        if ws is None:
+            self.expire(session)
+            return
+        new = self.open_session(ws, session.options)
+        new.recovering = ("rebuild", started)
+
+    def recovered(self, session, path, since):
+        ms = round((time.monotonic() - since) * 1000, 1)
+        self.recovery[path].add(ms)
+        RECORDER.timing(session.id, f"recovered_{path}", ms)
+        print(f"Session {session.id} recovered by {path} in {ms} ms")
+        session.send(json.dumps({'recovered': {'path': path, 'ms': ms}}))
+
+    def add_signaling_totals(self, session):
+        totals = self.closed_totals
+        for key, value in session.signaling.stats().items():
+            if key in totals:
+                totals[key] += value
+
+    def close_session(self, ws):
+        session = self.sessions.pop(ws, None)
+        if not session:
+            return
+        self.add_signaling_totals(session)
+        self.closed_totals["candidates_received"] += session.candidates_received
+        RECORDER.signal(session.id, "close")
+        self.server.on_session_closed(session)
+        session.close(done=self.on_session_closed)
+
+    def on_session_closed(self):
+        if not self.sessions and not self.keep_warm:
+            self.stop_capture()
+
+
+class WebRTCServerBase:
+    """Signaling, control and session plumbing shared by the server scripts.
+
+    A script subclasses this, adds its media branches in add_branches() and
+    links whatever a peer sends in on_incoming_stream(), then runs it with
+    serve().
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.sessions = SessionManager(loop, self)
+        self.control = ControlDispatcher()
+        self.control_loop = ControlLoop(actuate=control_output())
+        self.control_loop.attach(self.control)
+        # Headset poses relayed from the WebXR demo server (or sent on the data channel)
+        self.pose = PoseMailbox()
+        self.control.register_pose(self.pose.put)
+        self.control.register(RECORDER.command)
+        self.add_branches(select_encoder())
+        self.abr = AdaptiveBitrate(self.sessions)
+        self.metrics = Metrics(self)
+
+    def add_branches(self, encoder):
+        raise NotImplementedError
+
+    def on_session_closed(self, session):
+        """Forget the session's control sequence state; a new session starts its own."""
+        self.control.forget(session.id)
+        self.control_loop.mailbox.forget(session.id)
+
+    def on_incoming_stream(self, webrtc, pad):
+        """pad-added on a peer's webrtcbin; a send-only server ignores it."""
+
+    def on_data_channel(self, webrtc, channel):
+        print("New data channel:", channel.props.label)
+        session = self.sessions.find(webrtc)
+        if session and session.options.get("echo"):
+            # Load generator timing the data path (loadgen.py); its messages must never drive the robot
+            session.echo_channel(channel)
+            return
+        # Sequence state is kept per session, so a second viewer can't disturb the operator's
+        sender = session.id if session else None
+        channel.connect("on-message-string", self.control.on_message_string, sender)
+        channel.connect("on-message-data", self.control.on_message_data, sender)
+
+    def handle_client_message(self, ws, message):
+        hello = parse_hello(message)
+        if hello is not None:
+            self.sessions.hello(ws, hello)
+            return
+        session = self.sessions.get(ws)
+        if not session:
+            print("No session for client, expected HELLO first")
+            return
+        try:
+            msg = json.loads(message)
+        except ValueError:
+            msg = None
+        if not isinstance(msg, dict):
+            print(f"Session {session.id}: ignoring malformed signaling message")
+            return
+        session.handle_message(msg)
+
+    async def websocket_handler(self, ws):
+        print("Client connected")
+        try:
+            async for msg in ws:
+                self.handle_client_message(ws, msg)
+        finally:
+            print("Client disconnected")
+            # Media keeps running until the client resumes or the grace period ends
+            self.sessions.detach_session(ws)
+
+
+async def serve(server_class, host="0.0.0.0", port=SIGNALING_PORT):
+    """Run a WebRTCServerBase subclass: GLib thread, control loop, ABR, metrics and the websocket."""
+    loop = asyncio.get_running_loop()
+    bridge = GLibBridge(loop)
+    bridge.start()
+    RECORDER.start()
+    server = server_class(loop)
+    server.control_loop.start()
+    server.abr.start()
+    server.metrics.start()
+    if UDP_CONTROL_PORT:
+        # Commands forwarded by udp_bridge.py --to robot
+        CommandReceiver(server.control).listen(loop, "0.0.0.0", UDP_CONTROL_PORT)
+    server.sessions.warm_up()
+    async with websockets.serve(server.websocket_handler, host, port):
+        print(f"WebSocket server running on ws://{host}:{port}")
+        await asyncio.Future()  # run forever
@@ -0,0 +1,113 @@
+import asyncio
+import collections
+import json
+
+SIGNAL_TICK = 0.02  # seconds to gather trickle candidates into one message
+HIGH_WATER = 64 * 1024  # hold candidates while this much is still unsent on the socket
+
+
+def parse_hello(message):
+    """Options dict for 'HELLO' or 'HELLO {json}', None for any other message (including binary ones)."""
+    if not isinstance(message, str):
+        return None
+    if message == "HELLO":
+        return {}
+    if message.startswith("HELLO "):
+        try:
+            options = json.loads(message[6:])
+        except ValueError:
+            return {}
+        return options if isinstance(options, dict) else {}
+    return None
+
+
+class SignalingChannel:
+    """Ordered outbound queue for one websocket.
+
+    send() and send_candidate() may be called from any GStreamer thread;
+    they only hand the message to the asyncio loop. A single task writes
+    messages in the order they were queued. Trickle candidates are gathered
+    for SIGNAL_TICK and sent as one {"candidates": [...]} message to clients
+    that asked for batching in their HELLO, or one {"ice": ...} each
+    otherwise. While the socket's write buffer is above HIGH_WATER,
+    candidates keep accumulating into the next batch instead of piling more
+    frames onto a slow link.
+    """
+
+    def __init__(self, ws, loop, batch=False, tick=SIGNAL_TICK):
+        self.ws = ws
+        self.loop = loop
+        self.batch = batch
+        self.tick = tick
+        self.queue = collections.deque()
+        self.candidates = []
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.sent = 0
+        self.batches = 0
+        self.candidates_sent = 0
+        self.max_depth = 0
+        self.task = loop.create_task(self.run())
+
+    def send(self, message):
+        if not self.closed:
+            self.loop.call_soon_threadsafe(self.push, message)
+
+    def send_candidate(self, mlineindex, candidate):
+        if not self.closed:
+            self.loop.call_soon_threadsafe(self.push_candidate, mlineindex, candidate)
+
+    def push(self, message):
+        # Anything already gathered was generated before this message
+        self.move_candidates()
+        self.queue.append(message)
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self.wakeup.set()
+
+    def push_candidate(self, mlineindex, candidate):
+        self.candidates.append({'candidate': candidate, 'sdpMLineIndex': mlineindex})
+        self.candidates_sent += 1
+        self.wakeup.set()
+
+    def move_candidates(self):
+        if not self.candidates:
+            return
+        if self.batch:
+            self.queue.append(json.dumps({'candidates': self.candidates}))
+            self.batches += 1
+        else:
+            self.queue.extend(json.dumps({'ice': c}) for c in self.candidates)
+        self.candidates = []
+
+    def congested(self):
+        transport = getattr(self.ws, "transport", None)
+        return transport is not None and transport.get_write_buffer_size() > HIGH_WATER
+
+    async def run(self):
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                if self.candidates and not self.queue:
+                    # Let the rest of this gathering burst arrive
+                    await asyncio.sleep(self.tick)
+                while self.congested():
+                    await asyncio.sleep(self.tick)
+                self.move_candidates()
+                while self.queue:
+                    await self.ws.send(self.queue.popleft())
+                    self.sent += 1
+        except Exception as e:
+            if not self.closed:
+                print("Signaling send failed:", e)
+            self.closed = True
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.candidates = []
+        self.task.cancel()
+
+    def stats(self):
+        return {"sent": self.sent, "batches": self.batches, "candidates": self.candidates_sent,
+                "queued": len(self.queue), "max_depth": self.max_depth}
@@ -0,0 +1,261 @@
+"""Spatial simulcast: a few resolutions encoded once, one chosen per peer.
+
+With KSCALE_SIMULCAST=2 or 3 a video branch splits its capture into that
+many rungs of LAYERS, each with its own shared encoder and tee. Every peer
+taps all layers into its own input-selector and payloader, so a viewer on
+a poor link can drop to a smaller layer without another encode and without
+pulling the top layer down for everyone else. The payloader being per peer
+keeps RTP sequence numbers and timestamps continuous across switches.
+
+AdaptiveBitrate picks each peer's layer from that peer's own stats; a
+switch asks the target layer for a keyframe and only moves the selector
+when that keyframe reaches it, so the peer's decoder never sees a delta
+frame from a layer it hasn't started.
+"""
+import os
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstWebRTC, GstVideo, GLib
+
+from bitrate import AVAILABLE_HEADROOM, LOSS_HIGH, LOSS_LOW, RTT_HIGH, STEP_DOWN_AFTER, STEP_UP_AFTER
+from capture import STEREO_LAYOUTS
+from keyframes import KeyframeRequests
+from latency_profile import PROFILE
+from sessions import MediaBranch
+
+# Number of layers to encode; 0 or 1 keeps the single shared encode
+SIMULCAST = int(os.environ.get("KSCALE_SIMULCAST", "0"))
+
+# Layers, best first: (width, height, fps, kbps). The top layer's bitrate follows
+# AdaptiveBitrate and kbps is the least a link must carry to stay on it; lower
+# layers are encoded at a fixed kbps.
+LAYERS = [
+    (640, 480, 30, 1000),
+    (320, 240, 15, 300),
+    (160, 120, 15, 100),
+]
+SIMULCAST_LAYERS = LAYERS[:SIMULCAST] if SIMULCAST > 1 else []
+
+
+class SimulcastLink:
+    """One peer's attachment to a SimulcastBranch and its layer selection state."""
+
+    def __init__(self, selector, payloader, taps):
+        self.selector = selector
+        self.payloader = payloader
+        # (tee pad, queue, selector sink pad) per layer
+        self.taps = taps
+        self.layer = 0
+        self.pending = None
+        self.bad = 0
+        self.good = 0
+        self.switches = 0
+
+    def elements(self):
+        return [queue for _, queue, _ in self.taps] + [self.selector, self.payloader]
+
+
+class SimulcastBranch(MediaBranch):
+    """A MediaBranch whose capture is encoded once per layer and payloaded per peer.
+
+    Layer 0 keeps the branch's encoder_name and scaler_name, so
+    AdaptiveBitrate, metrics and the flight recorder see the top layer the
+    same way they see a single encode.
+    """
+
+    def __init__(self, name, source, encoder, pt, encoder_name, scaler_name,
+                 direction=GstWebRTC.WebRTCRTPTransceiverDirection.SENDRECV,
+                 keyframe_interval=None, stereo=None, layers=None, profile=PROFILE):
+        layers = layers or SIMULCAST_LAYERS or LAYERS
+        cols, rows = STEREO_LAYOUTS.get(stereo, (1, 1))
+        desc = f"{source} ! videoconvert ! tee name={name}_split"
+        for i, (width, height, fps, _) in enumerate(layers):
+            enc_name = encoder_name if i == 0 else f"{encoder_name}_l{i}"
+            scale_name = scaler_name if i == 0 else f"{scaler_name}_l{i}"
+            # The top layer starts at capture size; AdaptiveBitrate steps it like a single encode
+            caps = "video/x-raw" if i == 0 else f"video/x-raw,width={width * cols},height={height * rows},framerate={fps}/1"
+            desc += (
+                f" {name}_split. ! {profile.queue_description()} ! videoscale ! videorate drop-only=true ! "
+                f"capsfilter name={scale_name} caps={caps} ! "
+                f"{encoder.encoder_description(enc_name, keyframe_interval, profile)} ! "
+                f"identity name={name}_layer{i} silent=true"
+            )
+        super().__init__(name, desc, encoder.rtp_caps(pt), direction, encoder=encoder,
+                         encoder_name=encoder_name, scaler_name=scaler_name, stereo=stereo)
+        self.layers = layers
+        self.pt = pt
+        self.payloaded = False
+        self.layer_tees = []
+        # Layer 0 shares MediaBranch.keyframes, so stats for the top layer look like a single encode's
+        self.layer_keyframes = [self.keyframes] + [KeyframeRequests() for _ in layers[1:]]
+
+    def layer_encoder_name(self, layer):
+        return self.encoder_name if layer == 0 else f"{self.encoder_name}_l{layer}"
+
+    def build(self, pipe):
+        self.bin = Gst.parse_bin_from_description(self.description, False)
+        self.bin.set_name(self.name)
+        pipe.add(self.bin)
+        cols, rows = self.tile
+        for i, layer in enumerate(self.layers):
+            out = self.bin.get_by_name(f"{self.name}_layer{i}").get_static_pad("src")
+            self.bin.add_pad(Gst.GhostPad.new(f"layer{i}", out))
+            tee = Gst.ElementFactory.make("tee", f"{self.name}_l{i}_tee")
+            tee.set_property("allow-not-linked", True)
+            pipe.add(tee)
+            self.bin.link_pads(f"layer{i}", tee, "sink")
+            self.layer_tees.append(tee)
+            enc = self.get_element(self.layer_encoder_name(i))
+            enc.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.layer_keyframes[i].on_encoded)
+            if i:
+                self.encoder.set_bitrate(enc, layer[3] * 1000 * cols * rows)
+        self.tee = self.layer_tees[0]
+        print(f"{self.name}: simulcast layers", [f"{w}x{h}@{fps}" for w, h, fps, _ in self.layers])
+
+    def teardown(self, pipe):
+        for tee in self.layer_tees[1:]:
+            tee.set_state(Gst.State.NULL)
+            pipe.remove(tee)
+        self.layer_tees = []
+        super().teardown(pipe)
+
+    def force_keyframe(self, reason="join", layer=0):
+        enc = self.get_element(self.layer_encoder_name(layer))
+        if not enc or not self.layer_keyframes[layer].admit(reason):
+            return False
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        enc.get_static_pad("src").send_event(event)
+        return True
+
+    def link_layer(self, link):
+        # Feedback from a peer is about the layer it is decoding
+        return link.layer
+
+    def attach(self, pipe, webrtc, index, profile=PROFILE):
+        """Tap every layer into a new input-selector and payloader for webrtc, starting on layer 0."""
+        prefix = f"{webrtc.get_name()}_{self.name}"
+        selector = Gst.ElementFactory.make("input-selector", f"{prefix}_select")
+        # Inactive layers are dropped as they arrive instead of being held back for sync
+        selector.set_property("sync-streams", False)
+        payloader = Gst.parse_launch(
+            f"{self.encoder.payloader} name={prefix}_pay pt={self.pt} {self.encoder.payloader_props}".rstrip())
+        queues = [profile.make_queue(f"{prefix}_l{i}_queue") for i in range(len(self.layers))]
+        for el in queues + [selector, payloader]:
+            pipe.add(el)
+        selector.link(payloader)
+        webrtc.emit("add-transceiver", self.direction, self.rtp_caps)
+        sink_pad = webrtc.get_request_pad(f"sink_{index}")
+        if not sink_pad:
+            print(f"Failed to get sink pad for {self.name} on {webrtc.get_name()}")
+        else:
+            payloader.get_static_pad("src").link(sink_pad)
+        for el in queues + [selector, payloader]:
+            el.sync_state_with_parent()
+        taps = []
+        for tee, queue in zip(self.layer_tees, queues):
+            select_pad = selector.get_request_pad("sink_%u")
+            queue.get_static_pad("src").link(select_pad)
+            if not taps:
+                selector.set_property("active-pad", select_pad)
+            tee_pad = tee.get_request_pad("src_%u")
+            tee_pad.link(queue.get_static_pad("sink"))
+            taps.append((tee_pad, queue, select_pad))
+        link = SimulcastLink(selector, payloader, taps)
+        payloader.get_static_pad("src").add_probe(Gst.PadProbeType.EVENT_UPSTREAM, self.on_feedback, link)
+        return link
+
+    def detach(self, pipe, link, done):
+        """Unlink every layer tap without stalling the tees; calls done() on the GLib thread."""
+        pending = [len(link.taps)]
+
+        def drop_elements():
+            pending[0] -= 1
+            if pending[0]:
+                return GLib.SOURCE_REMOVE
+            for el in link.elements():
+                el.set_state(Gst.State.NULL)
+                pipe.remove(el)
+            done()
+            return GLib.SOURCE_REMOVE
+
+        def on_idle(pad, info, tee, queue):
+            pad.unlink(queue.get_static_pad("sink"))
+            tee.release_request_pad(pad)
+            GLib.idle_add(drop_elements)
+            return Gst.PadProbeReturn.REMOVE
+
+        link.pending = None
+        for tee, (tee_pad, queue, _) in zip(self.layer_tees, link.taps):
+            tee_pad.add_probe(Gst.PadProbeType.IDLE, on_idle, tee, queue)
+
+    def peer_src(self, link):
+        return link.payloader.get_static_pad("src")
+
+    def select_layer(self, link, loss, rtt, jitter, available):
+        """Step this peer down after STEP_DOWN_AFTER bad samples, up after STEP_UP_AFTER clean ones."""
+        current = link.pending if link.pending is not None else link.layer
+        cols, rows = self.tile
+        room = available * AVAILABLE_HEADROOM / (cols * rows) if available is not None else None
+        if loss > LOSS_HIGH or (room is not None and room < self.layers[current][3]):
+            link.bad += 1
+            link.good = 0
+        elif current > 0 and loss < LOSS_LOW and rtt < RTT_HIGH and (room is None or room >= self.layers[current - 1][3]):
+            link.good += 1
+            link.bad = 0
+        else:
+            link.bad = link.good = 0
+        target = current
+        if link.bad >= STEP_DOWN_AFTER and current < len(self.layers) - 1:
+            target = current + 1
+        elif link.good >= STEP_UP_AFTER and current > 0:
+            target = current - 1
+        if target != current:
+            link.bad = link.good = 0
+        self.switch_layer(link, target)
+        return target
+
+    def switch_layer(self, link, layer):
+        """Move link to layer at that layer's next keyframe (requested now)."""
+        if layer == link.layer:
+            link.pending = None
+            return
+        if layer == link.pending:
+            # Still waiting; the keyframe request may have been coalesced away, ask again
+            self.force_keyframe("layer", layer)
+            return
+        link.pending = layer
+        _, _, select_pad = link.taps[layer]
+
+        def on_buffer(pad, info):
+            if link.pending != layer:
+                return Gst.PadProbeReturn.REMOVE
+            if info.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+                return Gst.PadProbeReturn.OK
+            # Before the selector's chain runs, so this keyframe is the first buffer forwarded
+            link.selector.set_property("active-pad", pad)
+            print(f"{link.payloader.get_name()}: layer {link.layer} -> {layer}")
+            link.layer = layer
+            link.pending = None
+            link.switches += 1
+            return Gst.PadProbeReturn.REMOVE
+
+        select_pad.add_probe(Gst.PadProbeType.BUFFER, on_buffer)
+        self.force_keyframe("layer", layer)
+
+
+def video_branch(name, source, encoder, pt, encoder_name, scaler_name,
+                 direction=GstWebRTC.WebRTCRTPTransceiverDirection.SENDRECV,
+                 keyframe_interval=None, stereo=None, layers=SIMULCAST_LAYERS):
+    """A SimulcastBranch when KSCALE_SIMULCAST asks for layers, otherwise the single shared encode."""
+    if len(layers) > 1:
+        return SimulcastBranch(name, source, encoder, pt, encoder_name, scaler_name, direction,
+                               keyframe_interval=keyframe_interval, stereo=stereo, layers=layers)
+    return MediaBranch(
+        name,
+        f"{source} ! {encoder.description(encoder_name, pt, keyframe_interval, scaler=scaler_name)}",
+        encoder.rtp_caps(pt), direction,
+        encoder=encoder, encoder_name=encoder_name, scaler_name=scaler_name, stereo=stereo,
+    )
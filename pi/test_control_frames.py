@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from control_frames import FLAG_RESET, FRAME_SIZE, MOTION_IDS, ChannelStats, ControlDispatcher, encode_frame
+
+
+def dispatcher():
+    d = ControlDispatcher()
+    received = []
+    d.register(lambda frame: received.append(frame.copy()))
+    return d, received
+
+
+def test_binary_frame_round_trip():
+    d, received = dispatcher()
+    data = encode_frame(7, 0.5, -0.25, 1.0, motion="salute", flags=FLAG_RESET, timestamp=1234.5)
+    assert len(data) == FRAME_SIZE
+    d.dispatch_bytes(data, "velocity", sender=1)
+    (frame,) = received
+    assert (frame.seq, frame.x, frame.y, frame.z) == (7, 0.5, -0.25, 1.0)
+    assert frame.motion_name == "salute" and frame.reset and frame.timestamp == 1234.5
+    assert frame.channel == (1, "velocity")
+
+
+@pytest.mark.parametrize("message", [
+    {"x": 0.1, "y": -0.2, "z": 0.3},
+    {"vector": [0.1, -0.2, 0.3]},
+    {"Xvel": -0.2, "Yvel": -0.1, "YawRate": -0.3},
+])
+def test_json_shapes_map_to_the_same_velocity(message):
+    d, received = dispatcher()
+    d.dispatch_json(json.dumps(message))
+    (frame,) = received
+    assert (frame.x, frame.y, frame.z) == pytest.approx((0.1, -0.2, 0.3))
+
+
+def test_json_motion_and_reset():
+    d, received = dispatcher()
+    d.dispatch_json(json.dumps({"vector": [0, 0, 0], "motion": "boxing", "reset": True}))
+    (frame,) = received
+    assert frame.motion == MOTION_IDS["boxing"] and frame.reset
+
+
+@pytest.mark.parametrize("message", [
+    '{"vector": [1]}',
+    '{"vector": [1, 2, 3, 4]}',
+    '{"vector": [1, 2, "3"]}',
+    '{"vector": "1,2,3"}',
+    '{"x": "abc"}',
+    '{"x": NaN}',
+    '{"Xvel": "fast"}',
+    '{"motion": [1]}',
+    '[1, 2, 3]',
+    'not json',
+])
+def test_malformed_json_is_rejected_not_raised(message):
+    d, received = dispatcher()
+    d.dispatch_json(message, "chat", sender=1)
+    assert received == []
+    assert d.rejected == 1
+    assert d.channel_stats("chat", sender=1).rejected == 1
+    assert d.decoded == 0
+
+
+def test_wrong_size_binary_is_rejected():
+    d, received = dispatcher()
+    d.dispatch_bytes(encode_frame(1, 0, 0, 0)[:-1], "velocity")
+    assert received == [] and d.rejected == 1
+
+
+def test_senders_keep_separate_sequence_stats():
+    d, _ = dispatcher()
+    for seq in range(1000, 1010):
+        d.dispatch_bytes(encode_frame(seq, 0, 0, 0), "velocity", sender=1)
+    for seq in range(1, 4):
+        d.dispatch_bytes(encode_frame(seq, 0, 0, 0), "velocity", sender=2)
+    assert d.stats() == {"velocity": {"delivered": 13, "late": 0, "dropped": 0, "rejected": 0}}
+    d.forget(2)
+    assert (2, "velocity") not in d.channels
+    # Counters stay monotonic after a sender is forgotten
+    assert d.stats()["velocity"]["delivered"] == 13
+
+
+def test_json_sequence_is_assigned_per_channel():
+    d, received = dispatcher()
+    d.dispatch_json('{"x": 1}', "chat", sender=1)
+    d.dispatch_json('{"x": 1}', "chat", sender=2)
+    assert [f.seq for f in received] == [1, 1]
+
+
+def test_channel_stats_counts_gaps_as_dropped():
+    stats = ChannelStats()
+    for seq in (1, 2, 5):
+        stats.update(seq)
+    assert stats.summary() == {"delivered": 3, "late": 0, "dropped": 2, "rejected": 0}
+
+
+def test_channel_stats_late_frame_fills_its_gap():
+    stats = ChannelStats()
+    for seq in (1, 3, 2):
+        stats.update(seq)
+    assert (stats.delivered, stats.late, stats.dropped) == (3, 1, 0)
+
+
+def test_channel_stats_repeat_is_neither_late_nor_dropped():
+    stats = ChannelStats()
+    for seq in (1, 1):
+        stats.update(seq)
+    assert (stats.late, stats.dropped) == (0, 0)
+
+
+def test_channel_stats_wraparound():
+    stats = ChannelStats()
+    for seq in (0xFFFFFFFE, 0xFFFFFFFF, 0, 2):
+        stats.update(seq)
+    assert (stats.late, stats.dropped, stats.last_seq) == (0, 1, 2)
+    stats.update(0xFFFFFFFF)
+    assert stats.late == 1
@@ -0,0 +1,168 @@
+import threading
+import time
+
+import pytest
+
+import control_loop
+from control_frames import FLAG_RESET, MOTION_IDS, ControlFrame
+from control_loop import CommandMailbox, ControlLoop, RollingStats, seq_newer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(control_loop.time, "monotonic", clock)
+    return clock
+
+
+def frame(seq, x=0.0, y=0.0, z=0.0, channel=(1, "velocity"), motion=0, flags=0):
+    f = ControlFrame()
+    f.seq, f.x, f.y, f.z, f.channel, f.motion, f.flags = seq, x, y, z, channel, motion, flags
+    return f
+
+
+def test_seq_newer_wraps():
+    assert seq_newer(1, 0)
+    assert not seq_newer(0, 1)
+    assert not seq_newer(5, 5)
+    assert seq_newer(0, 0xFFFFFFFF)
+    assert seq_newer(3, 0xFFFFFFF0)
+    assert not seq_newer(0xFFFFFFF0, 3)
+
+
+def test_mailbox_drops_old_and_repeated_seq(clock):
+    box = CommandMailbox(deadline=0.25)
+    assert box.put(frame(10, x=1.0))
+    assert not box.put(frame(10, x=2.0))
+    assert not box.put(frame(9, x=3.0))
+    assert box.latest[1] == 1.0
+    assert box.stale_dropped == 2
+
+
+def test_mailbox_accepts_across_wraparound(clock):
+    box = CommandMailbox()
+    assert box.put(frame(0xFFFFFFFF))
+    assert box.put(frame(0))
+    assert box.latest[0] == 0
+
+
+def test_mailbox_lets_a_restarted_sender_through_after_the_deadline(clock):
+    box = CommandMailbox(deadline=0.25)
+    box.put(frame(500))
+    clock.now += 0.1
+    assert not box.put(frame(1))
+    clock.now += 0.2
+    assert box.put(frame(1))
+
+
+def test_mailbox_channels_have_separate_sequence_spaces(clock):
+    box = CommandMailbox()
+    assert box.put(frame(1000, x=1.0, channel=(1, "velocity")))
+    assert box.put(frame(1, x=2.0, channel=(2, "velocity")))
+    assert box.latest[1] == 2.0
+    box.forget(2)
+    assert (2, "velocity") not in box.channels and (1, "velocity") in box.channels
+
+
+def test_mailbox_hands_motion_and_flags_over_once(clock):
+    box = CommandMailbox()
+    box.put(frame(1, motion=MOTION_IDS["boxing"], flags=FLAG_RESET))
+    box.put(frame(2, x=0.5))
+    latest, motion, flags = box.take()
+    assert latest[1] == 0.5 and motion == MOTION_IDS["boxing"] and flags == FLAG_RESET
+    _, motion, flags = box.take()
+    assert motion == 0 and flags == 0
+
+
+def test_put_command_latches_without_touching_velocity(clock):
+    box = CommandMailbox()
+    box.put(frame(1, x=0.5))
+    box.put_command(frame(1, motion=MOTION_IDS["salute"], channel=(1, "commands")))
+    latest, motion, _ = box.take()
+    assert latest[1] == 0.5 and motion == MOTION_IDS["salute"]
+
+
+def test_loop_passes_reset_on_one_tick_only(clock):
+    ticks = []
+    loop = ControlLoop(actuate=lambda *args: ticks.append(args), deadline=0.25)
+    loop.mailbox.put(frame(1, x=1.0, flags=FLAG_RESET))
+    for _ in range(3):
+        clock.now += 0.01
+        loop.tick(clock.now)
+    assert [t[4] for t in ticks] == [FLAG_RESET, 0, 0]
+    assert all(t[0] == 1.0 for t in ticks)
+
+
+def test_loop_decays_to_stop_after_deadline(clock):
+    ticks = []
+    loop = ControlLoop(actuate=lambda *args: ticks.append(args), deadline=0.25)
+    loop.mailbox.put(frame(1, x=1.0))
+    loop.tick(clock.now)
+    clock.now += 0.3
+    for _ in range(40):
+        clock.now += 0.01
+        loop.tick(clock.now)
+    assert ticks[1][0] == pytest.approx(0.8)
+    assert ticks[-1][:3] == (0.0, 0.0, 0.0)
+    assert loop.timeouts == 1
+
+
+def test_rolling_stats_wraps():
+    stats = RollingStats(4)
+    for value in range(10):
+        stats.add(float(value))
+    summary = stats.summary()
+    assert summary["n"] == 4 and summary["max"] == 9.0 and summary["mean"] == 7.5
+
+
+class YieldingMailbox(CommandMailbox):
+    """Gives up the GIL on every read of flags, so put_command() and take() interleave mid-update."""
+
+    @property
+    def flags(self):
+        value = self._flags
+        time.sleep(0)
+        return value
+
+    @flags.setter
+    def flags(self, value):
+        self._flags = value
+
+
+def test_take_never_loses_a_flag_latched_concurrently():
+    box = YieldingMailbox()
+    frames = [frame(0, flags=1 << i, channel=(1, "commands")) for i in range(16)]
+    latched = [0] * len(frames)
+    taken = [0] * len(frames)
+    done = threading.Event()
+
+    def hammer():
+        # Set each bit again only once the previous one has been taken, so every set must come out once
+        deadline = time.monotonic() + 2.0
+        while sum(latched) < 2000 and time.monotonic() < deadline:
+            for i, f in enumerate(frames):
+                if latched[i] == taken[i]:
+                    latched[i] += 1
+                    box.put_command(f)
+        done.set()
+
+    def collect(flags):
+        for i in range(len(frames)):
+            if flags >> i & 1:
+                taken[i] += 1
+
+    thread = threading.Thread(target=hammer)
+    thread.start()
+    while not done.is_set():
+        collect(box.take()[2])
+    thread.join()
+    collect(box.take()[2])
+    assert taken == latched and sum(latched) >= 2000
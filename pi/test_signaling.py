@@ -0,0 +1,16 @@
+import pytest
+
+from signaling import parse_hello
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("HELLO", {}),
+    ('HELLO {"batch": true}', {"batch": True}),
+    ("HELLO not-json", {}),
+    ("HELLO [1]", {}),
+    ('{"ice": {}}', None),
+    (b"HELLO", None),
+    (b"\x00\x01", None),
+])
+def test_parse_hello(message, expected):
+    assert parse_hello(message) == expected
@@ -0,0 +1,38 @@
+import socket
+import time
+
+from control_frames import ControlDispatcher, encode_frame
+from udp_bridge import CommandReceiver
+
+
+def receiver(handler):
+    dispatcher = ControlDispatcher()
+    dispatcher.register(handler)
+    r = CommandReceiver(dispatcher)
+    r.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    r.sock.bind(("127.0.0.1", 0))
+    r.sock.setblocking(False)
+    return r
+
+
+def send(r, *datagrams):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as out:
+        for data in datagrams:
+            out.sendto(data, r.sock.getsockname())
+    time.sleep(0.05)
+
+
+def test_bad_datagrams_do_not_stop_the_batch():
+    received = []
+
+    def handler(frame):
+        if frame.seq == 2:
+            raise RuntimeError("handler failed")
+        received.append(frame.seq)
+
+    r = receiver(handler)
+    send(r, b"\xff\xfe not utf-8", encode_frame(2, 0, 0, 0), b"not json", encode_frame(3, 0, 0, 0))
+    r.on_readable()
+    r.sock.close()
+    assert received == [3]
+    assert r.datagrams == 4 and r.errors == 1 and r.dispatcher.rejected == 2
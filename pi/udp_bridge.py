@@ -0,0 +1,193 @@
+"""UDP command bridge between the app's simulator path and a simulator or the robot.
+
+SimUDP.tsx sends one JSON datagram per joystick change, either
+{Xvel, Yvel, YawRate, motion} or {vector, reset}; binary control frames
+(control_frames.py) are accepted too. Everything received goes through the
+same ControlDispatcher as the data channel, into a ControlLoop that
+coalesces to one command per tick at --rate Hz and forwards it:
+
+    --to sim    JSON in the SimUDP shape, so an existing simulator sees the same messages
+    --to robot  binary control frames, for a server started with KSCALE_UDP_CONTROL_PORT
+
+    python3 pi/udp_bridge.py --listen 8765 --to sim --target 127.0.0.1:9000
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+
+from control_frames import FLAG_RESET, FRAME_VERSION, MOTIONS, POSE_VERSION, ControlDispatcher, encode_frame
+from control_loop import COMMAND_DEADLINE, ControlLoop
+
+# Servers also accept control frames over UDP on this port when it is set
+UDP_CONTROL_PORT = int(os.environ.get("KSCALE_UDP_CONTROL_PORT", "0"))
+# host:port the servers' control loop sends each tick's command to; unset, the loop only measures
+CONTROL_TARGET = os.environ.get("KSCALE_CONTROL_TARGET", "")
+# "binary" control frames for a robot-side consumer, "json" (SimUDP shape) for a simulator
+CONTROL_FORMAT = os.environ.get("KSCALE_CONTROL_FORMAT", "binary")
+
+MAX_DATAGRAM = 2048
+MAX_BATCH = 256  # datagrams drained per wakeup before yielding to the loop
+RECV_BUFFER = 1 << 20
+REPORT_INTERVAL = 10.0
+
+
+def kernel_drops(port):
+    """Datagrams the kernel dropped for our UDP port (receive buffer full), from /proc/net/udp."""
+    drops = 0
+    for path in ("/proc/net/udp", "/proc/net/udp6"):
+        try:
+            with open(path) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if int(fields[1].rsplit(":", 1)[1], 16) == port:
+                        drops += int(fields[-1])
+        except (OSError, ValueError, IndexError):
+            pass
+    return drops
+
+
+class CommandReceiver:
+    """Non-blocking UDP socket drained in batches on each readable wakeup.
+
+    One recv_into() per datagram into a reused buffer; binary frames go to
+    the dispatcher without a copy, JSON is decoded from the filled slice.
+    A datagram that can't be decoded or whose handlers raise is counted and
+    skipped, and the rest of the batch is still drained.
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.buffer = bytearray(MAX_DATAGRAM)
+        self.view = memoryview(self.buffer)
+        self.sock = None
+        self.port = 0
+        self.datagrams = 0
+        self.wakeups = 0
+        self.max_batch = 0
+        self.errors = 0
+
+    def listen(self, loop, host, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        loop.add_reader(self.sock.fileno(), self.on_readable)
+        print(f"UDP control listening on {host}:{self.port}")
+        return self
+
+    def on_readable(self):
+        self.wakeups += 1
+        batch = 0
+        while batch < MAX_BATCH:
+            try:
+                n = self.sock.recv_into(self.buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            batch += 1
+            try:
+                if n and self.buffer[0] in (FRAME_VERSION, POSE_VERSION):
+                    self.dispatcher.dispatch_bytes(self.view[:n])
+                else:
+                    self.dispatcher.dispatch_json(str(self.view[:n], "utf-8"))
+            except UnicodeDecodeError:
+                self.dispatcher.rejected += 1
+            except Exception as e:
+                if not self.errors:
+                    print(f"UDP control: error handling datagram: {e!r}")
+                self.errors += 1
+        self.datagrams += batch
+        self.max_batch = max(self.max_batch, batch)
+
+    def stats(self):
+        return {"datagrams": self.datagrams, "wakeups": self.wakeups, "max_batch": self.max_batch,
+                "decoded": self.dispatcher.decoded, "rejected": self.dispatcher.rejected, "errors": self.errors,
+                "kernel_dropped": kernel_drops(self.port)}
+
+
+def control_output(target=CONTROL_TARGET, fmt=CONTROL_FORMAT):
+    """The ControlLoop actuate callback for KSCALE_CONTROL_TARGET, or None when it isn't set."""
+    if not target:
+        return None
+    host, port = target.rsplit(":", 1)
+    print(f"Control output to {target} as {fmt}")
+    return Forwarder((host, int(port)), fmt)
+
+
+class Forwarder:
+    """ControlLoop actuate callback that sends each tick's command as one datagram."""
+
+    def __init__(self, target, fmt):
+        self.target = target
+        self.fmt = fmt
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.seq = 0
+        self.sent = 0
+        self.errors = 0
+
+    def __call__(self, x, y, z, motion, flags):
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        if self.fmt == "binary":
+            data = encode_frame(self.seq, x, y, z, MOTIONS[motion] if motion < len(MOTIONS) else None, flags)
+        elif flags & FLAG_RESET:
+            # The loop passes a reset on for one tick only
+            data = json.dumps({"vector": [0, 0, 0], "motion": None, "reset": True}).encode()
+        else:
+            # Inverse of the SimUDP mapping in ControlDispatcher.dispatch_json
+            data = json.dumps({"Xvel": y, "Yvel": -x, "YawRate": -z,
+                               "motion": MOTIONS[motion] if motion < len(MOTIONS) else None}).encode()
+        try:
+            self.sock.sendto(data, self.target)
+            self.sent += 1
+        except OSError:
+            self.errors += 1
+
+
+async def report(receiver, loop_, forwarder):
+    last = time.monotonic()
+    last_datagrams = last_sent = 0
+    while True:
+        await asyncio.sleep(REPORT_INTERVAL)
+        now = time.monotonic()
+        elapsed = now - last
+        stats = receiver.stats()
+        stats.update(
+            receive_hz=round((receiver.datagrams - last_datagrams) / elapsed, 1),
+            forward_hz=round((forwarder.sent - last_sent) / elapsed, 1),
+            send_errors=forwarder.errors,
+            stale_dropped=loop_.mailbox.stale_dropped,
+            timeouts=loop_.timeouts,
+        )
+        print("UDP bridge:", json.dumps(stats))
+        last, last_datagrams, last_sent = now, receiver.datagrams, forwarder.sent
+
+
+async def main(args):
+    host, port = args.target.rsplit(":", 1)
+    forwarder = Forwarder((host, int(port)), "binary" if args.to == "robot" else "json")
+    # SimUDP only sends on change, so by default hold the last command instead of timing out
+    deadline = args.deadline if args.deadline > 0 else float("inf")
+    control_loop = ControlLoop(actuate=forwarder, rate_hz=args.rate, deadline=deadline, report_interval=0)
+    # Still let a restarted sender's lower sequence numbers through
+    control_loop.mailbox.deadline = COMMAND_DEADLINE
+    dispatcher = ControlDispatcher()
+    control_loop.attach(dispatcher)
+    receiver = CommandReceiver(dispatcher).listen(asyncio.get_running_loop(), "0.0.0.0", args.listen)
+    control_loop.start()
+    print(f"Forwarding to {args.target} as {forwarder.fmt} at {args.rate:.0f} Hz")
+    await report(receiver, control_loop, forwarder)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listen", type=int, default=8765, help="UDP port SimUDP.tsx sends to")
+    parser.add_argument("--to", choices=["sim", "robot"], default="sim")
+    parser.add_argument("--target", default="127.0.0.1:9000", help="host:port to forward to")
+    parser.add_argument("--rate", type=float, default=50.0, help="forwarding rate in Hz")
+    parser.add_argument("--deadline", type=float, default=0.0,
+                        help="seconds without input before decaying to a stop (0 = hold the last command)")
+    asyncio.run(main(parser.parse_args()))
@@ -151,7 +151,7 @@ function ControllerScreen({ navigation, route }: ControllerScreenProps) {
       
       {/* VideoScreen component - handles WebRTC setup */}
       {!simulate ? (
-        <VideoScreen setStream={setStream} vector={vector} setIsConnected={setIsConnected} setLocalStream={setLocalStream} call={call} signalingUrl={robot.ip} />
+        <VideoScreen setStream={setStream} vector={vector} setIsConnected={setIsConnected} setLocalStream={setLocalStream} call={call} signalingUrl={robot.ip} payload={payload} simStop={simStop} />
       ) : (
         <SimUDP vector={vector} payload={payload} simStop={simStop} />
       )}
@@ -160,7 +160,7 @@ function ControllerScreen({ navigation, route }: ControllerScreenProps) {
       
       {/* VideoScreen component - handles WebRTC setup */}
       {!simulate ? (
-        <VideoScreen setStreamLeft={setStreamLeft} setStreamRight={setStreamRight} vector={vector} setIsConnected={setIsConnected} setLocalStream={setLocalStream} call={call} signalingUrl={robot.ip} />
+        <VideoScreen setStreamLeft={setStreamLeft} setStreamRight={setStreamRight} vector={vector} setIsConnected={setIsConnected} setLocalStream={setLocalStream} call={call} signalingUrl={robot.ip} payload={payload} simStop={simStop} />
       ) : (
         <SimUDP vector={vector} payload={payload} simStop={simStop} />
       )}
@@ -0,0 +1,121 @@
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+import vid
+from vid import AssetCache, write_json
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+CHUNK = 1024
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serves DATA at any path, honouring single byte ranges unless the server says otherwise."""
+
+    def do_HEAD(self):
+        if not self.server.head:
+            self.send_error(501)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(DATA)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get("Range"))
+        byte_range = self.headers.get("Range")
+        if byte_range and self.server.ranges:
+            start, end = (int(v) for v in byte_range.split("=", 1)[1].split("-"))
+            body = DATA[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        else:
+            body = DATA
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.daemon_threads = True
+    httpd.head = True
+    httpd.ranges = True
+    httpd.requests = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/video.mp4"
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def cache(tmp_path):
+    return AssetCache(str(tmp_path), jobs=2, chunk_size=CHUNK)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download_in_chunks_and_link(server, tmp_path):
+    path = cache(tmp_path).fetch("video.mp4", server.url)
+    assert read(path) == DATA
+    assert len(server.requests) == len(DATA) // CHUNK
+    manifest = vid.read_json(os.path.join(tmp_path, "manifest.json"), {})
+    assert manifest["video.mp4"]["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_resume_fetches_only_missing_chunks(server, tmp_path):
+    c = cache(tmp_path)
+    part = os.path.join(c.partial, hashlib.sha256(server.url.encode()).hexdigest()[:32] + ".part")
+    with open(part, "wb") as f:
+        f.write(DATA[:3 * CHUNK])
+    write_json(part + ".json", {"url": server.url, "size": len(DATA), "validator": '"v1"', "done": [0, 1, 2]})
+    path = c.fetch("video.mp4", server.url)
+    assert read(path) == DATA
+    assert f"bytes=0-{CHUNK - 1}" not in server.requests
+    assert len(server.requests) == len(DATA) // CHUNK - 3
+    assert not os.path.exists(part + ".json")
+
+
+def test_checksum_mismatch_is_an_error(server, tmp_path):
+    c = cache(tmp_path)
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        c.fetch("video.mp4", server.url, sha256="0" * 64)
+    assert os.listdir(c.objects) == [] and os.listdir(c.partial) == []
+    assert not os.path.exists(os.path.join(tmp_path, "video.mp4"))
+
+
+def test_cache_hit_makes_no_requests(server, tmp_path):
+    cache(tmp_path).fetch("video.mp4", server.url)
+    server.requests.clear()
+    path = cache(tmp_path).fetch("video.mp4", server.url)
+    assert read(path) == DATA
+    assert server.requests == []
+
+
+def test_falls_back_to_one_get_without_head(server, tmp_path):
+    server.head = False
+    path = cache(tmp_path).fetch("video.mp4", server.url)
+    assert read(path) == DATA
+    assert server.requests == [None]
+
+
+def test_falls_back_to_one_get_when_range_is_ignored(server, tmp_path):
+    server.ranges = False
+    c = cache(tmp_path)
+    path = c.fetch("video.mp4", server.url)
+    assert read(path) == DATA
+    assert server.requests[-1] is None
+    assert os.listdir(c.partial) == []
@@ -0,0 +1,35 @@
+// Binary control frame sent on the robot data channel.
+// Layout must stay in sync with pi/control_frames.py (little endian, 28 bytes):
+//   u8 version, u8 motion, u16 flags, u32 seq, f64 timestamp (ms), f32 x, y, z
+
+export const FRAME_VERSION = 1;
+export const FRAME_SIZE = 28;
+export const FLAG_RESET = 0x1;
+
+const MOTIONS: (string | null)[] = [null, 'boxing', 'salute', 'zombie_walk'];
+
+export interface ControlVector {
+  x: number;
+  y: number;
+  z: number;
+}
+
+export function encodeControlFrame(
+  seq: number,
+  vector: ControlVector,
+  motion: string | null = null,
+  flags: number = 0,
+): ArrayBuffer {
+  const buffer = new ArrayBuffer(FRAME_SIZE);
+  const view = new DataView(buffer);
+  const motionId = motion ? Math.max(MOTIONS.indexOf(motion), 0) : 0;
+  view.setUint8(0, FRAME_VERSION);
+  view.setUint8(1, motionId);
+  view.setUint16(2, flags, true);
+  view.setUint32(4, seq >>> 0, true);
+  view.setFloat64(8, Date.now(), true);
+  view.setFloat32(16, vector.x, true);
+  view.setFloat32(20, vector.y, true);
+  view.setFloat32(24, vector.z, true);
+  return buffer;
+}
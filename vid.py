@@ -1,55 +1,285 @@
+"""Benchmark media, fetched once per board into a content-addressed cache under ~/videos.
+
+Downloads are split into CHUNK_SIZE pieces fetched in parallel with HTTP
+Range requests and written in place into a preallocated .part file; a
+small state file next to it records finished chunks, so an interrupted
+download resumes where it stopped. Servers that refuse HEAD or ignore
+Range get a single plain GET instead. Finished files are checked (size,
+then SHA-256 against ASSETS or the manifest) and stored as
+~/videos/.objects/<sha256>, with ~/videos/<name> linked to it and
+~/videos/manifest.json recording name, url, size and hash. Every run
+re-verifies the cached file, so a truncated or corrupted input is fetched
+again instead of being benchmarked.
+
+    python3 vid.py                                # default assets
+    python3 vid.py --url http://127.0.0.1:5000/video.mp4 --name video.mp4 --dir /tmp/videos
+"""
+import argparse
+import hashlib
+import json
 import os
+import shutil
 import sys
-import subprocess
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 VIDEO_URL = "https://download.blender.org/peach/bigbuckbunny_movies/BigBuckBunny_320x180.mp4"
 TARGET_DIR = os.path.expanduser("~/videos")
-TARGET_FILE = os.path.join(TARGET_DIR, "BigBuckBunny_320x180.mp4")
 
-def download_with_wget(url, target):
-    print("Trying to download with wget...")
-    try:
-        subprocess.run(["wget", "-O", target, url], check=True)
-        print("Download completed.")
-        return True
-    except subprocess.CalledProcessError:
-        print("wget download failed.")
-        return False
-
-def download_with_requests(url, target):
-    print("Downloading with requests...")
+# name -> (url, sha256). Every shipped asset should be pinned: without a hash the
+# first download is only checked against Content-Length, then trusted through the
+# manifest. fetch() prints the digest to pin whenever it stores an unpinned asset.
+ASSETS = {
+    # Not pinned yet: run vid.py on a networked board and paste the printed digest here
+    "BigBuckBunny_320x180.mp4": (VIDEO_URL, None),
+}
+
+CHUNK_SIZE = 4 * 1024 * 1024
+JOBS = 4
+READ_SIZE = 256 * 1024
+TIMEOUT = 30
+RETRIES = 3
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_json(path, data):
+    # Write then rename, so a crash never leaves a half-written manifest or state file
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+def read_json(path, default):
     try:
-        import requests
-    except ImportError:
-        print("requests module not installed.")
-        return False
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+class RangeIgnored(urllib.error.URLError):
+    """The server answered a Range request with the whole file."""
 
+def probe(url):
+    """(size or None, accepts ranges, validator) from a HEAD request; unknown size and no ranges if HEAD fails."""
+    request = urllib.request.Request(url, method="HEAD")
     try:
-        r = requests.get(url, stream=True)
-        r.raise_for_status()
-        with open(target, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-        print("Download completed.")
-        return True
-    except Exception as e:
-        print(f"Download failed: {e}")
-        return False
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            length = response.headers.get("Content-Length")
+            ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified") or ""
+            return (int(length) if length else None), ranges, validator
+    except (OSError, ValueError, urllib.error.URLError) as e:
+        print(f"HEAD {url} failed ({e}), falling back to a single GET")
+        return None, False, ""
+
+class AssetCache:
+    """Content-addressed store of downloaded assets with a JSON manifest."""
+
+    def __init__(self, root=TARGET_DIR, jobs=JOBS, chunk_size=CHUNK_SIZE):
+        self.root = root
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.objects = os.path.join(root, ".objects")
+        self.partial = os.path.join(root, ".partial")
+        self.manifest_path = os.path.join(root, "manifest.json")
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.partial, exist_ok=True)
+        self.manifest = read_json(self.manifest_path, {})
+        self.lock = threading.Lock()
+
+    def fetch(self, name, url, sha256=None):
+        """Path to a verified copy of the asset, downloading or resuming as needed."""
+        entry = self.manifest.get(name)
+        expected = sha256 or (entry["sha256"] if entry and entry["url"] == url else None)
+        if entry and (not sha256 or entry["sha256"] == sha256):
+            path = self.verified_object(entry)
+            if path:
+                print(f"{name}: cached, sha256 {entry['sha256'][:12]}")
+                return self.link(name, path)
+            print(f"{name}: cached copy failed verification, fetching again")
+
+        size, ranges, validator = probe(url)
+        adopted = self.adopt_existing(name, size, expected)
+        if adopted:
+            path = adopted
+        else:
+            part = self.download(url, size, ranges, validator)
+            path = self.store(part, size, expected)
+        digest = os.path.basename(path)
+        if not expected:
+            print(f"{name}: WARNING no pinned sha256, only the size was checked. "
+                  f"Pin it in ASSETS: {name!r}: ({url!r}, {digest!r})")
+        self.manifest[name] = {"url": url, "sha256": digest, "size": os.path.getsize(path)}
+        write_json(self.manifest_path, self.manifest)
+        print(f"{name}: stored, sha256 {digest[:12]}")
+        return self.link(name, path)
+
+    def verified_object(self, entry):
+        path = os.path.join(self.objects, entry["sha256"])
+        if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            return None
+        return path if sha256_file(path) == entry["sha256"] else None
+
+    def adopt_existing(self, name, size, expected):
+        """Take over a complete file left at ~/videos/<name> by an older run; drop a truncated one."""
+        path = os.path.join(self.root, name)
+        if not os.path.isfile(path) or os.path.islink(path):
+            return None
+        if size is None or os.path.getsize(path) != size:
+            print(f"{name}: existing file is incomplete, replacing it")
+            os.remove(path)
+            return None
+        digest = sha256_file(path)
+        if expected and digest != expected:
+            print(f"{name}: existing file has the wrong checksum, replacing it")
+            os.remove(path)
+            return None
+        target = os.path.join(self.objects, digest)
+        os.replace(path, target)
+        return target
+
+    def download(self, url, size, ranges, validator):
+        key = hashlib.sha256(url.encode()).hexdigest()[:32]
+        part = os.path.join(self.partial, key + ".part")
+        state_path = part + ".json"
+        state = read_json(state_path, {})
+        if state.get("size") != size or state.get("validator") != validator or not os.path.exists(part):
+            # New download, or the file changed on the server since the last attempt
+            state = {"url": url, "size": size, "validator": validator, "done": []}
+        if not size or not ranges:
+            print(f"Downloading {url} in one stream (no range support)")
+            return self.download_whole(url, part, state_path)
+
+        chunks = [(start, min(start + self.chunk_size, size) - 1) for start in range(0, size, self.chunk_size)]
+        done = set(state["done"])
+        todo = [i for i in range(len(chunks)) if i not in done]
+        if done:
+            print(f"Resuming {url}: {len(done)}/{len(chunks)} chunks already downloaded")
+        else:
+            print(f"Downloading {url}: {size} bytes in {len(chunks)} chunks, {self.jobs} at a time")
+        with open(part, "ab") as f:
+            f.truncate(size)
+        write_json(state_path, state)
+
+        def fetch_chunk(i):
+            start, end = chunks[i]
+            self.fetch_range(url, part, start, end)
+            with self.lock:
+                state["done"].append(i)
+                write_json(state_path, state)
+
+        try:
+            with ThreadPoolExecutor(self.jobs) as pool:
+                for future in [pool.submit(fetch_chunk, i) for i in todo]:
+                    future.result()
+        except RangeIgnored:
+            print(f"{url} ignored the Range header, downloading in one stream")
+            return self.download_whole(url, part, state_path)
+        os.remove(state_path)
+        return part
+
+    def download_whole(self, url, part, state_path):
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        self.fetch_range(url, part, None, None)
+        return part
+
+    def fetch_range(self, url, part, start, end):
+        for attempt in range(RETRIES):
+            try:
+                request = urllib.request.Request(url)
+                if start is not None:
+                    request.add_header("Range", f"bytes={start}-{end}")
+                with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                    if start is not None and response.status == 200:
+                        raise RangeIgnored(f"expected 206 for a range, got {response.status}")
+                    if start is not None and response.status != 206:
+                        raise urllib.error.URLError(f"expected 206 for a range, got {response.status}")
+                    self.copy_response(response, part, start, end)
+                return
+            except RangeIgnored:
+                raise
+            except (OSError, urllib.error.URLError) as e:
+                if attempt == RETRIES - 1:
+                    raise
+                print(f"Retrying {'whole file' if start is None else f'bytes {start}-{end}'}: {e}")
+
+    def copy_response(self, response, part, start, end):
+        if start is None:
+            with open(part, "wb") as f:
+                shutil.copyfileobj(response, f, READ_SIZE)
+            return
+        fd = os.open(part, os.O_WRONLY)
+        try:
+            offset = start
+            while True:
+                data = response.read(READ_SIZE)
+                if not data:
+                    break
+                os.pwrite(fd, data, offset)
+                offset += len(data)
+        finally:
+            os.close(fd)
+        if offset != end + 1:
+            raise urllib.error.URLError(f"short read for bytes {start}-{end}: got {offset - start}")
+
+    def store(self, part, size, expected):
+        got = os.path.getsize(part)
+        if size is not None and got != size:
+            os.remove(part)
+            raise ValueError(f"download is {got} bytes, expected {size}")
+        digest = sha256_file(part)
+        if expected and digest != expected:
+            os.remove(part)
+            raise ValueError(f"checksum mismatch: got {digest}, expected {expected}")
+        target = os.path.join(self.objects, digest)
+        os.replace(part, target)
+        return target
+
+    def link(self, name, path):
+        # ~/videos/<name> stays where scripts expect it, as a hard link to the object (copy across filesystems)
+        target = os.path.join(self.root, name)
+        if os.path.exists(target) and os.path.samefile(target, path):
+            return target
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copyfile(path, target)
+        return target
 
 def main():
-    if not os.path.exists(TARGET_DIR):
-        os.makedirs(TARGET_DIR)
-        print(f"Created directory {TARGET_DIR}")
-
-    if os.path.exists(TARGET_FILE):
-        print(f"File already exists at {TARGET_FILE}")
-        return
-
-    if not download_with_wget(VIDEO_URL, TARGET_FILE):
-        if not download_with_requests(VIDEO_URL, TARGET_FILE):
-            print("Failed to download video file. Please download manually.")
-            sys.exit(1)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", default=TARGET_DIR, help="cache directory")
+    parser.add_argument("--url", help="fetch this URL instead of the default assets")
+    parser.add_argument("--name", help="file name for --url (default: last path segment)")
+    parser.add_argument("--sha256", help="expected checksum for --url")
+    parser.add_argument("--jobs", type=int, default=JOBS, help="parallel range requests")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_SIZE / 1024 / 1024)
+    args = parser.parse_args()
+
+    if args.url:
+        assets = {args.name or args.url.rsplit("/", 1)[-1]: (args.url, args.sha256)}
+    else:
+        assets = ASSETS
+    cache = AssetCache(args.dir, args.jobs, int(args.chunk_mb * 1024 * 1024))
+    failed = False
+    for name, (url, sha256) in assets.items():
+        try:
+            print(f"Ready: {cache.fetch(name, url, sha256)}")
+        except (OSError, ValueError, urllib.error.URLError) as e:
+            print(f"Failed to fetch {name}: {e}. Please download manually.")
+            failed = True
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,138 @@
+"""Requests per second and time to first byte: https_server.py against the plain
+HTTPServer + SimpleHTTPRequestHandler setup it replaced.
+
+Both servers run in this process on ephemeral ports, serving a temporary
+copy of index.html plus a generated media file. --clients threads each make
+--requests requests to each path; the new server is reused over keep-alive,
+the old one gets a fresh (TLS) connection per request because it only
+speaks HTTP/1.0. With --stall N an extra client opens a connection and
+sends nothing for N seconds; the old server's accept loop is stuck in that
+TLS handshake the whole time, which shows up in its time to first byte.
+
+    python3 webxr_demo/bench_server.py --clients 8 --requests 200
+"""
+import argparse
+import http.client
+import http.server
+import json
+import os
+import shutil
+import socket
+import ssl
+import statistics
+import tempfile
+import threading
+import time
+
+from https_server import MyHandler, generate_cert_if_needed, get_ssl_context, make_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLIENT_TIMEOUT = 5.0
+
+
+class LegacyHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def legacy_server(address, directory):
+    """The server as it was: single-threaded, handshake in accept(), no caching."""
+    handler = lambda *args: LegacyHandler(*args, directory=directory)
+    httpd = http.server.HTTPServer(address, handler)
+    httpd.socket = get_ssl_context("cert.pem", "key.pem").wrap_socket(httpd.socket, server_side=True)
+    return httpd
+
+
+def summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {"n": len(values), "mean": round(statistics.fmean(values), 3),
+            "p50": round(values[len(values) // 2], 3), "p99": round(values[int(len(values) * 0.99)], 3)}
+
+
+def client(port, paths, requests, headers, results):
+    context = ssl._create_unverified_context()
+    conn = http.client.HTTPSConnection("127.0.0.1", port, context=context, timeout=CLIENT_TIMEOUT)
+    for i in range(requests):
+        path = paths[i % len(paths)]
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            first_byte = time.perf_counter()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            results["errors"] += 1
+            conn.close()
+            continue
+        results["ttfb_ms"].append((first_byte - start) * 1000)
+        results["bytes"] += len(body)
+    conn.close()
+
+
+def stall(port, seconds):
+    # Connects and sends nothing, so the server waits for a ClientHello until we hang up
+    sock = socket.create_connection(("127.0.0.1", port))
+    time.sleep(seconds)
+    sock.close()
+
+
+def run(name, httpd, args, paths, headers):
+    port = httpd.server_address[1]
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    if args.stall:
+        threading.Thread(target=stall, args=(port, args.stall), daemon=True).start()
+        time.sleep(0.2)
+    results = [{"ttfb_ms": [], "bytes": 0, "errors": 0} for _ in range(args.clients)]
+    threads = [threading.Thread(target=client, args=(port, paths, args.requests, headers, r)) for r in results]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    httpd.shutdown()
+    httpd.server_close()
+    ttfb = [v for r in results for v in r["ttfb_ms"]]
+    return {
+        "server": name,
+        "requests": len(ttfb),
+        "errors": sum(r["errors"] for r in results),
+        "requests_per_second": round(len(ttfb) / elapsed, 1),
+        "megabytes_per_second": round(sum(r["bytes"] for r in results) / elapsed / 1e6, 2),
+        "ttfb_ms": summarize(ttfb),
+    }
+
+
+def main(args):
+    os.chdir(HERE)
+    generate_cert_if_needed()
+    directory = tempfile.mkdtemp(prefix="kscale-static-")
+    try:
+        shutil.copy(os.path.join(HERE, "index.html"), directory)
+        with open(os.path.join(directory, "media.bin"), "wb") as f:
+            f.write(os.urandom(int(args.media_mb * 1e6)))
+        paths = ["/", "/index.html"] + (["/media.bin"] if args.media_mb else [])
+        headers = {"Range": args.range} if args.range else {}
+        servers = [("https_server", lambda: make_server(("127.0.0.1", 0), directory))]
+        if not args.new_only:
+            servers.insert(0, ("legacy", lambda: legacy_server(("127.0.0.1", 0), directory)))
+        MyHandler.quiet = True
+        report = [run(name, factory(), args, paths, headers) for name, factory in servers]
+        report[-1]["cache"] = {"hits": MyHandler.cache.hits, "misses": MyHandler.cache.misses}
+        print(json.dumps(report, indent=2))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--media-mb", type=float, default=4.0, help="size of the generated media file (0 = none)")
+    parser.add_argument("--range", default="", help='Range header to send, e.g. "bytes=0-65535"')
+    parser.add_argument("--stall", type=float, default=0.0,
+                        help="hold one connection open this many seconds without handshaking")
+    parser.add_argument("--new-only", action="store_true", help="skip the legacy server")
+    main(parser.parse_args())
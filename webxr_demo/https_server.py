@@ -1,32 +1,218 @@
+import argparse
+import email.utils
 import http.server
-import ssl
 import os
+import ssl
+import sys
+import threading
+
+from pose_ingest import PoseRelay, serve_pose_socket
+
+# Files up to this size are served from memory; bigger ones (video) are streamed from disk
+CACHE_MAX_FILE = 1 << 20
+CACHE_MAX_TOTAL = 64 << 20
+# Served instead of the original when the client accepts the encoding and the file is at least as new
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+# Seconds an idle keep-alive connection is held open
+KEEPALIVE_TIMEOUT = 30
 
 def get_ssl_context(certfile, keyfile):
     context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
     context.load_cert_chain(certfile, keyfile)
     context.set_ciphers("@SECLEVEL=1:ALL")
+    # Kernel TLS lets sendfile stay zero-copy over HTTPS where Python and OpenSSL support it
+    context.options |= getattr(ssl, "OP_ENABLE_KTLS", 0)
     return context
 
+def parse_range(header, size):
+    """(start, end) for a single "bytes=" range, None if unsatisfiable, () to ignore it and send everything."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return ()
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return ()
+    if start >= size or start > end:
+        return None
+    return start, end
+
+class AssetCache:
+    """Contents of small files keyed by path, reused while mtime and size are unchanged."""
+
+    def __init__(self, max_file=CACHE_MAX_FILE, max_total=CACHE_MAX_TOTAL):
+        self.max_file = max_file
+        self.max_total = max_total
+        self.entries = {}  # path -> (mtime_ns, size, bytes)
+        self.total = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, st):
+        entry = self.entries.get(path)
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        with open(path, "rb") as f:
+            data = f.read()
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old:
+                self.total -= len(old[2])
+            # Oldest entries go first once the cache is full
+            while self.entries and self.total + len(data) > self.max_total:
+                self.total -= len(self.entries.pop(next(iter(self.entries)))[2])
+            self.entries[path] = (st.st_mtime_ns, st.st_size, data)
+            self.total += len(data)
+        return data
+
 class MyHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files with keep-alive, an in-memory cache, Range requests and precompressed variants.
+
+    Small files come from AssetCache; large ones are sent with
+    socket.sendfile, which is zero-copy on plain HTTP (and kTLS) and a
+    chunked read/send loop over regular TLS, so they are never held in
+    memory whole.
+    """
+
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    cache = AssetCache()
+    quiet = False
+    pose_relay = None
+
+    def setup(self):
+        # The TLS handshake runs here, on the connection's own thread, not in the accept loop
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.settimeout(self.timeout)
+            self.request.do_handshake()
+        super().setup()
+
     def do_GET(self):
-        # Let SimpleHTTPRequestHandler handle all GET requests for static files
-        return super().do_GET()
-    
+        if self.pose_relay and self.path.split("?", 1)[0] == "/pose":
+            serve_pose_socket(self, self.pose_relay)
+            return
+        self.serve_file(send_body=True)
+
+    def do_HEAD(self):
+        self.serve_file(send_body=False)
+
+    def serve_file(self, send_body):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index = os.path.join(path, "index.html")
+            if not self.path.split("?", 1)[0].endswith("/") or not os.path.isfile(index):
+                # Redirects and directory listings are left to SimpleHTTPRequestHandler
+                return super().do_GET() if send_body else super().do_HEAD()
+            path = index
+        range_header = self.headers.get("Range")
+        encoding, served = (None, path) if range_header else self.precompressed(path)
+        try:
+            st = os.stat(served)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        data = self.cache.get(served, st) if st.st_size <= self.cache.max_file else None
+        size = len(data) if data is not None else st.st_size
+        status, start, end = 200, 0, size - 1
+        if range_header:
+            byte_range = parse_range(range_header, size)
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if byte_range:
+                status, (start, end) = 206, byte_range
+        length = max(end - start + 1, 0)
+
+        self.send_response(status)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(length))
+        self.send_header("Last-Modified", email.utils.formatdate(st.st_mtime, usegmt=True))
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if not send_body or not length:
+            return
+        if data is not None:
+            self.wfile.write(memoryview(data)[start:end + 1])
+        else:
+            with open(served, "rb") as f:
+                self.connection.sendfile(f, start, length)
+
+    def precompressed(self, path):
+        accepted = {token.split(";", 1)[0].strip() for token in self.headers.get("Accept-Encoding", "").split(",")}
+        for encoding, suffix in PRECOMPRESSED:
+            if encoding not in accepted:
+                continue
+            try:
+                if os.stat(path + suffix).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                    return encoding, path + suffix
+            except OSError:
+                continue
+        return None, path
+
     def do_POST(self):
         content_length = int(self.headers["Content-Length"])
         post_data = self.rfile.read(content_length)
-        print("POST data received:", post_data.decode("utf-8"))
-        
+        if not self.quiet:
+            print("POST data received:", post_data.decode("utf-8", "replace"))
+
         # Send a simple response
+        body = b'POST received successfully'
         self.send_response(200)
         self.send_header('Content-type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(b'POST received successfully')
+        self.wfile.write(body)
 
     def log_message(self, format, *args):
         # Custom logging to show what files are being served
-        print(f"[{self.address_string()}] {format % args}")
+        if not self.quiet:
+            print(f"[{self.address_string()}] {format % args}")
+
+class StaticServer(http.server.ThreadingHTTPServer):
+    """One thread per connection, so a slow client or handshake only holds up itself."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Browsers drop connections (and reject the self-signed certificate) all the time
+        if isinstance(sys.exc_info()[1], (ssl.SSLError, ConnectionError, TimeoutError)):
+            return
+        super().handle_error(request, client_address)
+
+def make_server(address, directory, tls=True, certfile="cert.pem", keyfile="key.pem"):
+    handler = lambda *args: MyHandler(*args, directory=directory)
+    httpd = StaticServer(address, handler)
+    if tls:
+        context = get_ssl_context(certfile, keyfile)
+        # Handshake lazily in MyHandler.setup instead of inside accept()
+        httpd.socket = context.wrap_socket(httpd.socket, server_side=True, do_handshake_on_connect=False)
+    return httpd
 
 # Auto-generate SSL certificate if it doesn't exist
 def generate_cert_if_needed():
@@ -35,24 +221,42 @@ def generate_cert_if_needed():
         os.system('openssl req -x509 -newkey rsa:2048 -keyout key.pem -out cert.pem -days 365 -nodes -subj "/C=US/ST=State/L=City/O=LocalDev/CN=localhost"')
         print("Certificate generated successfully!")
 
-# Generate certificate if needed
-generate_cert_if_needed()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--directory", default=os.getcwd())
+    parser.add_argument("--no-tls", action="store_true",
+                        help="plain HTTP (localhost is still a secure context for WebXR); sendfile is zero-copy")
+    parser.add_argument("--quiet", action="store_true", help="don't log every request")
+    parser.add_argument("--pose-target", default="",
+                        help="host:port of the robot's KSCALE_UDP_CONTROL_PORT to forward headset poses to")
+    args = parser.parse_args()
+    MyHandler.quiet = args.quiet
+    target = None
+    if args.pose_target:
+        host, port = args.pose_target.rsplit(":", 1)
+        target = (host, int(port))
+    MyHandler.pose_relay = PoseRelay(target).start()
+
+    # Generate certificate if needed
+    if not args.no_tls:
+        generate_cert_if_needed()
 
-# Server configuration
-server_address = ("127.0.0.1", 5000)
-print(f"Starting HTTPS server on https://{server_address[0]}:{server_address[1]}")
-print(f"Serving files from: {os.getcwd()}")
+    # Server configuration
+    server_address = (args.host, args.port)
+    scheme = "http" if args.no_tls else "https"
+    print(f"Starting {scheme.upper()} server on {scheme}://{server_address[0]}:{server_address[1]}")
+    print(f"Serving files from: {args.directory}")
 
-# Create and configure server
-httpd = http.server.HTTPServer(server_address, MyHandler)
-context = get_ssl_context("cert.pem", "key.pem")
-httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+    # Create and configure server
+    httpd = make_server(server_address, args.directory, tls=not args.no_tls)
 
-print("Server ready! Visit https://127.0.0.1:5000")
-print("Press Ctrl+C to stop the server")
+    print(f"Server ready! Visit {scheme}://{server_address[0]}:{server_address[1]}")
+    print("Press Ctrl+C to stop the server")
 
-try:
-    httpd.serve_forever()
-except KeyboardInterrupt:
-    print("\nServer stopped.")
-    httpd.server_close()
\ No newline at end of file
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+        httpd.server_close()
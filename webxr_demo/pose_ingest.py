@@ -0,0 +1,231 @@
+"""Headset pose ingest for https_server.py: a WebSocket endpoint and a latest-wins relay.
+
+The page streams one 44 byte binary frame per rendered XR frame over a
+single WebSocket (/pose) instead of POSTing each sample. PoseRelay keeps
+only the newest pose per source and a forwarder thread sends whatever is
+newest when it wakes up, so a slow hop drops intermediate poses instead of
+queueing them. Poses go by UDP to the robot's KSCALE_UDP_CONTROL_PORT,
+where they enter the same ControlDispatcher as the WebRTC data channel,
+and/or to a local consumer callback.
+
+The frame layout (POSE) and the stats helpers are imported from pi/, so
+the demo and the robot can't drift apart.
+"""
+import base64
+import hashlib
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+# The pose wire format and stats helpers live in pi/ of the same checkout
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "pi"))
+from control_frames import POSE, POSE_SIZE, POSE_VERSION
+from control_loop import RollingStats, seq_newer
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+# Pose frames are tiny; anything much bigger is not a pose
+MAX_MESSAGE = 64 * 1024
+REPORT_INTERVAL = 10.0
+# After this long without a pose from a source, any sequence number is accepted (the page reloaded)
+STALE_RESET = 0.25
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def read_exact(rfile, n):
+    data = rfile.read(n)
+    if len(data) != n:
+        raise ConnectionError("WebSocket closed mid-frame")
+    return data
+
+
+def read_message(rfile):
+    """(opcode, payload) for the next client message, reassembling fragments."""
+    opcode, payload = None, b""
+    while True:
+        b0, b1 = read_exact(rfile, 2)
+        length = b1 & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", read_exact(rfile, 2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", read_exact(rfile, 8))[0]
+        if length > MAX_MESSAGE:
+            raise ConnectionError("WebSocket message too large")
+        mask = read_exact(rfile, 4) if b1 & 0x80 else None
+        data = read_exact(rfile, length)
+        if mask:
+            data = bytes(b ^ mask[i & 3] for i, b in enumerate(data))
+        frame_opcode = b0 & 0x0F
+        if frame_opcode >= 0x8:
+            # Control frames may arrive between fragments
+            return frame_opcode, data
+        if frame_opcode:
+            opcode = frame_opcode
+        payload += data
+        if b0 & 0x80:
+            return opcode, payload
+
+
+def write_message(wfile, opcode, payload=b""):
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 1 << 16:
+        header += bytes([126]) + struct.pack(">H", len(payload))
+    else:
+        header += bytes([127]) + struct.pack(">Q", len(payload))
+    wfile.write(header + payload)
+
+
+class PoseRelay:
+    """Latest-wins slot per pose source, drained by one forwarder thread.
+
+    put() runs on the WebSocket connection threads and never blocks on the
+    forwarding hop; every counter those threads share is updated under
+    lock. Stale poses (sequence number not newer than the one held) are
+    dropped on arrival; poses replaced before the forwarder got to them are
+    counted as superseded.
+
+    Latency is reported per hop: headset to this server (wall clocks, so
+    only meaningful with synced clocks) and arrival here to forwarded.
+    """
+
+    def __init__(self, target=None, consumer=None):
+        self.target = target
+        self.consumer = consumer
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if target else None
+        self.last_seq = {}  # source -> (newest sequence number accepted, arrival monotonic)
+        self.pending = {}  # source -> (payload, arrival monotonic) not yet forwarded
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.received = 0
+        self.forwarded = 0
+        self.rejected = 0
+        self.stale = 0
+        self.superseded = 0
+        self.send_errors = 0
+        self.consumer_errors = 0
+        self.connections = 0
+        self.ingest_ms = RollingStats()
+        self.relay_ms = RollingStats()
+
+    def start(self):
+        threading.Thread(target=self.forward, name="pose-forwarder", daemon=True).start()
+        threading.Thread(target=self.report, name="pose-report", daemon=True).start()
+        where = f"udp://{self.target[0]}:{self.target[1]}" if self.target else "local consumer only"
+        print(f"Pose ingest on /pose, forwarding to {where}")
+        return self
+
+    def add_connection(self, delta):
+        with self.lock:
+            self.connections += delta
+
+    def reject(self):
+        with self.lock:
+            self.rejected += 1
+
+    def put(self, payload):
+        if len(payload) != POSE_SIZE or payload[0] != POSE_VERSION:
+            self.reject()
+            return False
+        now = time.monotonic()
+        _, source, _, seq, sender_ms = POSE.unpack_from(payload)[:5]
+        ingest_ms = time.time() * 1000 - sender_ms
+        with self.lock:
+            self.ingest_ms.add(ingest_ms)
+            self.received += 1
+            last = self.last_seq.get(source)
+            if last is not None and not seq_newer(seq, last[0]) and now - last[1] < STALE_RESET:
+                self.stale += 1
+                return False
+            self.last_seq[source] = (seq, now)
+            if source in self.pending:
+                self.superseded += 1
+            self.pending[source] = (payload, now)
+        self.wakeup.set()
+        return True
+
+    def forward(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                self.wakeup.clear()
+                pending, self.pending = self.pending, {}
+            for payload, arrived in pending.values():
+                if self.sock:
+                    try:
+                        self.sock.sendto(payload, self.target)
+                    except OSError:
+                        self.send_errors += 1
+                        continue
+                if self.consumer:
+                    try:
+                        self.consumer(POSE.unpack(payload))
+                    except Exception as e:
+                        # A bad consumer must not take the forwarder (and the UDP path) down with it
+                        if not self.consumer_errors:
+                            print(f"Pose consumer failed: {e!r}")
+                        self.consumer_errors += 1
+                        continue
+                self.forwarded += 1
+                self.relay_ms.add((time.monotonic() - arrived) * 1000)
+
+    def stats(self):
+        return {"connections": self.connections, "received": self.received, "forwarded": self.forwarded,
+                "stale": self.stale, "superseded": self.superseded, "rejected": self.rejected,
+                "send_errors": self.send_errors, "consumer_errors": self.consumer_errors,
+                "headset_to_server_ms": self.ingest_ms.summary(),
+                "server_to_forward_ms": self.relay_ms.summary()}
+
+    def report(self):
+        last_received = last_forwarded = 0
+        while True:
+            time.sleep(REPORT_INTERVAL)
+            if self.received == last_received:
+                continue
+            stats = self.stats()
+            stats["ingest_hz"] = round((self.received - last_received) / REPORT_INTERVAL, 1)
+            stats["forward_hz"] = round((self.forwarded - last_forwarded) / REPORT_INTERVAL, 1)
+            print("Pose relay:", stats)
+            last_received, last_forwarded = self.received, self.forwarded
+
+
+def serve_pose_socket(handler, relay):
+    """Upgrade a GET /pose request on an http.server handler and read pose frames until it closes."""
+    key = handler.headers.get("Sec-WebSocket-Key")
+    if not key or "websocket" not in handler.headers.get("Upgrade", "").lower():
+        handler.send_error(426, "Upgrade to WebSocket required")
+        return
+    handler.send_response(101, "Switching Protocols")
+    handler.send_header("Upgrade", "websocket")
+    handler.send_header("Connection", "Upgrade")
+    handler.send_header("Sec-WebSocket-Accept", accept_key(key))
+    handler.end_headers()
+    handler.close_connection = True
+    # Poses are small and time critical; don't let Nagle hold pongs back
+    handler.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # Unlike keep-alive HTTP, a pose stream may legitimately go quiet for a while
+    handler.connection.settimeout(None)
+    relay.add_connection(1)
+    try:
+        while True:
+            opcode, payload = read_message(handler.rfile)
+            if opcode == OP_BINARY:
+                relay.put(payload)
+            elif opcode == OP_PING:
+                write_message(handler.wfile, OP_PONG, payload)
+            elif opcode == OP_CLOSE:
+                write_message(handler.wfile, OP_CLOSE, payload[:2])
+                return
+            else:
+                relay.reject()
+    except (ConnectionError, OSError, ValueError):
+        return
+    finally:
+        relay.add_connection(-1)